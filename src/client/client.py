@@ -1,11 +1,16 @@
 from os.path import join
 
+import time
+
 import yaml
 
-from client.client_dataset_loader import DataLoader
 from client.client_file_manager import OpenYaML, get_available_models, get_model_class
-from client.client_trainer import ClientTrainer
+from server.training_spec import is_spec, loss_from_spec, optimizer_from_spec
+from utils.dataloader_args import dataloader_args_key
+from utils.benchmark_cache import benchmark_cache_key
+from utils.hardware_info import get_hardware_fingerprint, get_hardware_info
 from utils.logger import FedLogger
+from utils.tracing import start_span
 
 
 class Client:
@@ -21,14 +26,54 @@ class Client:
         self.temp_dir_path: str = temp_dir_path  # required for model dir path
         self.dataset_paths: str = dataset_paths  # required for dataset path
         self.client_info: dict = client_info
-        self.dataloader = DataLoader()
+        self.client_id: str = client_id
+        # optimizer state_dict per model_id, kept across rounds for specs with persist_state
+        self.optimizer_states: dict = dict()
+        self._dataloader = None
         self.train_loader, self.test_loader = None, None
         self.logger = FedLogger(id=client_id, loggername="CLIENT")
         self.dataset_id = None
+        # same hardware_info the client advertises over MQTT, used to pick the precision
+        self.hw_info: dict = get_hardware_info()
+        self.hw_fingerprint: str = get_hardware_fingerprint(self.hw_info)
+
+    @property
+    def dataloader(self):
+        # torch is imported with the first training or validation request
+        if self._dataloader is None:
+            from client.client_dataset_loader import DataLoader
+
+            self._dataloader = DataLoader()
+        return self._dataloader
 
     def StreamFile(self):
         pass
 
+    def set_training_spec(self, trainer, model_id, loss_function, optimizer) -> None:
+        """Builds the loss function and optimizer the server sent as specs for the
+        model of "trainer"; pickled ones were already passed to the trainer."""
+        if is_spec(loss_function):
+            build_time = time.time()
+            trainer.set_loss_function(loss_from_spec(self.client_id, loss_function))
+            self.logger.info(
+                "fedclient.loss_function.spec.build.time",
+                f"{model_id},{time.time() - build_time}",
+            )
+        if is_spec(optimizer):
+            build_time = time.time()
+            state_dict = None
+            if optimizer.get("persist_state"):
+                state_dict = self.optimizer_states.get(model_id)
+            trainer.set_optimizer(
+                optimizer_from_spec(
+                    self.client_id, optimizer, trainer.model.parameters(), state_dict
+                )
+            )
+            self.logger.info(
+                "fedclient.optimizer.spec.build.time",
+                f"{model_id},{time.time() - build_time}",
+            )
+
     def Benchmark(
         self,
         model_id: str,
@@ -42,6 +87,8 @@ class Client:
         timeout_duration_s: float = None,
         max_mini_batches: int = None,
     ):
+        from client.client_trainer import ClientTrainer
+
         model_dir_path: str = join(self.temp_dir_path, "model_cache", model_id)
         model_hash: str = get_available_models(self.temp_dir_path)[model_id]
 
@@ -59,6 +106,12 @@ class Client:
         custom_trainer_args = model_config["custom_trainer_args"]
         use_custom_dataloader = model_config["use_custom_dataloader"]
         custom_dataloader_args = model_config["custom_loader_args"]
+        dataloader_args = model_config.get("dataloader_args")
+        use_fast_trainer = model_config.get("use_fast_trainer", False)
+        fast_trainer_args = model_config.get("fast_trainer_args")
+        precision = model_config.get("precision", "fp32")
+        channels_last = model_config.get("channels_last", False)
+        compile_mode = model_config.get("compile_mode")
         model_args = model_config["model_args"]
 
         dataset_path: str = self.dataset_paths[dataset_id]
@@ -73,8 +126,17 @@ class Client:
                 use_custom_trainer=use_custom_trainer,
                 custom_trainer_args=custom_trainer_args,
                 model_args=model_args,
+                use_fast_trainer=use_fast_trainer,
+                fast_trainer_args=fast_trainer_args,
+                precision=precision,
+                channels_last=channels_last,
+                hw_info=self.hw_info,
+                compile_mode=compile_mode,
             )
             benchmark_trainer.model.to(self.torch_device)
+            self.set_training_spec(
+                benchmark_trainer, model_id, loss_function, optimizer
+            )
         # TODO throw exception from ClientTrainer() to handle any missing not critical arguments
         except Exception as e:
             self.logger.error("fedclient.InitBench.exception", f"{e}")
@@ -98,7 +160,9 @@ class Client:
                 train_loader,
                 test_loader,
             ) = self.dataloader.get_train_test_dataset_loaders(
-                batch_size=batch_size, dataset_path=dataset_path
+                batch_size=batch_size,
+                dataset_path=dataset_path,
+                loader_args=dataloader_args,
             )
             self.logger.debug(
                 "fedclient.InitBench.DataLoader", f"Loaded default Dataloader"
@@ -112,7 +176,29 @@ class Client:
             timeout_duration_s=timeout_duration_s,
             max_mini_batches=max_mini_batches,
         )
-        self.update_client_info(model_id, model_hash, result)
+
+        # throughput is recorded per loader setting so that settings can be compared
+        result["dataloader_setting"] = (
+            "custom" if use_custom_dataloader else dataloader_args_key(dataloader_args)
+        )
+        result["mini_batches_per_s"] = (
+            result["total_mini_batches"] / result["time_taken_s"]
+            if result["time_taken_s"]
+            else 0.0
+        )
+        result["samples_per_s"] = result["mini_batches_per_s"] * batch_size
+        result["model_hash"] = model_hash
+        if benchmark_trainer.compile_info:
+            result["compile_mode"] = benchmark_trainer.compile_info["compile_mode"]
+            result["compile_time_s"] = benchmark_trainer.compile_info.get(
+                "compile_time_s", 0.0
+            )
+            result["compile_speedup"] = benchmark_trainer.compile_info["speedup"]
+        self.logger.info(
+            "fedclient.InitBench.throughput",
+            f"{result['dataloader_setting']},{result['mini_batches_per_s']},{result['samples_per_s']}",
+        )
+        self.update_client_info(model_id, model_hash, result, dataset_id, batch_size)
 
         return result
 
@@ -131,7 +217,10 @@ class Client:
         timeout_duration_s: float = None,
         max_epochs: int = None,
         max_mini_batches: int = None,
+        span=None,
     ):
+        from client.client_trainer import ClientTrainer
+
         model_dir_path: str = join(self.temp_dir_path, "model_cache", model_id)
 
         if not model_config:
@@ -144,71 +233,94 @@ class Client:
         custom_trainer_args = model_config["custom_trainer_args"]
         use_custom_dataloader = model_config["use_custom_dataloader"]
         custom_dataloader_args = model_config["custom_loader_args"]
+        dataloader_args = model_config.get("dataloader_args")
+        use_fast_trainer = model_config.get("use_fast_trainer", False)
+        fast_trainer_args = model_config.get("fast_trainer_args")
+        precision = model_config.get("precision", "fp32")
+        channels_last = model_config.get("channels_last", False)
+        compile_mode = model_config.get("compile_mode")
         model_args = model_config["model_args"]
 
         dataset_path: str = self.dataset_paths[dataset_id]
 
-        try:
-            model_trainer = ClientTrainer(
-                temp_dir_path=self.temp_dir_path,
-                model_id=model_id,
-                model_class=model_class,
-                loss_fn=loss_function,
-                optimizer=optimizer,
-                device=self.torch_device,
-                use_custom_trainer=use_custom_trainer,
-                custom_trainer_args=custom_trainer_args,
-                model_args=model_args,
-            )
-            model_trainer.model.to(self.torch_device)
-        except Exception as e:
-            self.logger.error("fedclient.StartTraining.exception", f"{e}")
-
-        if (
-            self.train_loader is None
-            or self.test_loader is None
-            or self.dataset_id != dataset_id
-        ):
-            if use_custom_dataloader:
-                DataLoader = get_model_class(
-                    path=self.temp_dir_path,
+        with start_span("load", span):
+            try:
+                model_trainer = ClientTrainer(
+                    temp_dir_path=self.temp_dir_path,
                     model_id=model_id,
-                    class_name="CustomDataLoader",
-                )()
-                (
-                    self.train_loader,
-                    self.test_loader,
-                ) = DataLoader.get_train_test_dataset_loaders(
-                    batch_size=batch_size,
-                    dataset_path=dataset_path,
-                    args=custom_dataloader_args,
+                    model_class=model_class,
+                    loss_fn=loss_function,
+                    optimizer=optimizer,
+                    device=self.torch_device,
+                    use_custom_trainer=use_custom_trainer,
+                    custom_trainer_args=custom_trainer_args,
+                    model_args=model_args,
+                    use_fast_trainer=use_fast_trainer,
+                    fast_trainer_args=fast_trainer_args,
+                    precision=precision,
+                    channels_last=channels_last,
+                    hw_info=self.hw_info,
+                    compile_mode=compile_mode,
                 )
-                self.logger.debug(
-                    "fedclient.StartTraining.DataLoader", f"Loaded custom Dataloader"
-                )
-            else:
-                (
-                    self.train_loader,
-                    self.test_loader,
-                ) = self.dataloader.get_train_test_dataset_loaders(
-                    batch_size=batch_size, dataset_path=dataset_path
-                )
-                self.logger.debug(
-                    "fedclient.StartTraining.DataLoader", f"Loaded default Dataloader"
+                model_trainer.model.to(self.torch_device)
+                self.set_training_spec(
+                    model_trainer, model_id, loss_function, optimizer
                 )
+            except Exception as e:
+                self.logger.error("fedclient.StartTraining.exception", f"{e}")
 
-        result = model_trainer.train_model(
-            train_loader=self.train_loader,
-            test_loader=self.test_loader,
-            lr=learning_rate,
-            num_epochs=num_epochs,
-            timeout_duration_s=timeout_duration_s,
-            max_mini_batches=max_mini_batches,
-            max_epochs=max_epochs,
-            model_checkpoint=model_wts,
-        )
+            if (
+                self.train_loader is None
+                or self.test_loader is None
+                or self.dataset_id != dataset_id
+            ):
+                if use_custom_dataloader:
+                    DataLoader = get_model_class(
+                        path=self.temp_dir_path,
+                        model_id=model_id,
+                        class_name="CustomDataLoader",
+                    )()
+                    (
+                        self.train_loader,
+                        self.test_loader,
+                    ) = DataLoader.get_train_test_dataset_loaders(
+                        batch_size=batch_size,
+                        dataset_path=dataset_path,
+                        args=custom_dataloader_args,
+                    )
+                    self.logger.debug(
+                        "fedclient.StartTraining.DataLoader",
+                        f"Loaded custom Dataloader",
+                    )
+                else:
+                    (
+                        self.train_loader,
+                        self.test_loader,
+                    ) = self.dataloader.get_train_test_dataset_loaders(
+                        batch_size=batch_size,
+                        dataset_path=dataset_path,
+                        loader_args=dataloader_args,
+                    )
+                    self.logger.debug(
+                        "fedclient.StartTraining.DataLoader",
+                        f"Loaded default Dataloader",
+                    )
+
+        with start_span("train", span):
+            result = model_trainer.train_model(
+                train_loader=self.train_loader,
+                test_loader=self.test_loader,
+                lr=learning_rate,
+                num_epochs=num_epochs,
+                timeout_duration_s=timeout_duration_s,
+                max_mini_batches=max_mini_batches,
+                max_epochs=max_epochs,
+                model_checkpoint=model_wts,
+            )
 
-        model_weights = model_trainer.get_model_wts()
+            model_weights = model_trainer.get_model_wts()
+            if is_spec(optimizer) and optimizer.get("persist_state"):
+                self.optimizer_states[model_id] = model_trainer.optimizer.state_dict()
 
         return result, model_weights
 
@@ -222,7 +334,10 @@ class Client:
         batch_size: int,
         loss_function,
         optimizer,
+        span=None,
     ):
+        from client.client_trainer import ClientTrainer
+
         model_dir_path: str = join(self.temp_dir_path, "model_cache", model_id)
 
         if not model_config:
@@ -235,69 +350,113 @@ class Client:
         custom_trainer_args = model_config["custom_trainer_args"]
         use_custom_dataloader = model_config["use_custom_dataloader"]
         custom_dataloader_args = model_config["custom_loader_args"]
+        dataloader_args = model_config.get("dataloader_args")
         use_custom_validator = model_config["use_custom_validator"]
         custom_validator_args = model_config["custom_validator_args"]
+        precision = model_config.get("precision", "fp32")
+        channels_last = model_config.get("channels_last", False)
+        compile_mode = model_config.get("compile_mode")
         model_args = model_config["model_args"]
 
         dataset_path: str = self.dataset_paths[dataset_id]
-        try:
-            model_validator = ClientTrainer(
-                temp_dir_path=self.temp_dir_path,
-                model_id=model_id,
-                model_class=model_class,
-                loss_fn=loss_function,
-                optimizer=optimizer,
-                device=self.torch_device,
-                use_custom_trainer=use_custom_trainer,
-                custom_trainer_args=custom_trainer_args,
-                use_custom_validator=use_custom_validator,
-                custom_validator_args=custom_validator_args,
-                model_args=model_args,
-            )
-            model_validator.model.to(self.torch_device)
-        except Exception as e:
-            self.logger.error("fedclient.StartValidation.exception", f"{e}")
-
-        if self.train_loader is None or self.test_loader is None:
-            if use_custom_dataloader:
-                DataLoader = get_model_class(
-                    path=self.temp_dir_path,
+        with start_span("load", span):
+            try:
+                model_validator = ClientTrainer(
+                    temp_dir_path=self.temp_dir_path,
                     model_id=model_id,
-                    class_name="CustomDataLoader",
-                )()
-                (
-                    self.train_loader,
-                    self.test_loader,
-                ) = DataLoader.get_train_test_dataset_loaders(
-                    batch_size=batch_size,
-                    dataset_path=dataset_path,
-                    args=custom_dataloader_args,
+                    model_class=model_class,
+                    loss_fn=loss_function,
+                    optimizer=optimizer,
+                    device=self.torch_device,
+                    use_custom_trainer=use_custom_trainer,
+                    custom_trainer_args=custom_trainer_args,
+                    use_custom_validator=use_custom_validator,
+                    custom_validator_args=custom_validator_args,
+                    model_args=model_args,
+                    precision=precision,
+                    channels_last=channels_last,
+                    hw_info=self.hw_info,
+                    compile_mode=compile_mode,
                 )
-                self.logger.debug(
-                    "fedclient.StartValidation.DataLoader", f"Loaded custom Dataloader"
-                )
-            else:
-                (
-                    self.train_loader,
-                    self.test_loader,
-                ) = self.dataloader.get_train_test_dataset_loaders(
-                    batch_size=batch_size, dataset_path=dataset_path
-                )
-                self.logger.debug(
-                    "fedclient.StartValidation.DataLoader", f"Loaded default Dataloader"
+                model_validator.model.to(self.torch_device)
+                self.set_training_spec(
+                    model_validator, model_id, loss_function, optimizer
                 )
+            except Exception as e:
+                self.logger.error("fedclient.StartValidation.exception", f"{e}")
 
-        result = model_validator.validate_model(
-            self.test_loader, model_checkpoint=model_wts
-        )
+            if self.train_loader is None or self.test_loader is None:
+                if use_custom_dataloader:
+                    DataLoader = get_model_class(
+                        path=self.temp_dir_path,
+                        model_id=model_id,
+                        class_name="CustomDataLoader",
+                    )()
+                    (
+                        self.train_loader,
+                        self.test_loader,
+                    ) = DataLoader.get_train_test_dataset_loaders(
+                        batch_size=batch_size,
+                        dataset_path=dataset_path,
+                        args=custom_dataloader_args,
+                    )
+                    self.logger.debug(
+                        "fedclient.StartValidation.DataLoader",
+                        f"Loaded custom Dataloader",
+                    )
+                else:
+                    (
+                        self.train_loader,
+                        self.test_loader,
+                    ) = self.dataloader.get_train_test_dataset_loaders(
+                        batch_size=batch_size,
+                        dataset_path=dataset_path,
+                        loader_args=dataloader_args,
+                    )
+                    self.logger.debug(
+                        "fedclient.StartValidation.DataLoader",
+                        f"Loaded default Dataloader",
+                    )
+
+        with start_span("validate", span):
+            result = model_validator.validate_model(
+                self.test_loader, model_checkpoint=model_wts
+            )
 
         return result
 
-    def update_client_info(self, model_id, model_hash, result):
+    def update_client_info(
+        self, model_id, model_hash, result, dataset_id=None, batch_size=None
+    ):
         info = dict()
         info["num_mini_batches"] = result["total_mini_batches"]
         info["time_taken_s"] = result["time_taken_s"]
         info["model_hash"] = model_hash
+        info["dataset_id"] = dataset_id
+        info["batch_size"] = batch_size
+        info["hw_fingerprint"] = self.hw_fingerprint
+        info["timestamp"] = time.time()
+
+        previous_info = self.client_info["benchmark_info"].get(model_id)
+        loader_throughput = dict()
+        if previous_info and previous_info.get("model_hash") == model_hash:
+            loader_throughput = previous_info.get("loader_throughput", dict())
+        if "dataloader_setting" in result:
+            loader_throughput[result["dataloader_setting"]] = {
+                "mini_batches_per_s": result["mini_batches_per_s"],
+                "samples_per_s": result["samples_per_s"],
+            }
+        info["loader_throughput"] = loader_throughput
+        if "compile_mode" in result:
+            info["compile"] = {
+                "compile_mode": result["compile_mode"],
+                "compile_time_s": result["compile_time_s"],
+                "speedup": result["compile_speedup"],
+            }
         self.client_info["benchmark_info"][model_id] = info
+        # kept across sessions so the server can skip benchmarks it already has
+        self.client_info.setdefault("benchmark_cache", dict())[
+            benchmark_cache_key(model_hash, dataset_id, batch_size, self.hw_fingerprint)
+        ] = dict(info, model_id=model_id)
         with open(join(self.temp_dir_path, "client_info.yaml"), "w") as file:
             yaml.dump(self.client_info, file)
@@ -9,27 +9,38 @@ import math
 
 import torch
 
+from utils.dataloader_args import get_dataloader_kwargs
+from utils.partition_format import load_partition
+
 
 class DataLoader:
     def __init__(self):
         pass
 
-    def get_train_loader(self, batch_size=16, dataset_path=None):
-        train_dataset = torch.load(dataset_path).dataset
+    def get_train_loader(self, batch_size=16, dataset_path=None, loader_args=None):
+        train_dataset = load_partition(dataset_path)
         train_loader = torch.utils.data.DataLoader(
-            train_dataset, shuffle=True, batch_size=batch_size
+            train_dataset,
+            shuffle=True,
+            batch_size=batch_size,
+            **get_dataloader_kwargs(loader_args),
         )
         return train_loader
 
-    def get_test_loader(self, batch_size=16, dataset_path=None):
-        test_dataset = torch.load(dataset_path).dataset
+    def get_test_loader(self, batch_size=16, dataset_path=None, loader_args=None):
+        test_dataset = load_partition(dataset_path)
         test_loader = torch.utils.data.DataLoader(
-            test_dataset, shuffle=True, batch_size=batch_size
+            test_dataset,
+            shuffle=True,
+            batch_size=batch_size,
+            **get_dataloader_kwargs(loader_args),
         )
         return test_loader
 
-    def get_train_test_dataset_loaders(self, batch_size=16, dataset_path=None):
-        dataset = torch.load(dataset_path).dataset
+    def get_train_test_dataset_loaders(
+        self, batch_size=16, dataset_path=None, loader_args=None
+    ):
+        dataset = load_partition(dataset_path)
 
         dataset_len = len(dataset)
 
@@ -46,11 +57,12 @@ class DataLoader:
             len(test_dataset),
         )
 
+        loader_kwargs = get_dataloader_kwargs(loader_args)
         train_loader = torch.utils.data.DataLoader(
-            train_dataset, shuffle=True, batch_size=batch_size
+            train_dataset, shuffle=True, batch_size=batch_size, **loader_kwargs
         )
         test_loader = torch.utils.data.DataLoader(
-            test_dataset, shuffle=True, batch_size=batch_size
+            test_dataset, shuffle=True, batch_size=batch_size, **loader_kwargs
         )
 
         print(
@@ -6,15 +6,13 @@ Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/L
 """
 
 import hashlib
-import importlib
-import inspect
 import os
-import pickle
-import sys
 
 import yaml
 
+from utils.get_data_summary import get_data_summary
 from utils.logger import FedLogger
+from utils.model_registry import load_class
 
 
 def hash_bytestr_iter(bytesiter, hasher, ashexstr=False):
@@ -88,15 +86,11 @@ def setup_model_dir(temp_dir_path: str, model_id: str) -> None:
 
 
 def get_dataset_details(path: str) -> dict:
-    # dataset_dir_path = os.path.abspath(os.path.join(path, os.pardir))
-    print(path)
-    summary_path = path.split(".")[1] + "_summary.data"
-    summary_path = "." + summary_path
-    print(summary_path)
+    """Label distribution and size of the dataset file at "path", from its summary file,
+    which is regenerated when the dataset file changed."""
+    summary = None
     try:
-        summary = None
-        with open(summary_path, "rb") as f:
-            summary = pickle.load(f)
+        summary = get_data_summary(path)
 
     except Exception as e:
         print("client_file_manager.get_dataset_details:: Error reading summary.")
@@ -130,6 +124,11 @@ def get_available_datasets(path: str) -> list:
                 path, dataset, dataset_config["dataset_details"]["data_filename"]
             )
             del dataset_config["dataset_details"]["data_filename"]
+            if not dataset_config.get("metadata"):
+                summary = get_dataset_details(available_datasets_path[dataset])
+                if summary is not None:
+                    del summary["data_filename"]
+                    dataset_config["metadata"] = summary
             available_datasets[dataset] = dataset_config
 
     return available_datasets, available_datasets_path
@@ -171,44 +170,22 @@ def get_available_models(path: str) -> list:
 def get_model_class(path: str, model_id: str, class_name: str):
     """
     Function that takes in the location of the temp directory, the name of the ML model
-    and the name of the class that contains the PyTorch model as well as the train and the
-    validation functions and returns an object to that class
+    and the name of the class that contains the PyTorch model, the dataloader or the
+    train and validation functions, and returns that class, cached until the model files
+    in "<temp_dir>/model_cache/<model_id>" change
     """
 
-    model_cache_dir_path = os.path.join(path, "model_cache")
-    model_dir_path = os.path.join(model_cache_dir_path, model_id)
-    if os.path.isdir(model_cache_dir_path):
-        add_init_file_to_dir(dir_path=model_dir_path, empty_init_file=False)
-        model_cache_dir_abspath = os.path.abspath(model_cache_dir_path)
-        sys.path.append(model_cache_dir_abspath)
-        module_imported = importlib.import_module(model_id, package=None)
-        model_dir_abspath = os.path.abspath(model_dir_path)
-        sys.path.append(model_dir_abspath)
-
-        for file in module_imported.__all__:
-            model_imported = importlib.import_module(
-                f"{path}.model_cache.{model_id}.{file}"
-            )
-
-            for name_local in dir(model_imported):
-                unknown_class = getattr(model_imported, name_local)
-
-                if (
-                    inspect.isclass(unknown_class)
-                    and unknown_class.__name__ == class_name
-                ):
-                    print(
-                        f"client_file_manager.get_model_class:: class {unknown_class} is loaded."
-                    )
-                    return unknown_class
+    model_dir_path = os.path.join(path, "model_cache", model_id)
+    if not os.path.isdir(model_dir_path):
+        print(f"\nclient_file_manager.get_model_class:: {model_dir_path} not found\n")
+        return None
 
+    loaded_class = load_class(model_dir_path, class_name)
+    if loaded_class is None:
         print(
             f"\nclient_file_manager.get_model_class:: {class_name} not found in {model_id}\n"
         )
-        return None
-
-    print(f"\nclient_file_manager.get_model_class:: {model_dir_path} not found\n")
-    return None
+    return loaded_class
 
 
 def read_yaml(path: str):
@@ -5,6 +5,7 @@ Copyright 2023 Indian Institute of Science
 Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
 """
 
+import json
 import sys
 from os.path import join
 from pickle import dumps as p_dumps
@@ -17,7 +18,26 @@ import proto.grpc_pb2 as grpc_pb2
 import proto.grpc_pb2_grpc as grpc_pb2_grpc
 from client.client import Client
 from client.client_file_manager import setup_model_dir
+from server.training_spec import decode_spec
 from utils.logger import FedLogger
+from utils.metrics import TRANSPORT_BYTES, observe_client_task
+from utils.tracing import TRACEPARENT, start_span
+
+
+def observe_task(task: str, task_time: float, request, response) -> None:
+    received_b, sent_b = request.ByteSize(), response.ByteSize()
+    observe_client_task("grpc", task, task_time, received_b, sent_b)
+    TRANSPORT_BYTES.inc(received_b, protocol="grpc", direction="received")
+    TRANSPORT_BYTES.inc(sent_b, protocol="grpc", direction="sent")
+
+
+def request_span(name: str, context, **args):
+    """Span of a request, child of the server span whose traceparent it carries."""
+    traceparent = None
+    for key, value in context.invocation_metadata() or ():
+        if key == TRACEPARENT:
+            traceparent = value
+    return start_span(name, traceparent, **args)
 
 
 class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
@@ -55,6 +75,7 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
         model_id = str()
         file_name = str()
         data = bytearray()
+        span = request_span("client.receive_model", context)
 
         try:
             self.logger.debug("fedclient.gRPC.download.model.init", "")
@@ -74,6 +95,7 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
                 f.write(data)
         except sys.excepthook:
             print("Exception at fedclient.gRPC.StreamFile::", sys.excepthook)
+        span.end(model_id=model_id, file_name=file_name, size_b=len(data))
 
         return grpc_pb2.StringResponse(
             text=f"{self.client_id} successfully received {model_id}/{file_name}"
@@ -96,9 +118,9 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
         max_mini_batches = None
 
         if request.loss_function:
-            loss_function = p_loads(request.loss_function)
+            loss_function = decode_spec(request.loss_function)
         if request.optimizer:
-            optimizer = p_loads(request.optimizer)
+            optimizer = decode_spec(request.optimizer)
         if request.timeout_duration_s:
             timeout_duration_s = request.timeout_duration_s
         if request.max_mini_batch_count:
@@ -131,7 +153,19 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
             model_id=model_id,
             num_mini_batches=result["total_mini_batches"],
             bench_duration_s=result["time_taken_s"],
+            compile_mode=result.get("compile_mode"),
+            compile_time_s=result.get("compile_time_s"),
+            compile_speedup=result.get("compile_speedup"),
         )
+        if "dataloader_setting" in result:
+            response.loader_throughput = json.dumps(
+                {
+                    result["dataloader_setting"]: {
+                        "mini_batches_per_s": result["mini_batches_per_s"],
+                        "samples_per_s": result["samples_per_s"],
+                    }
+                }
+            )
 
         print("fedclient.gRPC.InitBench:: Benchmark Round Finished")
         if context.is_active():
@@ -142,7 +176,9 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
     def StartTraining(self, request, context) -> grpc_pb2.InitTrainResponse:
         self.logger.info("fedclient.gRPC.train.init", "")
         grpc_train_time = time()
+        span = request_span("client.train", context, round_no=request.round_idx)
 
+        deserialize_span = span.child("deserialize")
         model_id: str = request.model_id
         model_class: str = request.model_class
         model_config: dict = p_loads(request.model_config)
@@ -153,8 +189,9 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
         num_epochs: int = request.num_epochs
         round_id: int = request.round_idx
         timeout_duration_s = None
-        loss_function = p_loads(request.loss_function)
-        optimizer = p_loads(request.optimizer)
+        loss_function = decode_spec(request.loss_function)
+        optimizer = decode_spec(request.optimizer)
+        deserialize_span.end()
 
         if request.timeout_duration_s:
             max_mini_batches = None
@@ -174,6 +211,7 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
 
         if not context.is_active():
             self.logger.error("fedclient.gRPC.train", f"fedserver not active")
+            span.end(error="fedserver not active")
             return
         result, model_weights = self.client.Train(
             model_id=model_id,
@@ -189,11 +227,13 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
             timeout_duration_s=timeout_duration_s,
             max_epochs=max_epochs,
             max_mini_batches=max_mini_batches,
+            span=span,
         )
 
         pickle_time = time()
-        model_weights = p_dumps(model_weights)
-        metrics = p_dumps(result)
+        with span.child("serialize"):
+            model_weights = p_dumps(model_weights)
+            metrics = p_dumps(result)
         self.logger.info(
             "fedclient.gRPC.train.round.pickle.weights", f"{time()-pickle_time}"
         )
@@ -217,6 +257,8 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
         finally:
             print("fedclient.gRPC.StartTraining:: Training Round Finished")
             self.logger.info("fedclient.gRPC.e2e.time", f"{time()-grpc_train_time}")
+            observe_task("train", time() - grpc_train_time, request, response)
+            span.end()
             self.logger.info(
                 "fedclient.gRPC.train.response.time", f"{time()-response_time}"
             )
@@ -224,7 +266,9 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
     def StartValidation(self, request, context) -> grpc_pb2.InitValidationResponse:
         self.logger.info("fedclient.gRPC.validation.round.init", "")
         grpc_validation_time = time()
+        span = request_span("client.validation", context, round_no=request.round_idx)
 
+        deserialize_span = span.child("deserialize")
         model_id: str = request.model_id
         model_class: str = request.model_class
         model_config = p_loads(request.model_config)
@@ -232,14 +276,16 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
         model_wts: OrderedDict = p_loads(request.model_wts)
         batch_size: int = request.batch_size
         round_id: int = request.round_idx
-        loss_function = p_loads(request.loss_function)
-        optimizer = p_loads(request.optimizer)
+        loss_function = decode_spec(request.loss_function)
+        optimizer = decode_spec(request.optimizer)
+        deserialize_span.end()
 
         self.logger.debug("fedclient.gRPC.validate.round.model", model_id)
         print(f"\nfedclient.gRPC.validate.round:: Validation Round:{round_id}")
 
         if not context.is_active():
             self.logger.error("fedclient.gRPC.validation", f"fedserver not active")
+            span.end(error="fedserver not active")
             return
         result = self.client.Validate(
             model_id=model_id,
@@ -250,10 +296,12 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
             batch_size=batch_size,
             loss_function=loss_function,
             optimizer=optimizer,
+            span=span,
         )
 
         pickle_time = time()
-        metrics = p_dumps(result)
+        with span.child("serialize"):
+            metrics = p_dumps(result)
         self.logger.info(
             "fedclient.gRPC.train.round.pickle.weights", f"{time()-pickle_time}"
         )
@@ -278,6 +326,8 @@ class ClientGRPCManager(grpc_pb2_grpc.EdgeServiceServicer):
             self.logger.info(
                 "fedclient.gRPC.e2e.time", f"{time()-grpc_validation_time}"
             )
+            observe_task("validation", time() - grpc_validation_time, request, response)
+            span.end()
             self.logger.info(
                 "fedclient.gRPC.validation.response.time", f"{time()-return_time}"
             )
@@ -11,7 +11,6 @@ from concurrent import futures
 from threading import Event, Thread
 
 import grpc
-import torch
 from grpc import Server
 
 import proto.grpc_pb2_grpc as grpc_pb2_grpc
@@ -24,7 +23,9 @@ from client.client_grpc_manager import ClientGRPCManager
 from client.client_mqtt_manager import ClientMQTTManager
 from client.utils.ip import get_ip_address, get_ip_address_docker
 from client.utils.port_allocator import port_allocator
+from utils.hardware_info import get_hardware_info
 from utils.logger import FedLogger
+from utils.metrics import start_metrics_server
 
 
 class ClientManager:
@@ -34,12 +35,14 @@ class ClientManager:
 
         self.client_info = client_info
 
+        # setting up client logger
+        self.logger = FedLogger(id=self.client_id, loggername="CLIENT_MANAGER")
+
+        # torch is not imported to pick the device on hosts without a GPU driver
+        self.torch_device = "cpu"
         if client_config["general_config"]["use_gpu"]:
-            self.torch_device = torch.device(
-                "cuda" if torch.cuda.is_available() else "cpu"
-            )
-        else:
-            self.torch_device = torch.device("cpu")
+            if get_hardware_info()["cuda_available"]:
+                self.torch_device = "cuda"
         if client_config["general_config"]["use_gpu"] and self.torch_device == "cpu":
             self.logger.warn(
                 f"WARNING: GPU not available on Client{self.client_id}.",
@@ -65,6 +68,15 @@ class ClientManager:
         self.grpc_port: int = port_allocator(self.ip, self.init_grpc_port)
         self.grpc_ep: str = f"{self.ip}:{self.grpc_port}"
 
+        # Prometheus scrape endpoint, the next free port when several clients share a host
+        metrics_config: dict = client_config["comm_config"].get("metrics") or dict()
+        self.metrics_server = None
+        if metrics_config.get("metrics_port") is not None:
+            self.metrics_server = start_metrics_server(
+                port=port_allocator(self.ip, int(metrics_config["metrics_port"])),
+                host=metrics_config.get("metrics_hostname", "0.0.0.0"),
+            )
+
         self.opts: list = [
             ("grpc.max_send_message_length", 1000 * 1024 * 1024),
             ("grpc.max_receive_message_length", 1000 * 1024 * 1024),
@@ -94,9 +106,6 @@ class ClientManager:
             "cleanup_temp_on_exit"
         ]
 
-        # setting up client logger
-        self.logger = FedLogger(id=self.client_id, loggername="CLIENT_MANAGER")
-
     def mqtt_init(self, stop_event: Event) -> Thread:
         """
         Function to start the client's MQTT service
@@ -14,8 +14,10 @@ import paho.mqtt.client as mqtt
 
 from client.client_file_manager import get_available_models
 from client.utils.ip import get_ip_address, get_ip_address_docker
-from utils.hardware_info import get_hardware_info
+from utils.hardware_info import get_hardware_fingerprint, get_hardware_info
 from utils.logger import FedLogger
+from utils.metrics import TRANSPORT_BYTES, observe_client_task
+from utils.tracing import TRACEPARENT, start_span
 
 
 class ClientMQTTManager:
@@ -62,6 +64,9 @@ class ClientMQTTManager:
         self.dataset_details: dict = dataset_details
         self.dataset_paths: dict = dataset_paths if dataset_paths is not None else {}
         self.session_id = None
+        # retained global model of the server and its payload size
+        self.latest_global_model = None
+        self.latest_global_model_bytes = 0
 
         self.heard_from_server_event = Event()
 
@@ -93,6 +98,10 @@ class ClientMQTTManager:
                             "datasets": self.dataset_details,
                             "models": get_available_models(self.temp_dir_path),
                             "benchmark_info": self.client_info["benchmark_info"],
+                            "benchmark_cache": self.client_info.get(
+                                "benchmark_cache", dict()
+                            ),
+                            "hw_fingerprint": get_hardware_fingerprint(self.hw_info),
                             "name": self.client_name,
                         }
                     }
@@ -141,8 +150,12 @@ class ClientMQTTManager:
         def on_model_global(client, userdata, message):
             # Cache latest global weights (base64)
             try:
+                TRANSPORT_BYTES.inc(
+                    len(message.payload), protocol="mqtt", direction="received"
+                )
                 body = json.loads(str(message.payload.decode()))
                 self.latest_global_model = body
+                self.latest_global_model_bytes = len(message.payload)
                 self.logger.info(
                     "MQTT.client.model.global", f"round,{body.get('round_id')}"
                 )
@@ -175,16 +188,29 @@ class ClientMQTTManager:
                 import base64, pickle
                 from client.client import Client as FloClient
 
+                task_start_time = time.time()
+                TRANSPORT_BYTES.inc(
+                    len(message.payload), protocol="mqtt", direction="received"
+                )
                 body = json.loads(str(message.payload.decode()))
                 task = body["task"]
                 params = body.get("params", {})
                 task_id = body.get("task_id")
                 round_id = body.get("round_id")
                 session_id = body.get("session_id")
+                # child of the server span of this task, see FloSessionManager.mqtt_publish_command
+                span = start_span(
+                    f"client.{task.lower()}",
+                    body.get(TRACEPARENT),
+                    task_id=task_id,
+                    round_no=round_id,
+                )
 
-                # Helper to publish status/result
+                # Helper to publish status/result, returns the size of the payload
                 def pub(topic, payload):
-                    client.publish(topic, json.dumps(payload), qos=1)
+                    data = json.dumps(payload)
+                    client.publish(topic, data, qos=1)
+                    return len(data)
 
                 status_topic = f"flotilla/client/status/{self.client_id}"
                 result_prefix = f"flotilla/client/result"
@@ -228,8 +254,20 @@ class ClientMQTTManager:
                             "task_id": task_id,
                             "model_id": params["model_id"],
                             "hash": res.get("model_hash", ""),
+                            "dataset_id": params["dataset_id"],
+                            "batch_size": params["batch_size"],
+                            "hw_fingerprint": get_hardware_fingerprint(self.hw_info),
                             "bench_duration_s": res.get("time_taken_s"),
                             "num_mini_batches": res.get("total_mini_batches"),
+                            "loader_throughput": {
+                                res.get("dataloader_setting"): {
+                                    "mini_batches_per_s": res.get("mini_batches_per_s"),
+                                    "samples_per_s": res.get("samples_per_s"),
+                                }
+                            },
+                            "compile_mode": res.get("compile_mode"),
+                            "compile_time_s": res.get("compile_time_s"),
+                            "compile_speedup": res.get("compile_speedup"),
                             "timestamp": time.time(),
                         },
                     )
@@ -273,11 +311,12 @@ class ClientMQTTManager:
                             batch_size=params["batch_size"],
                             learning_rate=params["learning_rate"],
                             num_epochs=params["num_epochs"],
-                            loss_function=None,
-                            optimizer=None,
+                            loss_function=params.get("loss_function"),
+                            optimizer=params.get("optimizer"),
                             timeout_duration_s=params.get("timeout_duration_s"),
                             max_epochs=params.get("max_epochs"),
                             max_mini_batches=params.get("max_mini_batches"),
+                            span=span,
                         )
                     except Exception as ex:
                         # Signal artifact request if model files missing
@@ -295,17 +334,20 @@ class ClientMQTTManager:
                             ),
                             qos=1,
                         )
+                        span.end(error=str(ex))
                         return
-                    pub(
+                    with span.child("serialize"):
+                        weights_b64 = base64.b64encode(pickle.dumps(new_wts)).decode(
+                            "utf-8"
+                        )
+                    sent_b = pub(
                         f"{result_prefix}/train/{self.client_id}",
                         {
                             "session_id": session_id,
                             "round_id": round_id,
                             "task_id": task_id,
                             "metrics": res,
-                            "weights_b64": base64.b64encode(
-                                pickle.dumps(new_wts)
-                            ).decode("utf-8"),
+                            "weights_b64": weights_b64,
                             "timestamp": time.time(),
                         },
                     )
@@ -319,6 +361,15 @@ class ClientMQTTManager:
                             "timestamp": time.time(),
                         },
                     )
+                    TRANSPORT_BYTES.inc(sent_b, protocol="mqtt", direction="sent")
+                    # the request is the command and the retained global model
+                    observe_client_task(
+                        "mqtt",
+                        "train",
+                        time.time() - task_start_time,
+                        len(message.payload) + self.latest_global_model_bytes,
+                        sent_b,
+                    )
 
                 elif task == "TEST":
                     pub(
@@ -345,10 +396,11 @@ class ClientMQTTManager:
                         dataset_id=params["dataset_id"],
                         model_wts=model_wts,
                         batch_size=params["batch_size"],
-                        loss_function=None,
-                        optimizer=None,
+                        loss_function=params.get("loss_function"),
+                        optimizer=params.get("optimizer"),
+                        span=span,
                     )
-                    pub(
+                    sent_b = pub(
                         f"{result_prefix}/test/{self.client_id}",
                         {
                             "session_id": session_id,
@@ -368,6 +420,15 @@ class ClientMQTTManager:
                             "timestamp": time.time(),
                         },
                     )
+                    TRANSPORT_BYTES.inc(sent_b, protocol="mqtt", direction="sent")
+                    observe_client_task(
+                        "mqtt",
+                        "validation",
+                        time.time() - task_start_time,
+                        len(message.payload) + self.latest_global_model_bytes,
+                        sent_b,
+                    )
+                span.end()
             except Exception as e:
                 self.logger.error("MQTT.client.command.error", str(e))
                 client.publish(
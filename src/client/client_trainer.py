@@ -6,11 +6,19 @@ Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/L
 """
 
 import time
+from os.path import join
 
 import torch
 from tqdm import tqdm
 
-from client.client_file_manager import get_model_class
+from client.client_file_manager import get_available_models, get_model_class
+from utils.model_compiler import (
+    compile_model,
+    example_input_from_loader,
+    get_compile_mode,
+    unwrap_model,
+)
+from utils.precision import autocast_context, get_grad_scaler, negotiate_precision
 
 
 class ClientTrainer:
@@ -27,6 +35,12 @@ class ClientTrainer:
         custom_trainer_args: dict = None,
         use_custom_validator=False,
         custom_validator_args: dict = None,
+        use_fast_trainer=False,
+        fast_trainer_args: dict = None,
+        precision: str = "fp32",
+        channels_last=False,
+        hw_info: dict = None,
+        compile_mode: str = None,
     ) -> None:
         self.device = torch.device(device)
 
@@ -41,6 +55,15 @@ class ClientTrainer:
             self.device, args=model_args
         )
 
+        # autocast keeps the parameters in fp32, only the forward pass runs in low precision
+        self.precision = negotiate_precision(precision, hw_info, self.device)
+        self.channels_last = channels_last is True
+        if self.channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+
+        self.compile_mode = get_compile_mode(compile_mode)
+        self.compile_info = None
+
         self.custom_trainer_args = None
         self.use_custom_trainer = use_custom_trainer
         if use_custom_trainer:
@@ -50,6 +73,13 @@ class ClientTrainer:
         if use_custom_validator:
             self.custom_validator_args = custom_validator_args
 
+        self.use_fast_trainer = use_fast_trainer
+        self.fast_trainer_sync_interval = 50
+        if use_fast_trainer and isinstance(fast_trainer_args, dict):
+            self.fast_trainer_sync_interval = max(
+                1, int(fast_trainer_args.get("sync_interval", 50))
+            )
+
     def set_loss_function(self, loss_func) -> None:
         self.loss_func = loss_func
 
@@ -59,16 +89,62 @@ class ClientTrainer:
     def set_optimizer(self, optimizer) -> None:
         self.optimizer = optimizer
 
+    def bind_optimizer(self) -> None:
+        """Points the optimizer at the parameters of the model, clearing its state,
+        unless it was built over them, e.g. from a spec with a persisted state."""
+        params = list(self.model.parameters())
+        bound = [p for group in self.optimizer.param_groups for p in group["params"]]
+        if len(bound) == len(params) and all(a is b for a, b in zip(bound, params)):
+            return
+        self.optimizer.param_groups.clear()
+        self.optimizer.state.clear()
+        self.optimizer.add_param_group({"params": params})
+
     def load_model_from_checkpoint(self, checkpoint) -> None:
-        self.model.load_state_dict(checkpoint)
+        unwrap_model(self.model).load_state_dict(checkpoint)
         self.model.to(self.device)
 
     def get_model_wts(self):
-        return self.model.to("cpu").state_dict()
+        state_dict = unwrap_model(self.model).to("cpu").state_dict()
+        # aggregation expects fp32 tensors in the default memory format
+        for key, value in state_dict.items():
+            if value.is_floating_point() and value.dtype != torch.float32:
+                value = value.float()
+            state_dict[key] = value.contiguous()
+        return state_dict
+
+    def to_device(self, x, non_blocking=False):
+        x = x.to(self.device, non_blocking=non_blocking)
+        if self.channels_last and x.dim() == 4:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return x
 
     def stop_training(self):
         self.stop_training_flag = True
 
+    def compile_for_loader(self, loader) -> None:
+        """Swaps in the compiled model, once, for the mini-batch shape of "loader"."""
+        if self.compile_mode is None or self.compile_info is not None:
+            return
+        try:
+            example_input = example_input_from_loader(
+                loader, self.device, self.channels_last
+            )
+            model_hash = get_available_models(self.temp_dir_path)[self.model_id]
+        except Exception as e:
+            print(f"CLIENT_TRAINER.compile_for_loader:: Using eager model: {e}")
+            self.compile_info = {"compile_mode": "eager", "speedup": 1.0}
+            return
+
+        self.model.to(self.device)
+        self.model, self.compile_info = compile_model(
+            model=self.model,
+            compile_mode=self.compile_mode,
+            cache_dir=join(self.temp_dir_path, "model_cache", self.model_id),
+            model_hash=model_hash,
+            example_input=example_input,
+        )
+
     def exit_check(
         self,
         epochs,
@@ -116,9 +192,9 @@ class ClientTrainer:
             print("Optimizer learning rate = ", param_group["lr"])
 
         # update optimizer with current model parameters.
-        self.optimizer.param_groups.clear()
-        self.optimizer.state.clear()
-        self.optimizer.add_param_group({"params": [p for p in self.model.parameters()]})
+        self.bind_optimizer()
+
+        scaler = get_grad_scaler(self.precision)
 
         # setting model to train mode
         self.model.train()
@@ -154,15 +230,16 @@ class ClientTrainer:
                 if exit_flag:
                     break
 
-                train_x = train_x.to(self.device)
+                train_x = self.to_device(train_x)
                 train_label = train_label.to(self.device)
                 self.optimizer.zero_grad()
-                predict_y = self.model(train_x)
+                with autocast_context(self.precision, self.device):
+                    predict_y = self.model(train_x)
+                    loss = cost(predict_y, train_label)
 
-                loss = cost(predict_y, train_label)
-                loss.backward()
-
-                self.optimizer.step()
+                scaler.scale(loss).backward()
+                scaler.step(self.optimizer)
+                scaler.update()
 
                 total += len(train_x)
                 total_loss += loss.item()
@@ -215,6 +292,138 @@ class ClientTrainer:
             "accuracy": total_accuracy,
         }
 
+    def fast_train_model_classifier(
+        self,
+        lr: float,
+        train_loader,
+        test_loader=None,
+        num_epochs=None,
+        timeout_duration_s=None,
+        max_mini_batches=None,
+        max_epochs=None,
+    ):
+        """Same training loop and metrics as default_train_model_classifier, without
+        a host sync per mini-batch. Loss and correct counts are accumulated as device
+        tensors and only read back every "sync_interval" steps and at the end. The
+        limits and the wall-clock timeout are checked on the host every step.
+        """
+        if not self.loss_func:
+            print("Loss was none, using default Loss Function")
+            self.set_loss_function(torch.nn.CrossEntropyLoss)
+        cost = self.loss_func()
+
+        if self.optimizer is None:
+            print("Optimizer was none, using default Optimizer")
+            self.set_optimizer(torch.optim.Adam(params=self.model.parameters(), lr=lr))
+
+        for param_group in self.optimizer.param_groups:
+            print("Optimizer learning rate = ", param_group["lr"])
+
+        # update optimizer with current model parameters.
+        self.bind_optimizer()
+
+        scaler = get_grad_scaler(self.precision)
+
+        self.model.train()
+
+        sync_interval = self.fast_trainer_sync_interval
+        data_entries = len(train_loader)
+
+        # float64 accumulation gives the same sum as adding loss.item() to a python float
+        total_loss = torch.zeros((), dtype=torch.float64, device=self.device)
+        correct = torch.zeros((), dtype=torch.int64, device=self.device)
+        total = 0
+        total_num_mini_batches = 0
+        float_epochs = 0.0
+        exit_flag = False
+        stopped = False
+
+        epochs = 0
+        start_time = time.time()
+        for epoch in range(num_epochs):
+            num_mini_batches = 0
+            for train_x, train_label in train_loader:
+                exit_flag = self.exit_check(
+                    epochs,
+                    max_epochs,
+                    max_mini_batches,
+                    num_mini_batches,
+                    start_time,
+                    timeout_duration_s,
+                )
+                if exit_flag:
+                    break
+
+                train_x = self.to_device(train_x, non_blocking=True)
+                train_label = train_label.to(self.device, non_blocking=True)
+                self.optimizer.zero_grad()
+                with autocast_context(self.precision, self.device):
+                    predict_y = self.model(train_x)
+                    loss = cost(predict_y, train_label)
+
+                scaler.scale(loss).backward()
+                scaler.step(self.optimizer)
+                scaler.update()
+
+                total += len(train_x)
+                total_loss += loss.detach().to(torch.float64)
+                correct += (torch.argmax(predict_y.detach(), 1) == train_label).sum()
+                epochs = epoch
+
+                num_mini_batches += 1
+                total_num_mini_batches += 1
+                float_epochs = epoch + (num_mini_batches / data_entries)
+
+                exit_flag = self.exit_check(
+                    epochs,
+                    max_epochs,
+                    max_mini_batches,
+                    num_mini_batches,
+                    start_time,
+                    timeout_duration_s,
+                )
+                if exit_flag:
+                    break
+
+                if total_num_mini_batches % sync_interval == 0:
+                    print(
+                        f"Mini Batches: {total_num_mini_batches}, epochs, {round(float_epochs, 3)}, avg_loss, {round(total_loss.item() / total_num_mini_batches, 3)}"
+                    )
+
+                if self.stop_training_flag:
+                    stopped = True
+                    break
+            if exit_flag or stopped:
+                break
+
+        avg_loss = (
+            round(total_loss.item() / total_num_mini_batches, 3)
+            if total_num_mini_batches
+            else 0
+        )
+        total_accuracy = round((correct.item() / total) * 100, 3) if total else 0
+
+        if stopped:
+            return {
+                "run_time": (time.time() - start_time),
+                "num_epochs": float_epochs,
+                "total_num_minibatches": total_num_mini_batches,
+                "loss": avg_loss,
+                "accuracy": total_accuracy,
+            }
+
+        print(
+            f"epochs, {float_epochs}, avg_loss ,{avg_loss}, total_accuracy, {total_accuracy}"
+        )
+        print(f"Training Round Finished {time.time() - start_time}sec")
+        return {
+            "time_taken_s": (time.time() - start_time),
+            "num_epochs": float_epochs,
+            "total_mini_batches": total_num_mini_batches,
+            "loss": avg_loss,
+            "accuracy": total_accuracy,
+        }
+
     def train_model(
         self,
         lr: float,
@@ -254,6 +463,9 @@ class ClientTrainer:
 
         results = dict()
 
+        if not self.use_custom_trainer:
+            self.compile_for_loader(train_loader)
+
         if self.use_custom_trainer:
             print("CLIIENT_TRAINER.train_model:: Using custom trainer")
             trainer = get_model_class(
@@ -272,6 +484,18 @@ class ClientTrainer:
                 timeout_s=timeout_duration_s,
             )
             print(f"CLIENT_TRAINER.train_model:: Results - {results}")
+        elif self.use_fast_trainer:
+            print("CLIIENT_TRAINER.train_model:: Using fast-path trainer")
+            results = self.fast_train_model_classifier(
+                lr=lr,
+                train_loader=train_loader,
+                test_loader=test_loader,
+                num_epochs=num_epochs,
+                timeout_duration_s=timeout_duration_s,
+                max_mini_batches=max_mini_batches,
+                max_epochs=max_epochs,
+            )
+            print(f"CLIENT_TRAINER.train_model:: Results - {results}")
         else:
             print("CLIIENT_TRAINER.train_model:: Using default trainer")
             results = self.default_train_model_classifier(
@@ -308,7 +532,7 @@ class ClientTrainer:
             print(
                 "client_trainer.ClientTrainer.train_model :: WARNING - Optimizer was none"
             )
-            self.set_optimizer(torch.optim.Adam(params=self.model.parameters(), lr=lr))
+            self.set_optimizer(torch.optim.Adam(params=self.model.parameters()))
 
         if self.use_custom_validator:
             print("CLIENT_TRAINER.validate_model:: Custom validator being used.")
@@ -330,6 +554,7 @@ class ClientTrainer:
 
         else:
             print("CLIENT_TRAINER.validate_model:: Default validator being used.")
+            self.compile_for_loader(test_loader)
             self.model = self.model.to(self.device)
 
             self.model.eval()
@@ -343,10 +568,11 @@ class ClientTrainer:
                 for i, (x_batch, y_batch) in enumerate(test_loader):
                     # if i >= 1:
                     #     break
-                    x_batch = x_batch.to(self.device)
+                    x_batch = self.to_device(x_batch)
                     y_batch = y_batch.to(self.device)
-                    y_pred = self.model(x_batch)
-                    loss = cost(y_pred, y_batch)
+                    with autocast_context(self.precision, self.device):
+                        y_pred = self.model(x_batch)
+                        loss = cost(y_pred, y_batch)
                     total_loss += loss.item()
                     acc += (torch.argmax(y_pred, 1) == y_batch).float().sum().item()
                     count += len(y_batch)
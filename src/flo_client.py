@@ -5,14 +5,20 @@ Copyright 2023 Indian Institute of Science
 Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
 """
 
+from utils.startup_profile import start_profiler
+
+# started before the other imports so that they are profiled too
+profiler = start_profiler()
+
 import argparse
+import atexit
 import os
 import uuid
 
 from client.client_file_manager import OpenYaML
 from client.client_manager import ClientManager
 from client.utils.client_info import generate_client_info
-from client.utils.monitor import Monitor
+from utils.tracing import configure_tracing
 
 
 def main():
@@ -34,12 +40,38 @@ def main():
         default=False,
         help="Monitor CPU/RAM/Disk/Network usage.",
     )
+    parser.add_argument(
+        "--monitor-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between two monitor samples.",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        default=False,
+        help="Write the spans of training and validation requests to logs/.",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        default=False,
+        help="Print the modules that took longest to import, at startup and on exit.",
+    )
     args = parser.parse_args()
 
     if args.monitor:
-        Monitor(client_id, pid)
+        from client.utils.monitor import Monitor
+
+        Monitor(client_id, pid, interval_s=args.monitor_interval)
+    if args.trace:
+        configure_tracing(client_id)
 
     client = ClientManager(client_id, client_config, client_info)
+    if profiler:
+        profiler.report("startup")
+        # modules imported lazily, e.g. torch on the first request
+        atexit.register(profiler.report, "after startup")
     client.run()
 
 
@@ -5,7 +5,13 @@ Copyright 2023 Indian Institute of Science
 Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
 """
 
+from utils.startup_profile import start_profiler
+
+# started before the other imports so that they are profiled too
+profiler = start_profiler()
+
 import asyncio
+import atexit
 from argparse import ArgumentParser
 from os import getpid
 from threading import Event
@@ -16,7 +22,7 @@ from waitress import serve
 
 from server.server_file_manager import OpenYaML
 from server.server_manager import FlotillaServerManager
-from utils.monitor import Monitor
+from utils.tracing import configure_tracing
 
 app = Flask("flo_server")
 
@@ -32,10 +38,32 @@ parser.add_argument(
     default=False,
     help="Monitor CPU/RAM/Disk/Network IO",
 )
+parser.add_argument(
+    "--monitor-interval",
+    type=float,
+    default=1.0,
+    help="Seconds between two monitor samples",
+)
+parser.add_argument(
+    "--trace",
+    action="store_true",
+    default=False,
+    help="Write the spans of rounds and client requests to logs/",
+)
+parser.add_argument(
+    "--profile-startup",
+    action="store_true",
+    default=False,
+    help="Print the modules that took longest to import, at startup and on exit",
+)
 args = parser.parse_args()
 is_monitoring = args.monitor
 if is_monitoring:
-    monitor = Monitor("0", process_id)
+    from utils.monitor import Monitor
+
+    monitor = Monitor("0", process_id, interval_s=args.monitor_interval)
+if args.trace:
+    configure_tracing("server")
 
 
 def handle_request(
@@ -106,6 +134,10 @@ def main():
     print("Starting FLo_Server")
     global flo_server
     flo_server = FlotillaServerManager(server_config)
+    if profiler:
+        profiler.report("startup")
+        # modules imported lazily, e.g. torch with the first session
+        atexit.register(profiler.report, "after startup")
     serve(
         app,
         host=server_config["comm_config"]["restful"]["rest_hostname"],
@@ -1,7 +1,149 @@
 from collections import OrderedDict
+from uuid import uuid4
 
 import numpy as np
-from torch import zeros
+import torch
+
+from server.tiering import get_num_tiers
+
+# tier models of the running sessions, in the server process, by session_id, freed by
+# reset when a session starts or ends
+_caches = dict()
+# aggregator_state key of the token of the cache that aggregator_state belongs to. A
+# new token is written with every checkpoint, so a cleared or restored state does not
+# match the cache and the cache is rebuilt from it.
+CACHE_TOKEN_KEY = "tier_cache_token"
+
+
+def get_tier_weights(update_counts: np.ndarray) -> np.ndarray:
+    """Weight of each tier in the global model: tier i gets the i-th smallest update
+    count, so that the tiers that update less often weigh more."""
+    return np.sort(update_counts) / update_counts.sum()
+
+
+class TierCache:
+    """
+    Tier models of a session, held in one preallocated (num_tiers, *shape) tensor per
+    layer, with the update counts of the tiers, the running sums of the client models
+    of the tiers' current rounds, and the weighted global model. The global model is
+    updated with the change of the tier model and of the tier weights on every tier
+    update, and written to aggregator_state only by checkpoint.
+    """
+
+    def __init__(self, tier_models: list, update_counts) -> None:
+        self.num_tiers = len(tier_models)
+        self.dtypes = OrderedDict(
+            (layer, w.dtype) for layer, w in tier_models[0].items()
+        )
+        self.tiers = OrderedDict(
+            (
+                layer,
+                torch.stack([m[layer].detach().cpu() for m in tier_models]).to(
+                    dtype if dtype.is_floating_point else torch.float64
+                ),
+            )
+            for layer, dtype in self.dtypes.items()
+        )
+        self.update_counts = np.asarray(update_counts, dtype=np.int64)
+        self.weights = np.zeros(self.num_tiers)
+        self.global_model = OrderedDict(
+            (layer, torch.zeros(t.shape[1:], dtype=torch.float64))
+            for layer, t in self.tiers.items()
+        )
+        if self.update_counts.sum() > 0:
+            self.set_weights(get_tier_weights(self.update_counts))
+        self.client_sums = [None] * self.num_tiers
+        self.client_items = np.zeros(self.num_tiers)
+        self.received = [set() for _ in range(self.num_tiers)]
+        self.token = uuid4().hex
+
+    def set_weights(self, weights: np.ndarray) -> None:
+        for t in np.flatnonzero(weights != self.weights).tolist():
+            change = float(weights[t] - self.weights[t])
+            for layer, g in self.global_model.items():
+                g.add_(self.tiers[layer][t], alpha=change)
+        self.weights = weights
+
+    def add_client(self, tier: int, client_id: str, weights, num_items: float) -> None:
+        if self.client_sums[tier] is None:
+            self.client_sums[tier] = OrderedDict(
+                (layer, torch.zeros(t.shape[1:], dtype=torch.float64))
+                for layer, t in self.tiers.items()
+            )
+        for layer, s in self.client_sums[tier].items():
+            s.add_(weights[layer].detach().cpu(), alpha=num_items)
+        self.client_items[tier] += num_items
+        self.received[tier].add(client_id)
+
+    def update_tier(self, tier: int) -> None:
+        """Replaces the tier model with the mean of the received client models, weighted
+        by their number of items, and updates the global model."""
+        sums, items = self.client_sums[tier], self.client_items[tier]
+        for layer, g in self.global_model.items():
+            old = self.tiers[layer][tier]
+            new = (sums[layer] / items).to(old.dtype)
+            g.add_(new.double() - old.double(), alpha=float(self.weights[tier]))
+            old.copy_(new)
+        self.update_counts[tier] += 1
+        self.set_weights(get_tier_weights(self.update_counts))
+        self.client_sums[tier] = None
+        self.client_items[tier] = 0.0
+        self.received[tier] = set()
+
+    def tier_model(self, tier: int) -> OrderedDict:
+        return OrderedDict(
+            (layer, t[tier].to(self.dtypes[layer]).clone())
+            for layer, t in self.tiers.items()
+        )
+
+    def get_global_model(self) -> OrderedDict:
+        return OrderedDict(
+            (layer, g.to(self.dtypes[layer])) for layer, g in self.global_model.items()
+        )
+
+
+def get_tier_cache(session_id, num_tiers, training_session, aggregator_state):
+    """Tier cache of the session, created from the tier models in aggregator_state
+    when restored from a checkpoint, otherwise with every tier at the global model.
+    Rebuilt when aggregator_state was cleared or restored since it was created."""
+    cache = _caches.get(session_id)
+    if (
+        cache is not None
+        and cache.num_tiers == num_tiers
+        and aggregator_state.get(CACHE_TOKEN_KEY) == cache.token
+    ):
+        return cache
+    tier_models, update_counts = [], []
+    global_model = training_session.get(f"{session_id}.global_model")
+    for tier in range(num_tiers):
+        tier_models.append(
+            aggregator_state.get(f"tier_model_tier_{tier}") or global_model
+        )
+        update_counts.append(aggregator_state.get(f"update_count_tier_{tier}") or 0)
+    cache = _caches[session_id] = TierCache(tier_models, update_counts)
+    aggregator_state.put(CACHE_TOKEN_KEY, cache.token)
+    return cache
+
+
+def reset(session_id) -> None:
+    """Drops the tier cache of the session, called by the session manager when the
+    session starts and ends."""
+    _caches.pop(session_id, None)
+
+
+def checkpoint(session_id, aggregator_state):
+    """Writes the tier models and update counts to aggregator_state, called by the
+    session manager before it checkpoints the state."""
+    cache = _caches.get(session_id)
+    if cache is None:
+        return
+    for tier in range(cache.num_tiers):
+        aggregator_state.put(f"tier_model_tier_{tier}", cache.tier_model(tier))
+        aggregator_state.put(
+            f"update_count_tier_{tier}", int(cache.update_counts[tier])
+        )
+    cache.token = uuid4().hex
+    aggregator_state.put(CACHE_TOKEN_KEY, cache.token)
 
 
 def aggregate(
@@ -16,41 +158,16 @@ def aggregate(
     client_selection_state,
     args,
 ):
-    def get_global_model(num_tiers):
-        global_model = OrderedDict()
-
-        tier_weights = aggregator_state.get(f"tier_model_tier_0")
-
-        for layer in tier_weights:
-            shape = tier_weights[layer].shape
-            global_model[layer] = zeros(shape)
-
-        T_k = []
-        for tier in range(num_tiers):
-            T_k.append(aggregator_state.get(f"update_count_tier_{tier}"))
-
-        sorted_index = np.argsort([-x for x in T_k])
-
-        tier_wts = np.array(
-            [T_k[sorted_index[len(T_k) - 1 - i]] for i in range(len(T_k))]
-        ) / sum(T_k)
-
-        print("TIER WEIGHTS = ", tier_wts)
-
-        for tier in range(num_tiers):
-            model_wts = aggregator_state.get(f"tier_model_tier_{tier}")
-
-            for layer in model_wts.keys():
-                # fmt: off
-                global_model[layer] += (model_wts[layer] * tier_wts[tier])
-                # fmt: on
-
-        return global_model
-
-    aggregator_state.put(f"clientweights_{client_id}", client_local_weights)
+    if client_id is None:
+        # round deadline, tiers are only updated when their clients report
+        return None
 
     client_to_tier_dict = client_selection_state.get("client_to_tier_id_dict")
-    num_tiers = len(np.unique(list(client_to_tier_dict.values())))
+    # tiers can be empty after re-tiering, the number of tiers is fixed at round 0
+    num_tiers = get_num_tiers(client_selection_state) or len(
+        np.unique(list(client_to_tier_dict.values()))
+    )
+    cache = get_tier_cache(session_id, num_tiers, training_session, aggregator_state)
 
     tier = client_to_tier_dict[client_id]
 
@@ -59,61 +176,35 @@ def aggregate(
     )
 
     print("-------------------------- Aggregrator -----------------------")
-    client_id_recv_weights = [
-        c for c in aggregator_state.keys() if "clientweights" in c
-    ]
-    print("CLIENTS WHO HAVE RETURNED - ", client_id_recv_weights)
+    if client_active:
+        try:
+            num_items = training_state.get(f"{client_id}.current_dataset_detail")[
+                "metadata"
+            ]["num_items"]
+        except Exception as e:
+            print("Exception ", e)
+            print("CLIENT_ID DATA = ", client_id)
+            num_items = 1
+        cache.add_client(tier, client_id, client_local_weights, num_items)
+    elif client_id in selected_clients_in_tier:
+        # the tier is updated from the clients that did not drop
+        selected_clients_in_tier.remove(client_id)
+        client_selection_state.put(
+            f"selected_clients_tier_{tier}", selected_clients_in_tier
+        )
+
+    print("CLIENTS WHO HAVE RETURNED - ", cache.received[tier])
     print(f"SELECTED CLIENTS IN TIER {tier}", selected_clients_in_tier)
 
-    if all(
-        f"clientweights_{c}" in client_id_recv_weights for c in selected_clients_in_tier
-    ):
-        tier_model = OrderedDict()
-        client_local_weights = aggregator_state.get(f"clientweights_{client_id}")
-
-        for layer in client_local_weights:
-            shape = client_local_weights[layer].shape
-            tier_model[layer] = zeros(shape)
-
-        client_weights = list()
-
-        N_k = np.array(list())
-        for client_id in selected_clients_in_tier:
-            try:
-                N_k = np.append(
-                    N_k,
-                    training_state.get(f"{client_id}.current_dataset_detail")[
-                        "metadata"
-                    ]["num_items"],
-                )
-            except Exception as e:
-                print("Exception ", e)
-                print("CLIENT_ID DATA = ", client_id)
-            client_weights.append(aggregator_state.get(f"clientweights_{client_id}"))
-
-        N_k = N_k / sum(N_k)
-        for i, weights in enumerate(client_weights):
-            for layer in weights.keys():
-                # fmt: off
-                tier_model[layer] += (weights[layer] * N_k[i])
-                # fmt: on
-
-        tier_count = aggregator_state.get(f"update_count_tier_{tier}")
-
-        aggregator_state.put(f"update_count_tier_{tier}", tier_count + 1)
-        aggregator_state.put(f"tier_model_tier_{tier}", tier_model)
-
-        global_model = get_global_model(num_tiers)
-
-        for c in selected_clients_in_tier:
-            aggregator_state.deletebykey(f"clientweights_{c}")
-
-        client_selection_state.put(f"selected_clients_tier_{tier}", [])
-
-        print("MODEL AGGREGATED\n\n")
-        print("AGGREGATION-END-STATE = ", aggregator_state.keys())
-        return global_model
-
-    else:
-        print("AGGREGATION-END-STATE = ", aggregator_state.keys())
+    if not all(c in cache.received[tier] for c in selected_clients_in_tier):
+        return None
+
+    client_selection_state.put(f"selected_clients_tier_{tier}", [])
+    if not cache.received[tier]:
+        # every selected client dropped
         return None
+
+    cache.update_tier(tier)
+    print("TIER WEIGHTS = ", cache.weights)
+    print("MODEL AGGREGATED\n\n")
+    return cache.get_global_model()
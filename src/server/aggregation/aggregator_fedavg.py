@@ -1,9 +1,17 @@
 from collections import OrderedDict
+from time import time
 from typing import OrderedDict
 
 import numpy as np
 from torch import zeros
 
+from server.round_deadline import (
+    deadline_passed,
+    parse_deadline_args,
+    quorum_reached,
+    record_round_time,
+    staleness_weight,
+)
 from utils.logger import FedLogger
 
 
@@ -23,17 +31,57 @@ def aggregate(
     print("CALLING FEDAVG")
     print("CLIENT ACTIVE", client_active)
     print("AGGREGATOR STATE", aggregator_state.keys())
-    if client_active:
+    deadline_args = parse_deadline_args(args)
+    current_round = training_session.get(f"{session_id}.last_round_number")
+
+    # updates from clients that were cut off in an earlier round
+    late_clients = client_selection_state.get("late_clients") or dict()
+    if client_id in late_clients:
+        late_round, round_start_time = late_clients.pop(client_id)
+        client_selection_state.put("late_clients", late_clients)
+        if round_start_time is not None and not any(
+            r == late_round for r, _ in late_clients.values()
+        ):
+            record_round_time(
+                training_session,
+                session_id,
+                "full",
+                time() - round_start_time,
+                logger,
+            )
+        if client_active and deadline_args["late_policy"] == "fold":
+            # the update is kept as it is now, it is added to the next aggregation even
+            # if the client reports again in between
+            logger.info(
+                "fedserver.aggregator.late_update.fold",
+                f"{client_id},{late_round},{current_round}",
+            )
+            folded_clients = client_selection_state.get("folded_clients") or dict()
+            folded_clients[client_id] = (
+                late_round,
+                client_local_weights,
+                training_state.get(f"{client_id}.current_dataset_detail")["metadata"][
+                    "num_items"
+                ],
+            )
+            client_selection_state.put("folded_clients", folded_clients)
+        else:
+            logger.info(
+                "fedserver.aggregator.late_update.discard",
+                f"{client_id},{late_round},{current_round}",
+            )
+        client_active = None
+    elif client_active:
         aggregator_state.put(f"{client_id}.client_local_weights", client_local_weights)
 
-    finished_clients = aggregator_state.keys()
+    finished_clients = list(aggregator_state.keys())
     print("FINISHED CLIENTS", finished_clients)
 
     active_clients = [
         c for c in client_info.keys() if client_info.get(f"{c}.is_active")
     ]
 
-    selected_clients = client_selection_state.get("selected_clients")
+    selected_clients = client_selection_state.get("selected_clients") or list()
 
     if client_active == False:
         try:
@@ -44,12 +92,50 @@ def aggregate(
             print("EXCEPTION E", e)
 
     clients_to_wait_for = [c for c in selected_clients if c in active_clients]
+    finished_selected_clients = [c for c in selected_clients if c in finished_clients]
 
-    if len(finished_clients) > 0 and all(
+    all_finished = len(finished_clients) > 0 and all(
         c in finished_clients for c in clients_to_wait_for
-    ):
+    )
+    cutoff = not all_finished and (
+        quorum_reached(
+            finished_selected_clients,
+            selected_clients,
+            deadline_args["min_fraction"],
+        )
+        or (finished_selected_clients and deadline_passed(client_selection_state))
+    )
+
+    if all_finished or cutoff:
         try:
             print("AGGREGATOR:: Aggregating clients - ", finished_clients)
+            round_start_time = client_selection_state.get("round_start_time")
+            stragglers = [c for c in clients_to_wait_for if c not in finished_clients]
+            if cutoff:
+                logger.info(
+                    "fedserver.aggregator.cutoff",
+                    f"{current_round},{len(finished_selected_clients)},{len(selected_clients)},{'-'.join(stragglers)}",
+                )
+                for straggler in stragglers:
+                    late_clients[straggler] = [current_round, round_start_time]
+                client_selection_state.put("late_clients", late_clients)
+            if round_start_time is not None:
+                record_round_time(
+                    training_session,
+                    session_id,
+                    "cutoff",
+                    time() - round_start_time,
+                    logger,
+                )
+                if not stragglers:
+                    record_round_time(
+                        training_session,
+                        session_id,
+                        "full",
+                        time() - round_start_time,
+                        logger,
+                    )
+            client_selection_state.put("round_deadline", None)
             N = 0
             global_model = OrderedDict()
             temp_model = aggregator_state.get(
@@ -76,6 +162,26 @@ def aggregate(
                     aggregator_state.get(f"{client_id}.client_local_weights")
                 )
 
+            # late updates folded in from earlier rounds count less the older they are
+            folded_clients = client_selection_state.get("folded_clients") or dict()
+            for client_id, (late_round, weights, num_items) in folded_clients.items():
+                if client_id in finished_clients:
+                    # superseded by the client's update of this round
+                    logger.info(
+                        "fedserver.aggregator.late_update.superseded",
+                        f"{client_id},{late_round},{current_round}",
+                    )
+                    continue
+                N_k = np.append(
+                    N_k,
+                    num_items
+                    * staleness_weight(
+                        current_round - late_round, deadline_args["staleness_exponent"]
+                    ),
+                )
+                client_weights.append(weights)
+            client_selection_state.put("folded_clients", dict())
+
             N_k = N_k / sum(N_k)
             print("N_k", N_k)
 
@@ -0,0 +1,127 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+from collections import OrderedDict
+
+import torch
+
+from server.round_deadline import staleness_weight
+from utils.logger import FedLogger
+
+DEFAULT_FEDBUFF_ARGS = {
+    # number of client updates buffered before the global model is updated
+    "buffer_size": 10,
+    # step size of the buffered update on the global model
+    "server_lr": 1.0,
+    # updates are weighted by (1 + staleness) ** -staleness_exponent
+    "staleness_exponent": 0.5,
+}
+
+# buffers of the running sessions, in the server process, by session_id, freed by
+# reset when a session starts or ends
+_buffers = dict()
+
+
+class UpdateBuffer:
+    """Staleness-weighted sum of the client models received since the last update of
+    the global model, allocated once from the first model and summed into in place."""
+
+    def __init__(self) -> None:
+        self.weighted_sum = None
+        self.weight_sum = 0.0
+        self.count = 0
+
+    def add(self, weights: OrderedDict, weight: float) -> None:
+        if self.weighted_sum is None:
+            # float64 so that integer buffers, e.g. num_batches_tracked, are averaged too
+            self.weighted_sum = OrderedDict(
+                (layer, torch.zeros(w.shape, dtype=torch.float64))
+                for layer, w in weights.items()
+            )
+        for layer, w in weights.items():
+            self.weighted_sum[layer].add_(w.detach().cpu(), alpha=weight)
+        self.weight_sum += weight
+        self.count += 1
+
+    def apply(self, global_model: OrderedDict, server_lr: float) -> OrderedDict:
+        """global + server_lr / count * sum(weight * (local - global)), computed as a
+        blend of the global model with the weighted mean of the buffered models."""
+        alpha = server_lr * self.weight_sum / self.count
+        for layer, w in global_model.items():
+            mean = self.weighted_sum[layer] / self.weight_sum
+            blended = (1 - alpha) * w.to(torch.float64) + alpha * mean
+            global_model[layer] = blended.to(w.dtype)
+        self.weighted_sum = None
+        self.weight_sum = 0.0
+        self.count = 0
+        return global_model
+
+
+def reset(session_id) -> None:
+    """Drops the buffered updates of the session, called by the session manager when
+    the session starts and ends."""
+    _buffers.pop(session_id, None)
+
+
+def parse_fedbuff_args(args) -> dict:
+    fedbuff_args = dict(DEFAULT_FEDBUFF_ARGS)
+    if isinstance(args, dict):
+        for key in DEFAULT_FEDBUFF_ARGS:
+            fedbuff_args[key] = args.get(key, fedbuff_args[key])
+    fedbuff_args["buffer_size"] = max(1, int(fedbuff_args["buffer_size"]))
+    return fedbuff_args
+
+
+def aggregate(
+    session_id,
+    client_id,
+    client_active,
+    client_local_weights,
+    client_info,
+    training_state,
+    training_session,
+    aggregator_state,
+    client_selection_state,
+    args,
+):
+    """
+    Buffered asynchronous aggregation (Nguyen et al., "Federated Learning with Buffered
+    Asynchronous Aggregation"). Each update is added to the buffer of the session with
+    the weight of its staleness, the number of global model updates since the client
+    was selected by client_selection_fedasync, and the global model is read and updated
+    once every buffer_size updates instead of once per update.
+    """
+    logger = FedLogger(id=session_id, loggername="AGGREGATOR")
+    if client_id is None:
+        # round deadline, nothing is aggregated without an update
+        return None
+    if not client_active:
+        client_selection_state.deletebykey(f"{client_id}")
+        return None
+
+    fedbuff_args = parse_fedbuff_args(args)
+    current_round = training_session.get(f"{session_id}.last_round_number")
+    model_version = client_selection_state.get(f"{client_id}")
+    if model_version is None:
+        model_version = current_round
+    staleness = max(0, current_round - model_version)
+    client_selection_state.deletebykey(f"{client_id}")
+
+    buffer = _buffers.setdefault(session_id, UpdateBuffer())
+    buffer.add(
+        client_local_weights,
+        staleness_weight(staleness, fedbuff_args["staleness_exponent"]),
+    )
+    logger.info(
+        "fedserver.aggregator.fedbuff.buffered",
+        f"client_id-round-staleness-buffered,{client_id},{current_round},{staleness},{buffer.count}",
+    )
+    if buffer.count < fedbuff_args["buffer_size"]:
+        return None
+
+    global_model = training_session.get(f"{session_id}.global_model")
+    return buffer.apply(global_model, fedbuff_args["server_lr"])
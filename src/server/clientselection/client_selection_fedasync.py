@@ -22,6 +22,25 @@ def client_selection(
     rng = np.random.default_rng()
     print("IN CLIENT SELECT")
 
+    concurrency = args.get("concurrency")
+    if concurrency is not None:
+        # keep "concurrency" clients training, the aggregator removes a client from
+        # client_selection_state when its update arrives
+        in_flight = [
+            c
+            for c in client_info.keys()
+            if client_selection_state.get(f"{c}") is not None
+        ]
+        num_clients = min(int(concurrency) - len(in_flight), len(selectable_clients))
+        if num_clients <= 0:
+            return None, None
+        selected_clients = rng.choice(
+            a=selectable_clients, size=num_clients, replace=False
+        )
+        for client in selected_clients:
+            client_selection_state.put(f"{client}", current_round)
+        return selected_clients, None
+
     client_fraction = args["client_fraction"]
     print("CLIENT FRACTION", client_fraction)
     if current_round == 0:
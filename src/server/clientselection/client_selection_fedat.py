@@ -1,5 +1,7 @@
 import numpy as np
-from sklearn.cluster import AgglomerativeClustering
+
+from server.latency_estimator import get_client_latencies, session_batch_size
+from server.tiering import get_client_tiers, get_num_tiers
 
 
 def client_selection(
@@ -17,11 +19,22 @@ def client_selection(
 
     current_round = training_session.get(f"{session_id}.last_round_number")
     print("CURRENT_ROUND = ", current_round)
+
+    model_id = training_state.get(f"{selectable_clients[0]}.current_model_id")
+    client_latencies = get_client_latencies(
+        client_info,
+        selectable_clients,
+        model_id,
+        batch_size=session_batch_size(training_session, session_id),
+    )
+    print("Client Latencies = ", client_latencies)
+
     # print(type(aggregate_state))
     if current_round == 0 and len(aggregate_state.keys()) == 0:
         try:
             num_tiers = args["num_tiers"]
         except Exception as e:
+            num_tiers = 1
             print(f"CLIENT_SELECTION.TiFL:: Exception - {e} \nSetting num_tiers = 1")
 
         if len(selectable_clients) < num_tiers:
@@ -30,39 +43,21 @@ def client_selection(
             )
             num_tiers = len(selectable_clients)
 
-        model_id = training_state.get(f"{selectable_clients[0]}.current_model_id")
-        client_latencies = list()
-        for client in selectable_clients:
-            client_benchmark_info = client_info.get(f"{client}.benchmark_info")[
-                model_id
-            ]
-            client_latency = (
-                client_benchmark_info["time_taken_s"]
-                / client_benchmark_info["num_mini_batches"]
-            ) * 100
-            client_latencies.append(client_latency)
-
-        print("Client Latencies = ", client_latencies)
-
-        reshaped_client_latencies = np.array(client_latencies).reshape(-1, 1)
-        agglomerative = AgglomerativeClustering(
-            n_clusters=num_tiers, metric="euclidean"
+        client_to_tier_id = get_client_tiers(
+            client_selection_state, client_latencies, num_tiers, current_round, args
         )
-        client_tiers_id = agglomerative.fit_predict(reshaped_client_latencies)
-        client_to_tier_id = dict()
-
-        for i in range(len(selectable_clients)):
-            client_to_tier_id[selectable_clients[i]] = client_tiers_id[i]
+        num_tiers = get_num_tiers(client_selection_state)
 
         print("CLIENT_TO_TIER_ID = ", client_to_tier_id)
 
         selectable_client_to_tier_id = {
-            c: client_to_tier_id[c] for c in selectable_clients
+            c: client_to_tier_id[c]
+            for c in selectable_clients
+            if c in client_to_tier_id
         }
 
         # print("SELECTABLE_CLIENT TO", selectable_client_to_tier_id)
-        tier_ids = np.unique(list(selectable_client_to_tier_id.values()))
-        client_tiers = [list() for i in tier_ids]
+        client_tiers = [list() for i in range(num_tiers)]
 
         for client_id in selectable_client_to_tier_id.keys():
             client_tiers[selectable_client_to_tier_id[client_id]].append(client_id)
@@ -88,22 +83,32 @@ def client_selection(
 
         print("SELECTED_CLIENTS", selected_clients)
 
-        global_model = training_session.get(f"{session_id}.global_model")
+        # the tier models start from the global model in the tier cache of the aggregator
         for i in range(num_tiers):
             aggregate_state.put(f"update_count_tier_{i}", 0)
-            aggregate_state.put(
-                f"tier_model_tier_{i}",
-                global_model,
-            )
-        client_selection_state.put("client_to_tier_id_dict", client_to_tier_id)
         return selected_clients, None
 
     else:
-        client_to_tier_dict = client_selection_state.get("client_to_tier_id_dict")
+        # clients that are training keep their tier until their tier model is updated
+        training_clients = [
+            c
+            for i in range(get_num_tiers(client_selection_state))
+            for c in client_selection_state.get(f"selected_clients_tier_{i}") or []
+        ]
+        client_to_tier_dict = get_client_tiers(
+            client_selection_state,
+            client_latencies,
+            get_num_tiers(client_selection_state),
+            current_round,
+            args,
+            pinned_clients=training_clients,
+        )
         # active_client_to_tier_id = [client_to_tier_dict[c] for c in selectable_clients]
 
         selectable_client_to_tier_id = {
-            c: client_to_tier_dict[c] for c in selectable_clients
+            c: client_to_tier_dict[c]
+            for c in selectable_clients
+            if c in client_to_tier_dict
         }
         tier_ids = np.unique(list(selectable_client_to_tier_id.values()))
         print("-------------------------- Client Selection -----------------------")
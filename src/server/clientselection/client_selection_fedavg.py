@@ -9,6 +9,8 @@ import math
 
 import numpy as np
 
+from server.round_deadline import round_in_progress
+
 
 def client_selection(
     selectable_clients: list,
@@ -21,7 +23,10 @@ def client_selection(
     args: dict = None,
 ):
     print("CLIENT SELECTION CALLED!")
-    if len(aggregate_state.keys()) == 0:
+    # late updates from cut-off clients wake the server without finishing the round
+    if len(aggregate_state.keys()) == 0 and not round_in_progress(
+        client_info, client_selection_state
+    ):
         C = args["client_fraction"]
         M = max(1, int(C * len(selectable_clients)))
         rng = np.random.default_rng()
@@ -5,11 +5,11 @@ Copyright 2023 Indian Institute of Science
 Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
 """
 
-import math
-import random
-
 import numpy as np
-from sklearn.cluster import AgglomerativeClustering
+
+from server.latency_estimator import session_batch_size
+from server.selection_context import SelectionContext, group_by_tier, tier_mean
+from server.tiering import get_client_tiers, get_num_tiers
 
 
 def client_selection(
@@ -25,32 +25,26 @@ def client_selection(
     if len(selectable_clients) == 0:
         return None, None
 
+    context = SelectionContext(
+        selectable_clients,
+        client_info,
+        training_state,
+        batch_size=session_batch_size(training_session, session_id),
+    )
+
     def get_client_clusters(num_clusters):
-        client_histograms = dict()
-        unique_labels = []
-        for c in selectable_clients:
-            client_histograms[c] = training_state.get(f"{c}.current_dataset_detail")[
-                "metadata"
-            ]["label_distribution"]
-            unique_labels.extend(client_histograms[c].keys())
-
-        print("CLIENT_HISTOGRAMS = ", client_histograms)
-        unique_labels = list(set(unique_labels))
-
-        client_label_histograms = []
-        for c in selectable_clients:
-            client_label_histograms.append(
-                [
-                    client_histograms[c][x] if x in client_histograms[c].keys() else 0.0
-                    for x in unique_labels
-                ]
-            )
-        print("CLIENT_LABEL_HISTOGRAMS = ", client_label_histograms)
-        agglomerative = AgglomerativeClustering(
-            n_clusters=num_clusters, metric="euclidean"
+        # labels keep their position across rounds, new labels are appended
+        histograms, label_order = context.label_histograms(
+            client_selection_state.get("cluster_label_order")
+        )
+        client_selection_state.put("cluster_label_order", label_order)
+        return get_client_tiers(
+            client_selection_state,
+            dict(zip(context.ids.tolist(), histograms)),
+            num_clusters,
+            current_round,
+            args,
         )
-        agglomerative.fit(client_label_histograms)
-        return agglomerative.labels_
 
     current_round = training_session.get(f"{session_id}.last_round_number")
     print("CURRENT_ROUND = ", current_round)
@@ -63,28 +57,11 @@ def client_selection(
                 num_clusters = 1
                 print("CLIENT_SELECTION:: num_clusters = 1")
 
-            cluster_labels = get_client_clusters(num_clusters=num_clusters)
-            print("CLUSTER_LABELS", cluster_labels)
-
-            client_to_cluster_dict = dict()
-            for i, client_id in enumerate(selectable_clients):
-                client_to_cluster_dict[client_id] = cluster_labels[i]
+            client_to_cluster_dict = get_client_clusters(num_clusters=num_clusters)
             print("CLIENT_TO_CLUSTER_DICT =", client_to_cluster_dict)
-            client_latencies = dict()
-
-            model_id = training_state.get(f"{selectable_clients[0]}.current_model_id")
-            for client in selectable_clients:
-                client_benchmark_info = client_info.get(f"{client}.benchmark_info")[
-                    model_id
-                ]
-                client_latency = (
-                    client_benchmark_info["time_taken_s"]
-                    / client_benchmark_info["num_mini_batches"]
-                ) * 100
-                client_latencies[client] = client_latency
+            client_latencies = context.latencies()
 
             print("CLIENT_LATENCIES", client_latencies)
-            client_selection_state.put("client_to_cluster_dict", client_to_cluster_dict)
             client_selection_state.put("client_latencies", client_latencies)
 
             client_selection_state.put("selected_clients", selectable_clients)
@@ -108,89 +85,63 @@ def client_selection(
 
         num_clients = max(1, int(client_fraction * len(selectable_clients)))
 
-        client_to_cluster_dict = client_selection_state.get("client_to_cluster_dict")
-
-        selectable_client_to_cluster_ids = {
-            c: client_to_cluster_dict[c] for c in selectable_clients
-        }
-
-        cluster_ids = np.unique(list(selectable_client_to_cluster_ids.values()))
-
-        # client_clusters = [
-        #     list(selectable_clients[selectable_client_to_cluster_ids == id])
-        #     for id in np.unique(selectable_client_to_cluster_ids)
-        # ]
-        client_clusters = [list() for i in cluster_ids]
-        for client_id in selectable_client_to_cluster_ids:
-            client_clusters[selectable_client_to_cluster_ids[client_id]].append(
-                client_id
-            )
-
-        num_clusters = len(client_clusters)
-
-        client_latencies = client_selection_state.get("client_latencies")
-        print("CLIENT_LATENCIES = ", client_latencies)
-        print("CLIENT_CLUSTERS = ", client_clusters)
-
-        cluster_loss = []
-
-        for cluster in client_clusters:
-            avg_loss = 0.0
-            for client in cluster:
-                # print(client)
-                # print(training_state.get(f"{client}.training_metrics")[training_state.get(f"{client}.last_round_participated")])
-                avg_loss += training_state.get(f"{client}.training_metrics")[
-                    training_state.get(f"{client}.last_round_participated")
-                ]["loss"]
-            cluster_loss.append(avg_loss / len(cluster))
-
+        # new clients join the nearest cluster, all clients are re-clustered periodically
+        client_to_cluster_dict = get_client_clusters(
+            num_clusters=get_num_tiers(client_selection_state)
+        )
+        clusters = np.array([client_to_cluster_dict[c] for c in context.ids.tolist()])
+
+        # latencies follow the online estimate, updated after every training round
+        latency = context.latency()
+        client_latencies = client_selection_state.get("client_latencies") or dict()
+        client_latencies.update(context.latencies())
+        client_selection_state.put("client_latencies", client_latencies)
+
+        # rows of each non-empty cluster, fastest client first
+        order = np.lexsort((np.where(np.isnan(latency), np.inf, latency), clusters))
+        cluster_ids, client_clusters = group_by_tier(clusters[order])
+        client_clusters = [order[rows] for rows in client_clusters]
+        num_clusters = len(cluster_ids)
+        print("CLIENT_CLUSTERS = ", [context.select(c) for c in client_clusters])
+
+        # clients that joined after round 0 may not have trained yet
+        cluster_loss = tier_mean(
+            context.training_loss, clusters, int(cluster_ids.max()) + 1
+        )[cluster_ids]
         print("CLUSTER_LOSS = ", cluster_loss)
-        cluster_latency = []
-        for cluster in client_clusters:
-            cluster_latency.append(
-                max([client_latencies[client] for client in cluster])
-            )
+        cluster_latency = np.array(
+            [np.nanmax(latency[rows], initial=0.0) for rows in client_clusters]
+        )
         print("CLUSTER_LATENCIES = ", cluster_latency)
-        sorted_clusters_by_latencies = []
-        for cluster in client_clusters:
-            sorted_clusters_by_latencies.append(
-                [
-                    k
-                    for k, v in sorted(
-                        client_latencies.items(), key=lambda item: item[1]
-                    )
-                    if k in cluster
-                ]
-            )
 
-        print("SORTED CLUSTERS = ", sorted_clusters_by_latencies)
+        max_cluster_latency = cluster_latency.max() or 1.0
+        reduction_in_latency = 1 - cluster_latency / max_cluster_latency
 
-        max_cluster_latency = max(cluster_latency)
-        reduction_in_latency = [1 - x / max_cluster_latency for x in cluster_latency]
-
-        sum_cluster_loss = sum(cluster_loss)
-        # fmt:off
-        cluster_weights = [
-            (loss_latency_tradeoff * reduction_in_latency[i])
-            + (1 - loss_latency_tradeoff) * cluster_loss[i] / sum_cluster_loss
-            for i in range(num_clusters)
-        ]
-        # fmt:on
+        sum_cluster_loss = cluster_loss.sum() or 1.0
+        cluster_weights = (
+            loss_latency_tradeoff * reduction_in_latency
+            + (1 - loss_latency_tradeoff) * cluster_loss / sum_cluster_loss
+        )
         print("CLUSTER_WEIGHTS = ", cluster_weights)
 
-        cluster_choices = random.choices(
-            range(num_clusters), weights=cluster_weights, k=num_clients
+        if cluster_weights.sum() > 0:
+            probabilities = cluster_weights / cluster_weights.sum()
+        else:
+            probabilities = np.full(num_clusters, 1.0 / num_clusters)
+        cluster_choices = np.random.default_rng().choice(
+            num_clusters, size=num_clients, p=probabilities
         )
         print(cluster_choices)
 
-        selected_clients = []
-        for cluster in cluster_choices:
-            try:
-                selected_clients.append(client_clusters[cluster].pop(0))
-            except:
-                print(
-                    "WARNING!! No clients left in cluster to choose. Skipping choice."
-                )
+        # each choice of a cluster takes its fastest remaining client
+        counts = np.bincount(cluster_choices, minlength=num_clusters)
+        if np.any(counts > [len(rows) for rows in client_clusters]):
+            print("WARNING!! No clients left in cluster to choose. Skipping choice.")
+        selected_clients = context.select(
+            np.concatenate(
+                [rows[:count] for rows, count in zip(client_clusters, counts)]
+            )
+        )
 
         client_selection_state.put("selected_clients", selected_clients)
 
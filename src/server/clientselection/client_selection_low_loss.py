@@ -7,47 +7,47 @@ Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/L
 
 import math
 
-import yaml
+import numpy as np
+
+from server.round_deadline import round_in_progress
+from server.selection_context import SelectionContext, top_k
 
 
 def client_selection(
-    logger_id: str,
-    client_list: list,
-    client_tiers,
-    round_no: int,
-    client_state: dict = None,
-    client_session: dict = None,
-    global_model_metrics: dict = None,
+    selectable_clients: list,
+    session_id: str,
+    client_info: dict,
+    training_state: dict,
+    training_session: dict,
+    aggregate_state: dict,
+    client_selection_state: dict,
     args: dict = None,
 ):
-    percent_clients = args["percentage_client_selection"]
-
-    if round_no == 1:
-        selected_clients = client_list
-
-    else:
-        latest_loss = dict()
-
-        for client in client_list:
-            latest_loss[client] = (
-                client_session[client]["validation_metrics"][1]["loss"]
-                if client_session[client]["validation_metrics"][0]
-                >= client_session[client]["last_round_participated"]
-                else client_session[client]["metrics"]["loss"]
-            )
-
-        num_clients = math.floor(len(client_list) * (percent_clients / 100))
-
-        if num_clients > len(client_list):
-            num_clients = len(client_list)
-
-        if num_clients == 0:
-            print(
-                "CLIENT_SELECTION.low_loss:: Number of clients to be selected from a tier came to be zero. Setting value to one."
-            )
-            num_clients = 1
-
-        sorted_clients = sorted(latest_loss.items(), lambda x: x[1])
-        selected_clients = sorted_clients.keys()[:num_clients]
-
-    return None, selected_clients
+    """
+    Selects the "percentage_client_selection" percent of the clients with the lowest
+    latest loss, validation loss if the client validated after it last trained and
+    training loss otherwise. Clients without a loss are selected first.
+    """
+    if len(selectable_clients) == 0:
+        return None, None
+    if len(aggregate_state.keys()) != 0 or round_in_progress(
+        client_info, client_selection_state
+    ):
+        return None, None
+
+    percent_clients = (args or dict()).get("percentage_client_selection", 100)
+    num_clients = math.floor(len(selectable_clients) * (percent_clients / 100))
+    num_clients = min(num_clients, len(selectable_clients))
+    if num_clients == 0:
+        print(
+            "CLIENT_SELECTION.low_loss:: Number of clients to be selected came to be zero. Setting value to one."
+        )
+        num_clients = 1
+
+    context = SelectionContext(selectable_clients, client_info, training_state)
+    # clients without a loss yet rank below every known loss
+    loss = np.where(np.isnan(context.loss), -np.inf, context.loss)
+    selected_clients = context.select(top_k(loss, num_clients, largest=False))
+
+    client_selection_state.put("selected_clients", selected_clients)
+    return selected_clients, None
@@ -6,50 +6,51 @@ Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/L
 """
 
 import math
-import random
 
 import numpy as np
 
+from server.round_deadline import round_in_progress
+from server.selection_context import SelectionContext, weighted_sample
+
 
 def client_selection(
-    logger_id: str,
-    client_list: list,
-    client_tiers,
-    round_no: int,
-    client_state: dict = None,
-    client_session: dict = None,
-    global_model_metrics: dict = None,
+    selectable_clients: list,
+    session_id: str,
+    client_info: dict,
+    training_state: dict,
+    training_session: dict,
+    aggregate_state: dict,
+    client_selection_state: dict,
     args: dict = None,
 ):
-    percent_clients = args["percentage_client_selection"]
-
-    if round_no == 1:
-        # selected_clients = client_list
-        selected_clients = np.random.choice(
-            a=client_list, size=num_clients, replace=False
-        )
-    else:
-        latest_loss = []
-
-        for client in client_list:
-            latest_loss.append(client_session[client]["valdiation_metrics"][0])
-
-        loss_sum = sum(latest_loss)
-        client_probabilities = [item / loss_sum for item in latest_loss]
-
-        num_clients = math.floor(len(client_list) * (percent_clients / 100))
-
-        if num_clients > len(client_list):
-            num_clients = len(client_list)
-
-        if num_clients == 0:
-            print(
-                "CLIENT_SELECTION.probabilistic_high_loss:: Number of clients to be selected from a tier came to be zero. Setting value to one."
-            )
-            num_clients = 1
-
-        selected_clients = np.random.choice(
-            a=client_list, p=client_probabilities, size=num_clients, replace=False
+    """
+    Samples the "percentage_client_selection" percent of the clients without
+    replacement, with probability proportional to their latest loss. Clients without a
+    loss weigh as much as the highest known loss.
+    """
+    if len(selectable_clients) == 0:
+        return None, None
+    if len(aggregate_state.keys()) != 0 or round_in_progress(
+        client_info, client_selection_state
+    ):
+        return None, None
+
+    percent_clients = (args or dict()).get("percentage_client_selection", 100)
+    num_clients = math.floor(len(selectable_clients) * (percent_clients / 100))
+    num_clients = min(num_clients, len(selectable_clients))
+    if num_clients == 0:
+        print(
+            "CLIENT_SELECTION.probabilistic_high_loss:: Number of clients to be selected came to be zero. Setting value to one."
         )
-
-    return None, selected_clients
+        num_clients = 1
+
+    context = SelectionContext(selectable_clients, client_info, training_state)
+    loss = context.loss
+    known = ~np.isnan(loss)
+    fill = loss[known].max() if known.any() else 1.0
+    selected_clients = context.select(
+        weighted_sample(np.where(known, loss, fill), num_clients)
+    )
+
+    client_selection_state.put("selected_clients", selected_clients)
+    return selected_clients, None
@@ -8,7 +8,10 @@ Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/L
 import time
 
 import numpy as np
-from sklearn.cluster import AgglomerativeClustering
+
+from server.latency_estimator import session_batch_size
+from server.selection_context import SelectionContext, get_active, group_by_tier
+from server.tiering import get_client_tiers, get_num_tiers
 
 np.random.seed()
 
@@ -27,6 +30,12 @@ def client_selection(
 
     if len(selectable_clients) == 0:
         return None, None
+    context = SelectionContext(
+        selectable_clients,
+        client_info,
+        training_state,
+        batch_size=session_batch_size(training_session, session_id),
+    )
 
     if len(aggregate_state.keys()) == 0:
         try:
@@ -55,22 +64,19 @@ def client_selection(
                 #     "clients_validating = ",
                 #     client_selection_state.get("client_ids_validating"),
                 # )
-                active_clients = [
-                    c for c in client_info.keys() if client_info.get(f"{c}.is_active")
-                ]
-
+                clients_validating = client_selection_state.get("client_ids_validating")
+                active = get_active(client_info, clients_validating)
                 clients_to_wait_for = [
-                    c
-                    for c in client_selection_state.get("client_ids_validating")
-                    if c in active_clients
+                    c for c, a in zip(clients_validating, active.tolist()) if a
                 ]
-                if all([c in selectable_clients for c in clients_to_wait_for]):
+                if all(c in context.index for c in clients_to_wait_for):
                     client_selection_state.put("val_ongoing", False)
-                    latest_loss = dict()
-                    for client in selectable_clients:
-                        latest_loss[client] = training_state.get(
-                            f"{client}.validation_metrics"
-                        )[current_round]["loss"]
+                    validation_loss = context.validation_loss(current_round)
+                    latest_loss = {
+                        c: float(x)
+                        for c, x in zip(context.ids.tolist(), validation_loss)
+                        if not np.isnan(x)
+                    }
                     client_selection_state.put("client_validation_losses", latest_loss)
                     print("Validation for round ", current_round, " ends")
 
@@ -83,13 +89,30 @@ def client_selection(
                     f"CLIENT_SELECTION.TIFL:: Error {e}. Setting client_fraction = 1."
                 )
 
-            if current_round == 0:
-                try:
-                    num_tiers = args["num_tiers"]
-                except Exception as e:
-                    num_tiers = 1
-                    print(f"CLIENT_SELECTION.TIFL:: Error {e}. Setting num_tiers = 1.")
+            try:
+                num_tiers = args["num_tiers"]
+            except Exception as e:
+                num_tiers = 1
+                print(f"CLIENT_SELECTION.TIFL:: Error {e}. Setting num_tiers = 1.")
+
+            print("Current model id = ", context.model_id)
+
+            client_latencies = context.latencies()
+
+            print("CLIENT LATENCIES = ", client_latencies)
+
+            # new clients join the nearest tier, all clients are re-tiered periodically
+            client_to_tier_dict = get_client_tiers(
+                client_selection_state,
+                client_latencies,
+                num_tiers,
+                current_round,
+                args,
+            )
 
+            print(f"CLIENT_SELECTION:: client_tiers = ", client_to_tier_dict)
+
+            if current_round == 0:
                 try:
                     credits_per_tier = args["credits_per_tier"]
                 except Exception as e:
@@ -98,160 +121,95 @@ def client_selection(
                         f"CLIENT_SELECTION.TIFL:: Error {e}. Setting credits_per_tier = 10."
                     )
 
-                model_id = training_state.get(
-                    f"{selectable_clients[0]}.current_model_id"
-                )
-
-                print("Current model id = ", model_id)
-
-                client_latencies = list()
-                for client in selectable_clients:
-                    print(
-                        "Benchmark info = ", client_info.get(f"{client}.benchmark_info")
-                    )
-                    client_benchmark_info = client_info.get(f"{client}.benchmark_info")[
-                        model_id
-                    ]
-                    client_latency = (
-                        client_benchmark_info["time_taken_s"]
-                        / client_benchmark_info["num_mini_batches"]
-                    ) * 100
-                    client_latencies.append(client_latency)
-
-                print("CLIENT LATENCIES = ", client_latencies)
-
-                reshaped_client_latencies = np.array(client_latencies).reshape(-1, 1)
-                agglomerative = AgglomerativeClustering(
-                    n_clusters=num_tiers, metric="euclidean"
-                )
-                client_tiers = agglomerative.fit_predict(reshaped_client_latencies)
-
-                client_to_tier_id = dict()
-
-                for i in range(len(selectable_clients)):
-                    client_to_tier_id[selectable_clients[i]] = client_tiers[i]
-
-                print(f"CLIENT_SELECTION:: client_tiers = ", client_to_tier_id)
-
-                # tier_credits = {
-                #     t_id: credits_per_tier for t_id in np.unique(client_tiers)
-                # }
                 print("CREDITS_PER_TIER = ", credits_per_tier)
-                for i in range(num_tiers):
+                for i in range(get_num_tiers(client_selection_state)):
                     client_selection_state.put(f"tier_{i}_credits", credits_per_tier)
 
-                # client_selection_state.put("tier_credits_dict", tier_credits)
-                client_selection_state.put("client_to_tier_id_dict", client_to_tier_id)
-
-            client_to_tier_dict = client_selection_state.get("client_to_tier_id_dict")
-            latest_loss = client_selection_state.get("client_validation_losses")
-
-            selectable_client_to_tier_id_dict = {
-                c: client_to_tier_dict[c] for c in selectable_clients
-            }
-
-            selectable_tier_ids_list = np.unique(
-                list(selectable_client_to_tier_id_dict.values())
+            latest_loss = (
+                client_selection_state.get("client_validation_losses") or dict()
             )
-            selectable_num_tiers = len(selectable_tier_ids_list)
 
-            selectable_tier_credits = [
-                client_selection_state.get(f"tier_{x}_credits")
-                for x in selectable_tier_ids_list
-            ]
+            # tiers of the selectable clients that have one, and their rows
+            tiered = np.array(
+                [
+                    i
+                    for i, c in enumerate(context.ids.tolist())
+                    if c in client_to_tier_dict
+                ],
+                dtype=np.int64,
+            )
+            tiers = np.array(
+                [client_to_tier_dict[c] for c in context.select(tiered)], dtype=np.int64
+            )
+            selectable_tier_ids, client_tiers = group_by_tier(tiers)
+            selectable_tier_credits = np.array(
+                [
+                    credits or 0
+                    for credits in client_selection_state.getmany(
+                        [f"tier_{x}_credits" for x in selectable_tier_ids.tolist()]
+                    )
+                ],
+                dtype=np.int64,
+            )
 
-            tier_ids = [
-                selectable_tier_ids_list[i]
-                for i in range(selectable_num_tiers)
-                if selectable_tier_credits[i] != 0
+            with_credits = selectable_tier_credits != 0
+            tier_ids = selectable_tier_ids[with_credits].tolist()
+            tier_credits = selectable_tier_credits[with_credits]
+            client_tiers = [
+                tiered[rows] for rows, c in zip(client_tiers, with_credits) if c
             ]
-
             current_num_tiers = len(tier_ids)
 
             if current_num_tiers == 0:
                 print(f"CLIENT_SELECTION.TIFL:: No tier has credits left!")
                 return None, None
 
-            tier_credits = [selectable_tier_credits[x] for x in tier_ids]
-
             print("TIER = ", tier_ids)
-            print("BEFORE SELECT TIER CREDITS = ", tier_credits)
-
-            selectable_clients_to_tier_id_w_credits_dict = {
-                c: selectable_client_to_tier_id_dict[c]
-                for c in selectable_client_to_tier_id_dict.keys()
-                if selectable_client_to_tier_id_dict[c] in tier_ids
-            }
+            print("BEFORE SELECT TIER CREDITS = ", tier_credits.tolist())
 
-            print(
-                "SELECTABLE CLIENTS WITH CREDITS = ",
-                selectable_clients_to_tier_id_w_credits_dict,
-                len(selectable_clients_to_tier_id_w_credits_dict),
+            # clients that joined after the last validation round have no loss yet
+            losses = np.array(
+                [latest_loss.get(c, np.nan) for c in context.ids.tolist()],
+                dtype=np.float64,
+            )
+            tier_avg_loss = np.array(
+                [
+                    np.nanmean(losses[rows]) if np.any(~np.isnan(losses[rows])) else 0.0
+                    for rows in client_tiers
+                ]
             )
 
-            client_tiers = [list() for i in tier_ids]
-            for client_id in selectable_clients_to_tier_id_w_credits_dict:
-                client_tiers[
-                    tier_ids.index(
-                        selectable_clients_to_tier_id_w_credits_dict[client_id]
-                    )
-                ].append(client_id)
-
-            tier_avg_loss = list()
-
-            print("CLIENT TIERS = ", client_tiers)
-            for i, tier in enumerate(client_tiers):
-                loss_sum = 0.0
-                for _, client in enumerate(tier):
-                    loss_sum += latest_loss[client]
-                assert len(client_tiers[i]) != 0  # asserting that a tier is not empty
-                tier_avg_loss.append(loss_sum / len(client_tiers[i]))
-
-            sorted_tier_index = (-np.array(tier_avg_loss)).argsort()
+            sorted_tier_index = (-tier_avg_loss).argsort()
             print("TIER AVG LOSS = ", tier_avg_loss)
             print("SORTED_TIER_INDEX = ", sorted_tier_index)
-            tier_probs = list()
 
             if current_num_tiers > 1:
+                # the i-th highest loss tier is chosen with probability (tiers - i) / D
                 D = current_num_tiers * (current_num_tiers - 1) // 2
-                for i in range(1, current_num_tiers + 1):
-                    tier_probs.append((current_num_tiers - i) / D)
-
-                chosen_tier = None
-
+                tier_probs = (
+                    current_num_tiers - np.arange(1, current_num_tiers + 1)
+                ) / D
                 print("TIER PROBS = ", tier_probs)
-                while True:
-                    chosen_tier = tier_ids[
-                        np.random.choice(a=sorted_tier_index, p=tier_probs, size=1)[0]
-                    ]
-                    print(f"Chosen tier for round {current_round} is = {chosen_tier}")
-                    if tier_credits[chosen_tier] > 0:
-                        break
+                chosen = np.random.choice(a=sorted_tier_index, p=tier_probs)
             else:
-                chosen_tier = tier_ids[0]
+                chosen = 0
+            chosen_tier = tier_ids[chosen]
+            print(f"Chosen tier for round {current_round} is = {chosen_tier}")
 
-            num_clients = min(
-                len(client_tiers[tier_ids.index(chosen_tier)]), num_clients
-            )
+            num_clients = min(len(client_tiers[chosen]), num_clients)
 
-            selected_clients = np.random.choice(
-                client_tiers[tier_ids.index(chosen_tier)],
-                size=num_clients,
-                replace=False,
-            ).tolist()
+            selected_clients = context.select(
+                np.random.choice(client_tiers[chosen], size=num_clients, replace=False)
+            )
 
             # print("SELECTED CLIENTS = ", selectable_clients)
 
+            tier_credits[chosen] -= 1
             client_selection_state.put(
-                f"tier_{chosen_tier}_credits",
-                tier_credits[tier_ids.index(chosen_tier)] - 1,
+                f"tier_{chosen_tier}_credits", int(tier_credits[chosen])
             )
 
-            tier_credits = [
-                client_selection_state.get(f"tier_{x}_credits") for x in tier_ids
-            ]
-
-            print("AFTER SELECT TIER CREDITS = ", tier_credits)
+            print("AFTER SELECT TIER CREDITS = ", tier_credits.tolist())
             # print(f"Client_to_tier_map = ", client_to_tier_dict)
             # print("Tier_ids", tier_ids)
             # print("Tier_credits", tier_credits_dict)
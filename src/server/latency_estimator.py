@@ -0,0 +1,164 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import math
+import time
+
+# client_info["<client_id>"]["latency_estimate"]["<model_id>"] = [mean_s, var_s2, count, last_update]
+# mean_s and var_s2 are the EWMA mean and variance of the seconds per sample, so that
+# training rounds and benchmarks run at different batch sizes can be compared.
+LATENCY_KEY = "latency_estimate"
+MEAN, VAR, COUNT, TIMESTAMP = 0, 1, 2, 3
+
+DEFAULT_ALPHA = 0.3
+
+
+def ewma_update(estimate: list, value: float, alpha: float = DEFAULT_ALPHA) -> list:
+    """Exponentially weighted mean and variance, the first sample seeds the mean."""
+    if not estimate or estimate[COUNT] == 0:
+        return [value, 0.0, 1, time.time()]
+    mean, var, count = estimate[MEAN], estimate[VAR], estimate[COUNT]
+    diff = value - mean
+    increment = alpha * diff
+    mean = mean + increment
+    var = (1 - alpha) * (var + diff * increment)
+    return [mean, var, count + 1, time.time()]
+
+
+def update_latency_estimate(
+    client_info,
+    client_id: str,
+    model_id: str,
+    metrics: dict,
+    alpha=DEFAULT_ALPHA,
+    batch_size: int = 1,
+):
+    """Folds the time per sample of one training response into the client's estimate.
+
+    Args:
+        client_info (StateManager): server client_info
+        client_id (str): client that returned the metrics
+        model_id (str): model that was trained
+        metrics (dict): training metrics, uses "time_taken_s" and "total_mini_batches"
+        alpha (float, optional): weight of the new observation
+        batch_size (int, optional): samples per mini-batch of the training round
+
+    Returns:
+        list: updated [mean_s, var_s2, count, last_update], None if the metrics have no timing
+    """
+    try:
+        time_taken_s = float(metrics["time_taken_s"])
+        num_mini_batches = int(metrics["total_mini_batches"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if num_mini_batches <= 0:
+        return None
+
+    estimates = client_info.get(f"{client_id}.{LATENCY_KEY}") or dict()
+    estimates[model_id] = ewma_update(
+        estimates.get(model_id),
+        time_taken_s / (num_mini_batches * max(int(batch_size or 1), 1)),
+        alpha,
+    )
+    client_info.put(f"{client_id}.{LATENCY_KEY}", estimates)
+    return estimates[model_id]
+
+
+def get_latency_estimate(client_info, client_id: str, model_id: str):
+    """Returns (mean_s, std_s, count) per sample, or None if the client has not
+    trained this model yet."""
+    estimates = client_info.get(f"{client_id}.{LATENCY_KEY}") or dict()
+    estimate = estimates.get(model_id)
+    if not estimate:
+        return None
+    return estimate[MEAN], math.sqrt(max(estimate[VAR], 0.0)), estimate[COUNT]
+
+
+def latency_from_state(
+    estimates: dict,
+    benchmark_info: dict,
+    model_id: str,
+    num_mini_batches=100,
+    num_std=0.0,
+    batch_size=None,
+):
+    """get_client_latency from the client's latency_estimate and benchmark_info."""
+    num_samples = num_mini_batches * (batch_size or 1)
+    estimate = (estimates or dict()).get(model_id)
+    if estimate:
+        std = math.sqrt(max(estimate[VAR], 0.0))
+        return (estimate[MEAN] + num_std * std) * num_samples
+
+    client_benchmark_info = (benchmark_info or dict()).get(model_id)
+    if not client_benchmark_info or not client_benchmark_info.get("num_mini_batches"):
+        return None
+    # benchmarks record the batch size they ran at, older ones are taken to have
+    # run at the batch size of the prediction
+    benchmark_batch_size = client_benchmark_info.get("batch_size") or batch_size or 1
+    return (
+        client_benchmark_info["time_taken_s"]
+        / (client_benchmark_info["num_mini_batches"] * benchmark_batch_size)
+    ) * num_samples
+
+
+def get_client_latency(
+    client_info,
+    client_id: str,
+    model_id: str,
+    num_mini_batches=100,
+    num_std=0.0,
+    batch_size=None,
+):
+    """Predicted time in seconds for "num_mini_batches" mini-batches of "batch_size"
+    samples, the latency used by the client_selection plugins (100 mini-batches of the
+    session's training batch size unless asked otherwise). Without a batch size the
+    mini-batches are taken to be single samples, which still ranks clients correctly.
+
+    Uses the online estimate when the client has trained "model_id" and falls back to
+    the one-shot benchmark otherwise. "num_std" adds standard deviations of the
+    estimate, for a pessimistic prediction.
+
+    Returns:
+        float: predicted latency, None if the client has neither an estimate nor a benchmark
+    """
+    return latency_from_state(
+        client_info.get(f"{client_id}.{LATENCY_KEY}"),
+        client_info.get(f"{client_id}.benchmark_info"),
+        model_id,
+        num_mini_batches,
+        num_std,
+        batch_size,
+    )
+
+
+def get_client_latencies(
+    client_info,
+    clients: list,
+    model_id: str,
+    num_mini_batches=100,
+    num_std=0.0,
+    batch_size=None,
+) -> dict:
+    """get_client_latency for each client in "clients", read in one getmany."""
+    clients = list(clients)
+    values = client_info.getmany(
+        [f"{c}.{LATENCY_KEY}" for c in clients]
+        + [f"{c}.benchmark_info" for c in clients]
+    )
+    n = len(clients)
+    return {
+        client: latency_from_state(
+            values[i], values[n + i], model_id, num_mini_batches, num_std, batch_size
+        )
+        for i, client in enumerate(clients)
+    }
+
+
+def session_batch_size(training_session, session_id: str):
+    """Training batch size of the session, None if its config is not stored."""
+    session_config = training_session.get(f"{session_id}.session_config") or dict()
+    return (session_config.get("client_training_config") or dict()).get("batch_size")
@@ -0,0 +1,219 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+from threading import Lock
+from time import time
+
+import numpy as np
+
+INITIAL_CAPACITY = 64
+# lower bound of the standard deviation of the heartbeat intervals, as a fraction of
+# their mean, so that a little jitter after perfectly regular heartbeats is not a failure
+MIN_STD_FRACTION = 0.25
+ROW_ARRAYS = (
+    "_times",
+    "_head",
+    "_count",
+    "_last_seen",
+    "_interval",
+    "_active",
+    "_dirty",
+    "_recovered",
+)
+
+
+class LivenessTable:
+    """Heartbeat timestamps of the clients, one row per client in numpy arrays with a
+    ring buffer of the last "history" timestamps. Recording a heartbeat does not touch
+    client_info; rows that changed are written to it in one batch by flush, and clients
+    that stopped sending heartbeats are found by expire, both called by a sweeper."""
+
+    def __init__(self, history: int, capacity: int = INITIAL_CAPACITY) -> None:
+        self.history = max(1, int(history))
+        self._lock = Lock()
+        self._index = dict()
+        self._ids = []
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int) -> None:
+        self._times = np.zeros((capacity, self.history), dtype=np.float64)
+        self._head = np.zeros(capacity, dtype=np.int64)
+        self._count = np.zeros(capacity, dtype=np.int64)
+        self._last_seen = np.zeros(capacity, dtype=np.float64)
+        self._interval = np.zeros(capacity, dtype=np.float64)
+        self._active = np.zeros(capacity, dtype=bool)
+        self._dirty = np.zeros(capacity, dtype=bool)
+        # marked inactive by expire, and sent a heartbeat since
+        self._recovered = np.zeros(capacity, dtype=bool)
+
+    def _grow(self) -> None:
+        for name in ROW_ARRAYS:
+            old = getattr(self, name)
+            new = np.zeros((2 * len(old),) + old.shape[1:], dtype=old.dtype)
+            new[: len(old)] = old
+            setattr(self, name, new)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, client_id: str) -> bool:
+        return client_id in self._index
+
+    def register(self, client_id: str, now: float = None) -> None:
+        """Adds a client, or resets its row if it advertises again, as active with
+        one heartbeat at "now"."""
+        now = time() if now is None else now
+        with self._lock:
+            i = self._index.get(client_id)
+            if i is None:
+                if len(self._ids) == len(self._head):
+                    self._grow()
+                i = len(self._ids)
+                self._index[client_id] = i
+                self._ids.append(client_id)
+            self._times[i, 0] = now
+            self._head[i] = 1 % self.history
+            self._count[i] = 1
+            self._last_seen[i] = now
+            self._interval[i] = 0.0
+            self._active[i] = True
+            self._dirty[i] = False
+            self._recovered[i] = False
+
+    def record(self, client_id: str, now: float = None) -> bool:
+        """Records a heartbeat. Called from the MQTT network thread, O(1). A client
+        that was marked inactive is active again, with its heartbeat history restarted
+        so that the gap does not count as an interval.
+
+        Returns:
+            bool: False if the client has not advertised
+        """
+        now = time() if now is None else now
+        with self._lock:
+            i = self._index.get(client_id)
+            if i is None:
+                return False
+            if not self._active[i]:
+                self._active[i] = True
+                self._recovered[i] = True
+                self._count[i] = 0
+            head = self._head[i]
+            self._times[i, head] = now
+            self._head[i] = (head + 1) % self.history
+            self._count[i] = min(self._count[i] + 1, self.history)
+            self._interval[i] = now - self._last_seen[i]
+            self._last_seen[i] = now
+            self._dirty[i] = True
+        return True
+
+    def _row_timestamps(self, i: int) -> list:
+        # oldest first, as in the list kept in client_info
+        first = self._head[i] - self._count[i]
+        order = (first + np.arange(self._count[i])) % self.history
+        return self._times[i, order].tolist()
+
+    def timestamps(self, client_id: str) -> list:
+        with self._lock:
+            return self._row_timestamps(self._index[client_id])
+
+    def is_active(self, client_id: str) -> bool:
+        i = self._index.get(client_id)
+        return bool(self._active[i]) if i is not None else False
+
+    def flush(self, client_info) -> list:
+        """Writes the heartbeat timestamps and interval of the clients that sent
+        heartbeats since the last flush to client_info, in one putmany, and marks the
+        clients that recovered since as active.
+
+        Returns:
+            list: client_ids of the clients that recovered
+        """
+        with self._lock:
+            n = len(self._ids)
+            rows = np.flatnonzero(self._dirty[:n])
+            values = dict()
+            for i in rows.tolist():
+                client_id = self._ids[i]
+                values[f"{client_id}.heartbeat.timestamp"] = self._row_timestamps(i)
+                values[f"{client_id}.heartbeat.interval"] = round(
+                    float(self._interval[i]), 2
+                )
+            recovered = np.flatnonzero(self._recovered[:n])
+            for i in recovered.tolist():
+                values[f"{self._ids[i]}.is_active"] = True
+            self._dirty[rows] = False
+            self._recovered[recovered] = False
+            recovered = [self._ids[i] for i in recovered.tolist()]
+        if values:
+            client_info.putmany(values)
+        return recovered
+
+    def _intervals(self, n: int):
+        """Heartbeat intervals of the first n rows, oldest first, and their mask."""
+        steps = np.arange(self.history)
+        first = (self._head[:n] - self._count[:n])[:, None]
+        order = (first + steps) % self.history
+        times = np.take_along_axis(self._times[:n], order, axis=1)
+        valid = steps[None, 1:] < self._count[:n, None]
+        return np.diff(times, axis=1), valid
+
+    def phi(self, now: float = None, min_std_fraction: float = MIN_STD_FRACTION):
+        """Suspicion level of every client, -log10 of the probability that a heartbeat
+        arrives later than now, with the intervals in the ring buffer taken as normally
+        distributed (Hayashibara et al., "The phi accrual failure detector").
+
+        Returns:
+            np.ndarray: phi per row, NaN for rows with fewer than two intervals
+        """
+        now = time() if now is None else now
+        with self._lock:
+            n = len(self._ids)
+            intervals, valid = self._intervals(n)
+            elapsed = now - self._last_seen[:n]
+        num = valid.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(valid, intervals, 0.0).sum(axis=1) / num
+            var = (
+                np.where(valid, (intervals - mean[:, None]) ** 2, 0.0).sum(axis=1) / num
+            )
+            std = np.maximum(np.sqrt(var), min_std_fraction * mean)
+            # logistic approximation of the normal CDF, as in Akka's detector
+            y = (elapsed - mean) / std
+            e = np.exp(-y * (1.5976 + 0.070566 * y * y))
+            phi = np.where(
+                elapsed > mean,
+                -np.log10(e / (1.0 + e)),
+                -np.log10(1.0 - 1.0 / (1.0 + e)),
+            )
+        phi[num < 2] = np.nan
+        return phi
+
+    def expire(
+        self, timeout: float, phi_threshold: float = None, now: float = None
+    ) -> list:
+        """Marks the active clients that failed as inactive: those whose phi exceeds
+        phi_threshold, or, with no threshold or too few heartbeats to estimate phi,
+        whose last heartbeat is older than "timeout".
+
+        Returns:
+            list: (client_id, seconds since its last heartbeat) of the clients marked
+            inactive
+        """
+        now = time() if now is None else now
+        phi = self.phi(now) if phi_threshold is not None else None
+        with self._lock:
+            n = len(self._ids)
+            elapsed = now - self._last_seen[:n]
+            failed = elapsed >= timeout
+            if phi is not None:
+                # rows registered after phi was computed are left to the next sweep
+                m = len(phi)
+                failed[:m] = np.where(np.isnan(phi), failed[:m], phi > phi_threshold)
+            expired = np.flatnonzero(self._active[:n] & failed)
+            self._active[expired] = False
+            self._recovered[expired] = False
+            return [(self._ids[i], float(elapsed[i])) for i in expired.tolist()]
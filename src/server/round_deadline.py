@@ -0,0 +1,149 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import math
+from time import time
+
+import numpy as np
+
+from server.latency_estimator import get_client_latency
+
+DEFAULT_DEADLINE_ARGS = {
+    # aggregate once this fraction of the selected clients has reported
+    "min_fraction": 1.0,
+    # deadline = round start + deadline_slack * slowest predicted round time, None disables it
+    "deadline_slack": None,
+    # standard deviations added to each client's predicted time per mini-batch
+    "deadline_num_std": 2.0,
+    # what to do with updates that arrive after the cutoff: "discard" or "fold"
+    "late_policy": "fold",
+    # folded updates are weighted by (1 + staleness) ** -staleness_exponent
+    "staleness_exponent": 0.5,
+}
+
+ROUND_TIME_PERCENTILES = (50, 90, 99)
+
+
+def parse_deadline_args(args) -> dict:
+    """Merges the aggregator_args of the session with DEFAULT_DEADLINE_ARGS."""
+    deadline_args = dict(DEFAULT_DEADLINE_ARGS)
+    if isinstance(args, dict):
+        for key in DEFAULT_DEADLINE_ARGS:
+            value = args.get(key, deadline_args[key])
+            if isinstance(value, str) and value.lower() == "none":
+                value = None
+            deadline_args[key] = value
+    deadline_args["min_fraction"] = min(
+        1.0, max(0.0, float(deadline_args["min_fraction"]))
+    )
+    return deadline_args
+
+
+def predict_round_time(
+    client_info,
+    training_state,
+    client_id: str,
+    model_id: str,
+    num_std,
+    batch_size=None,
+):
+    """Predicted training time of one round, the client's latency estimate times the
+    number of mini-batches it ran in its last round. None if either is unknown."""
+    training_metrics = training_state.get(f"{client_id}.training_metrics")
+    if not training_metrics:
+        return None
+    last_metrics = training_metrics[max(training_metrics.keys())]
+    num_mini_batches = last_metrics.get("total_mini_batches")
+    if not num_mini_batches:
+        return None
+    return get_client_latency(
+        client_info, client_id, model_id, num_mini_batches, num_std, batch_size
+    )
+
+
+def start_round(
+    client_selection_state,
+    client_info,
+    training_state,
+    clients,
+    model_id: str,
+    round_no: int,
+    args,
+    batch_size=None,
+):
+    """Records the start of a training round and its deadline in client_selection_state.
+    Called by the session manager when the training requests are sent."""
+    deadline_args = parse_deadline_args(args)
+    start_time = time()
+    deadline = None
+    if deadline_args["deadline_slack"] is not None:
+        predicted = [
+            predict_round_time(
+                client_info,
+                training_state,
+                client,
+                model_id,
+                deadline_args["deadline_num_std"],
+                batch_size,
+            )
+            for client in clients
+        ]
+        predicted = [p for p in predicted if p is not None]
+        if predicted:
+            deadline = start_time + float(deadline_args["deadline_slack"]) * max(
+                predicted
+            )
+
+    client_selection_state.put("round_no", round_no)
+    client_selection_state.put("round_start_time", start_time)
+    client_selection_state.put("round_deadline", deadline)
+    return deadline
+
+
+def round_in_progress(client_info, client_selection_state) -> bool:
+    """True while a selected client that was not cut off is still training."""
+    late_clients = client_selection_state.get("late_clients") or dict()
+    return any(
+        client_info.get(f"{c}.is_training")
+        for c in client_selection_state.get("selected_clients") or list()
+        if c not in late_clients
+    )
+
+
+def quorum_reached(finished: list, selected: list, min_fraction: float) -> bool:
+    return len(finished) > 0 and len(finished) >= math.ceil(
+        min_fraction * len(selected)
+    )
+
+
+def deadline_passed(client_selection_state) -> bool:
+    deadline = client_selection_state.get("round_deadline")
+    return deadline is not None and time() >= deadline
+
+
+def staleness_weight(staleness: int, exponent: float) -> float:
+    return (1 + staleness) ** -exponent
+
+
+def record_round_time(
+    training_session, session_id: str, kind: str, seconds: float, logger
+):
+    """Appends a round time to training_session["<session_id>"]["round_times"][kind]
+    and logs its percentiles. "cutoff" is the time at which the round was aggregated,
+    "full" is the time at which the last selected client of the round reported."""
+    round_times = training_session.get(f"{session_id}.round_times") or dict()
+    round_times.setdefault(kind, list()).append(seconds)
+    training_session.put(f"{session_id}.round_times", round_times)
+
+    percentiles = np.percentile(round_times[kind], ROUND_TIME_PERCENTILES)
+    logger.info(
+        f"fedserver.round_time.{kind}",
+        ",".join(
+            [f"{len(round_times[kind])},{seconds}"]
+            + [f"p{p},{v}" for p, v in zip(ROUND_TIME_PERCENTILES, percentiles)]
+        ),
+    )
@@ -0,0 +1,250 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+from functools import cached_property
+
+import numpy as np
+
+from server.latency_estimator import LATENCY_KEY, latency_from_state
+
+# per-client keys read by SelectionContext, in one getmany per state
+CLIENT_INFO_FIELDS = ("is_active", LATENCY_KEY, "benchmark_info")
+TRAINING_STATE_FIELDS = (
+    "training_metrics",
+    "validation_metrics",
+    "last_round_participated",
+    "current_dataset_detail",
+    "current_model_id",
+)
+
+
+def get_active(client_info, clients) -> np.ndarray:
+    """is_active of "clients", in one getmany."""
+    values = client_info.getmany([f"{c}.is_active" for c in clients])
+    return np.array([bool(a) for a in values], dtype=bool)
+
+
+def latest_loss(metrics: dict, round_no=None):
+    """Loss of round "round_no" of a {round_no: metrics} dict, or of its last round.
+
+    Returns:
+        (float, int): loss and round, (nan, -1) if there is none
+    """
+    if not metrics:
+        return np.nan, -1
+    if round_no is None:
+        round_no = max(metrics)
+    round_metrics = metrics.get(round_no)
+    if not round_metrics or round_metrics.get("loss") is None:
+        return np.nan, -1
+    return float(round_metrics["loss"]), round_no
+
+
+class SelectionContext:
+    """
+    State of the candidate clients of a client_selection call, read with one getmany on
+    client_info and one on training_state, as NumPy arrays aligned with "ids". Arrays
+    are built on first use, missing values are NaN.
+    """
+
+    def __init__(
+        self, clients, client_info, training_state, model_id=None, batch_size=None
+    ) -> None:
+        self.ids = np.array(list(clients), dtype=object)
+        self.index = {c: i for i, c in enumerate(self.ids.tolist())}
+        n = len(self.ids)
+        values = client_info.getmany(
+            [f"{c}.{f}" for f in CLIENT_INFO_FIELDS for c in self.ids]
+        )
+        self._client_info = {
+            f: values[i * n : (i + 1) * n] for i, f in enumerate(CLIENT_INFO_FIELDS)
+        }
+        values = training_state.getmany(
+            [f"{c}.{f}" for f in TRAINING_STATE_FIELDS for c in self.ids]
+        )
+        self._training_state = {
+            f: values[i * n : (i + 1) * n] for i, f in enumerate(TRAINING_STATE_FIELDS)
+        }
+        if model_id is None:
+            model_id = next(
+                (m for m in self._training_state["current_model_id"] if m), None
+            )
+        self.model_id = model_id
+        # samples per mini-batch of the latency predictions
+        self.batch_size = batch_size
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def select(self, indices) -> list:
+        """client_ids of the rows "indices", as a list for client_selection_state."""
+        return self.ids[np.asarray(indices, dtype=np.int64)].tolist()
+
+    def mask(self, clients) -> np.ndarray:
+        mask = np.zeros(len(self.ids), dtype=bool)
+        mask[[self.index[c] for c in clients if c in self.index]] = True
+        return mask
+
+    @cached_property
+    def active(self) -> np.ndarray:
+        return np.array([bool(a) for a in self._client_info["is_active"]], dtype=bool)
+
+    @cached_property
+    def training_loss(self) -> np.ndarray:
+        """Training loss of the last round each client participated in."""
+        return np.array(
+            [
+                latest_loss(metrics, last_round)[0]
+                for metrics, last_round in zip(
+                    self._training_state["training_metrics"],
+                    self._training_state["last_round_participated"],
+                )
+            ],
+            dtype=np.float64,
+        )
+
+    def validation_loss(self, round_no=None) -> np.ndarray:
+        """Validation loss of round "round_no", or of the last validation round."""
+        return np.array(
+            [
+                latest_loss(metrics, round_no)[0]
+                for metrics in self._training_state["validation_metrics"]
+            ],
+            dtype=np.float64,
+        )
+
+    @cached_property
+    def loss(self) -> np.ndarray:
+        """Latest loss of each client, from validation if the client validated after
+        it last trained, otherwise from training."""
+        losses = np.full(len(self.ids), np.nan)
+        for i, (training, validation, last_round) in enumerate(
+            zip(
+                self._training_state["training_metrics"],
+                self._training_state["validation_metrics"],
+                self._training_state["last_round_participated"],
+            )
+        ):
+            train_loss, train_round = latest_loss(training, last_round)
+            val_loss, val_round = latest_loss(validation)
+            losses[i] = val_loss if val_round >= train_round else train_loss
+        return losses
+
+    def latency(self, num_mini_batches=100, num_std=0.0) -> np.ndarray:
+        """Predicted time for "num_mini_batches" mini-batches of the session's model,
+        as get_client_latency."""
+        latencies = [
+            latency_from_state(
+                estimates,
+                benchmark_info,
+                self.model_id,
+                num_mini_batches,
+                num_std,
+                self.batch_size,
+            )
+            for estimates, benchmark_info in zip(
+                self._client_info[LATENCY_KEY], self._client_info["benchmark_info"]
+            )
+        ]
+        return np.array(
+            [np.nan if x is None else x for x in latencies], dtype=np.float64
+        )
+
+    def latencies(self, num_mini_batches=100, num_std=0.0) -> dict:
+        """latency as a client_id -> latency dict, None for unknown latencies."""
+        return {
+            c: (None if np.isnan(x) else float(x))
+            for c, x in zip(self.ids.tolist(), self.latency(num_mini_batches, num_std))
+        }
+
+    @cached_property
+    def num_items(self) -> np.ndarray:
+        return np.array(
+            [
+                ((detail or dict()).get("metadata") or dict()).get("num_items", np.nan)
+                for detail in self._training_state["current_dataset_detail"]
+            ],
+            dtype=np.float64,
+        )
+
+    def label_histograms(self, label_order=None):
+        """(clients, labels) matrix of the label distributions of the clients' data.
+        Labels in "label_order" keep their column, new labels are appended.
+
+        Returns:
+            (np.ndarray, list): histograms and the label of each column
+        """
+        label_order = list(label_order or [])
+        columns = {label: j for j, label in enumerate(label_order)}
+        rows, cols, values = [], [], []
+        for i, detail in enumerate(self._training_state["current_dataset_detail"]):
+            distribution = ((detail or dict()).get("metadata") or dict()).get(
+                "label_distribution"
+            ) or dict()
+            for label, share in distribution.items():
+                if label not in columns:
+                    columns[label] = len(label_order)
+                    label_order.append(label)
+                rows.append(i)
+                cols.append(columns[label])
+                values.append(share)
+        histograms = np.zeros((len(self.ids), len(label_order)))
+        histograms[rows, cols] = values
+        return histograms, label_order
+
+
+def top_k(values: np.ndarray, k: int, largest: bool = True) -> np.ndarray:
+    """Indices of the k largest (or smallest) values, in order, NaN values last.
+    O(n + k log k) with argpartition."""
+    values = np.asarray(values, dtype=np.float64)
+    k = max(0, min(int(k), len(values)))
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    keys = -values if largest else values.copy()
+    keys[np.isnan(keys)] = np.inf
+    candidates = np.argpartition(keys, k - 1)[:k] if k < len(keys) else np.arange(k)
+    return candidates[np.argsort(keys[candidates], kind="stable")]
+
+
+def weighted_sample(weights: np.ndarray, k: int, rng=None) -> np.ndarray:
+    """Indices of k rows drawn without replacement with probability proportional to
+    "weights" (Efraimidis-Spirakis keys), uniformly if no weight is positive."""
+    rng = np.random.default_rng() if rng is None else rng
+    weights = np.nan_to_num(np.asarray(weights, dtype=np.float64), nan=0.0)
+    weights = np.maximum(weights, 0.0)
+    k = max(0, min(int(k), len(weights)))
+    positive = np.flatnonzero(weights > 0)
+    if len(positive) == 0:
+        return rng.choice(len(weights), size=k, replace=False)
+    keys = np.log(rng.random(len(positive))) / weights[positive]
+    drawn = positive[top_k(keys, k, largest=True)]
+    if len(drawn) == k:
+        return drawn
+    # rows with zero weight are only drawn once the others are exhausted, uniformly
+    zero = np.flatnonzero(weights <= 0)
+    return np.concatenate((drawn, rng.choice(zero, size=k - len(drawn), replace=False)))
+
+
+def group_by_tier(tiers: np.ndarray):
+    """Rows of each tier, with one stable argsort.
+
+    Returns:
+        (np.ndarray, list): sorted tier ids and the row indices of each tier
+    """
+    tiers = np.asarray(tiers)
+    order = np.argsort(tiers, kind="stable")
+    tier_ids, starts = np.unique(tiers[order], return_index=True)
+    return tier_ids, np.split(order, starts[1:])
+
+
+def tier_mean(values: np.ndarray, tiers: np.ndarray, num_tiers: int) -> np.ndarray:
+    """Mean of the non-NaN values of each tier, 0 for tiers without any."""
+    values = np.asarray(values, dtype=np.float64)
+    known = ~np.isnan(values)
+    sums = np.bincount(tiers[known], weights=values[known], minlength=num_tiers)
+    counts = np.bincount(tiers[known], minlength=num_tiers)
+    return np.divide(sums, counts, out=np.zeros(num_tiers), where=counts > 0)
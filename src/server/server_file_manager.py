@@ -5,15 +5,12 @@ Copyright 2023 Indian Institute of Science
 Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
 """
 
-import hashlib
-import importlib
-import inspect
 import os
-import sys
 
 import yaml
 
 from utils.logger import FedLogger
+from utils.model_registry import load_class, model_dir_hash
 
 
 def add_init_file_to_dir(dir_path: str, empty_init_file: bool = True) -> None:
@@ -38,49 +35,24 @@ def add_init_file_to_dir(dir_path: str, empty_init_file: bool = True) -> None:
 
 def get_model_class(path: str, class_name: str):
     """
-        Function that takes in the location of the temp directory, the name of the ML model
-    and the name of the class that contains the PyTorch model as well as the train and the
-    validation functions and returns an object to that class
+        Function that takes in the location of the model directory and the name of the
+    class that contains the PyTorch model, the dataloader or the train and validation
+    functions, and returns that class, cached until the model files change
 
     Args:
-        path (str):   Relative/absolute path to the temp directory
-        class_name (str): Name of the class in one of the .py files in "<temp_dir>/model_cache/<model_name>"
-                          that contains the PyTorch model as well as the train and validate functions
+        path (str):   Relative/absolute path to the model directory
+        class_name (str): Name of the class in one of the .py files in the model directory
     """
-    model_name = path.split("/")[-1]
-    path = os.path.abspath(path)
-    model_cache_dir_path = os.path.dirname(path)
-    model_dir_path = path
-
-    if os.path.isdir(model_cache_dir_path):
-        add_init_file_to_dir(dir_path=model_dir_path, empty_init_file=False)
-        model_cache_dir_abspath = os.path.abspath(model_cache_dir_path)
-        sys.path.append(model_cache_dir_abspath)
-        module_imported = importlib.import_module(model_name, package=None)
-        model_dir_abspath = os.path.abspath(model_dir_path)
-        sys.path.append(model_dir_abspath)
-
-        for file in module_imported.__all__:
-            model_imported = importlib.import_module(file, package=None)
-
-            for name_local in dir(model_imported):
-                unknown_class = getattr(model_imported, name_local)
-                if (
-                    inspect.isclass(unknown_class)
-                    and unknown_class.__name__ == class_name
-                ):
-                    print(
-                        f"\nserver_file_manager.get_model_class:: class {unknown_class} is loaded\n"
-                    )
-                    return unknown_class
+    if not os.path.isdir(path):
+        print(f"\nserver_file_manager.get_model_class:: {path} not found\n")
+        return None
 
+    loaded_class = load_class(path, class_name)
+    if loaded_class is None:
         print(
-            f"\nserver_file_manager.get_model_class:: {class_name} not found in {model_name}\n"
+            f"\nserver_file_manager.get_model_class:: {class_name} not found in {path}\n"
         )
-        return None
-
-    print(f"\nserver_file_manager.get_model_class:: {model_dir_path} not found\n")
-    return None
+    return loaded_class
 
 
 def get_available_datasets(path: str) -> dict:
@@ -107,25 +79,8 @@ def get_available_datasets(path: str) -> dict:
     return available_datasets
 
 
-def file_as_bytes(file):
-    with file:
-        return file.read()
-
-
 def get_model_dir_hash(path: str) -> str:
-    model_hash = hex(0)
-    abs_model_path = os.path.abspath(path)
-    model_files = [
-        file for file in os.scandir(abs_model_path) if not os.path.isdir(file)
-    ]
-    hashes = [
-        hashlib.sha256(file_as_bytes(open(fname, "rb"))).hexdigest()
-        for fname in model_files
-    ]
-    for hash in hashes:
-        model_hash = hex(int(model_hash, 16) + int(hash, 16))
-
-    return model_hash
+    return model_dir_hash(path)
 
 
 def OpenYaML(path: str, logger: FedLogger = None) -> dict[str, str] | None:
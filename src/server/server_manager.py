@@ -11,9 +11,9 @@ import os
 from threading import Event
 
 from server.server_mqtt_manager import MQTTManager
-from server.server_session_manager import FloSessionManager
 from server.server_state_manager import StateManager
 from utils.logger import FedLogger
+from utils.metrics import start_metrics_server
 
 
 class FlotillaServerManager:
@@ -41,6 +41,15 @@ class FlotillaServerManager:
         self.mqtt_task.name = "MQTT_Task_Thread"
         self.mqtt_task.start()
 
+        # Prometheus scrape endpoint, disabled when comm_config has no metrics_port
+        metrics_config = self.server_config["comm_config"].get("metrics") or dict()
+        self.metrics_server = None
+        if metrics_config.get("metrics_port") is not None:
+            self.metrics_server = start_metrics_server(
+                port=metrics_config["metrics_port"],
+                host=metrics_config.get("metrics_hostname", "0.0.0.0"),
+            )
+
     async def run(
         self, id: str, train_config: dict, restore=False, revive=False, file=False
     ):
@@ -52,6 +61,9 @@ class FlotillaServerManager:
             .get("communication_protocol", "grpc")
             .lower()
         )
+        # torch, grpc and the session's modules are imported with the first session
+        from server.server_session_manager import FloSessionManager
+
         session = FloSessionManager(
             id=id,
             client_info=self.client_info,
@@ -10,8 +10,15 @@ from tqdm import tqdm
 
 from server.load_loss import load_loss
 from server.load_optimizer import load_optimizer
-from server.server_file_manager import get_model_class
+from server.server_file_manager import get_model_class, get_model_dir_hash
+from utils.dataloader_args import get_dataloader_kwargs
 from utils.logger import FedLogger
+from utils.model_compiler import (
+    compile_model,
+    example_input_from_loader,
+    get_compile_mode,
+)
+from utils.partition_format import load_partition
 
 
 class ServerModelManager:
@@ -28,6 +35,9 @@ class ServerModelManager:
         custom_dataloader_args: dict = None,
         use_custom_validator=False,
         custom_validator_args=None,
+        dataloader_args: dict = None,
+        compile_mode: str = None,
+        compile_cache_dir: str = None,
     ) -> None:
         self.id = id
         self.torch_device = torch_device
@@ -51,12 +61,17 @@ class ServerModelManager:
             )
         else:
             self.data = self.test_dataset_loader(
-                path=val_data_path, batch_size=batch_size
+                path=val_data_path, batch_size=batch_size, loader_args=dataloader_args
             )
 
         self.use_custom_validator = use_custom_validator
         self.custom_validator_args = custom_validator_args
 
+        # compiled copy used for the forward pass of the default validator, weights stay in self.model
+        self.compile_mode = get_compile_mode(compile_mode)
+        self.compile_cache_dir = compile_cache_dir
+        self.compiled_model = None
+
     def get_model_weights(self):
         self.model.to("cpu")
         return self.model.state_dict()
@@ -83,12 +98,42 @@ class ServerModelManager:
     def get_loss_fun(self):
         return self.loss_fun
 
-    def test_dataset_loader(self, path: str, batch_size=50):
-        test_dataset = torch.load(path).dataset
+    def get_validation_model(self):
+        if self.compile_mode is None or self.compile_cache_dir is None:
+            return self.model
+        if self.compiled_model is None:
+            try:
+                example_input = example_input_from_loader(self.data, self.torch_device)
+                model_hash = get_model_dir_hash(self.model_dir)
+                self.compiled_model, info = compile_model(
+                    model=self.model,
+                    compile_mode=self.compile_mode,
+                    cache_dir=self.compile_cache_dir,
+                    model_hash=model_hash,
+                    example_input=example_input,
+                )
+                self.logger.info(
+                    "fedserver.model_manager.compile",
+                    f"{info['compile_mode']},{info['cached']},{info['compile_time_s']},{info['speedup']}",
+                )
+            except Exception as e:
+                self.logger.error("fedserver.model_manager.compile.exception", f"{e}")
+                self.compile_mode = None
+                return self.model
+        elif isinstance(self.compiled_model, torch.jit.ScriptModule):
+            # a TorchScript module loaded from the cache has its own copy of the weights
+            self.compiled_model.load_state_dict(self.model.state_dict())
+        return self.compiled_model
+
+    def test_dataset_loader(self, path: str, batch_size=50, loader_args: dict = None):
+        test_dataset = load_partition(path)
         print("Length of test dataset", len(test_dataset))
 
         data = torch.utils.data.DataLoader(
-            dataset=test_dataset, batch_size=batch_size, shuffle=True
+            dataset=test_dataset,
+            batch_size=batch_size,
+            shuffle=True,
+            **get_dataloader_kwargs(loader_args),
         )
         return data
 
@@ -116,8 +161,9 @@ class ServerModelManager:
 
         else:
             self.model = self.model.to(self.torch_device)
+            model = self.get_validation_model()
 
-            self.model.eval()
+            model.eval()
 
             acc = 0
             count = 0
@@ -130,7 +176,7 @@ class ServerModelManager:
                 ):
                     x_batch = x_batch.to(self.torch_device)
                     y_batch = y_batch.to(self.torch_device)
-                    y_pred = self.model(x_batch)
+                    y_pred = model(x_batch)
                     loss = cost(y_pred, y_batch)
                     total_loss += loss.item()
                     acc += (torch.argmax(y_pred, 1) == y_batch).float().sum().item()
@@ -140,6 +186,7 @@ class ServerModelManager:
             acc = (acc / count) * 100
             loss = total_loss / batches
 
+            model.train()
             self.model.train()
             res = {"accuracy": acc, "loss": loss}
             print(res)
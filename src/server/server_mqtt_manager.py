@@ -11,8 +11,44 @@ from threading import Event, Thread
 
 import paho.mqtt.client as mqtt
 
+from server.liveness import LivenessTable
 from utils.hardware_info import get_hardware_info
 from utils.logger import FedLogger
+from utils.metrics import REGISTRY
+
+MQTT_MESSAGES = REGISTRY.counter(
+    "flotilla_mqtt_messages_total",
+    "MQTT messages published or received, by topic filter",
+    ("direction", "topic"),
+)
+MQTT_BYTES = REGISTRY.counter(
+    "flotilla_mqtt_bytes_total",
+    "MQTT payload bytes published or received, by topic filter",
+    ("direction", "topic"),
+)
+
+FAILURE_DETECTION_SECONDS = REGISTRY.histogram(
+    "flotilla_failure_detection_seconds",
+    "Time from the last heartbeat of a client to its detection as failed",
+    ("detector",),
+)
+
+# a client that stopped sending heartbeats is detected within this many seconds of
+# crossing the threshold, heartbeats are written to client_info once per interval
+FAILURE_CHECK_INTERVAL_S = 1.0
+
+
+# topics that end with a client or model id are counted under one "<prefix>+" label
+PER_ID_TOPIC_PREFIXES = ("flotilla/server/command/", "flotilla/server/model/artifact/")
+
+
+def count_mqtt_message(direction: str, topic: str, payload) -> None:
+    for prefix in PER_ID_TOPIC_PREFIXES:
+        if topic.startswith(prefix):
+            topic = prefix + "+"
+            break
+    MQTT_MESSAGES.inc(direction=direction, topic=topic)
+    MQTT_BYTES.inc(len(payload) if payload else 0, direction=direction, topic=topic)
 
 
 class MQTTManager:
@@ -32,6 +68,16 @@ class MQTTManager:
             "num_heartbeats_timestamp_cached"
         ]
         self.max_heartbeats_miss_threshold: int = config["max_heartbeat_miss_threshold"]
+        # heartbeats are recorded here and written to client_info by the sweeper
+        self.liveness: LivenessTable = LivenessTable(
+            self.num_heartbeats_timestamp_cached
+        )
+        # "miss_count": failed after max_heartbeat_miss_threshold missed heartbeats,
+        # "phi": failed once the phi accrual suspicion level exceeds phi_threshold
+        self.failure_detector: str = config.get("failure_detector", "miss_count")
+        self.phi_threshold: float = float(config.get("phi_threshold", 8.0))
+        # called with (client_id, detection_latency_s) when a client is detected as failed
+        self.failure_listeners: list = []
         self.type_: str = config["type"]
 
         self.heard_from_client_event: Event = Event()
@@ -56,6 +102,7 @@ class MQTTManager:
             )
 
         def message_ad_response(client, userdata, message):
+            count_mqtt_message("received", self.client_advertise_topic, message.payload)
             info = json.loads(str(message.payload.decode()))
             client_id = list(info.keys())[0]
             client_name = info[str(client_id)]["payload"]["name"]
@@ -70,6 +117,12 @@ class MQTTManager:
             benchmark_info = info[str(client_id)]["payload"]["benchmark_info"]
             client_info.put(f"{client_id}.benchmark_info", benchmark_info)
 
+            # older clients do not advertise a benchmark cache
+            benchmark_cache = info[str(client_id)]["payload"].get("benchmark_cache", {})
+            client_info.put(f"{client_id}.benchmark_cache", benchmark_cache)
+            hw_fingerprint = info[str(client_id)]["payload"].get("hw_fingerprint")
+            client_info.put(f"{client_id}.hw_fingerprint", hw_fingerprint)
+
             hardware_information = info[str(client_id)]["payload"]["hw_info"]
             client_info.put(f"{client_id}.hardware_information", hardware_information)
 
@@ -82,11 +135,13 @@ class MQTTManager:
             models = info[str(client_id)]["payload"]["models"]
             client_info.put(f"{client_id}.models", models)
 
+            join_time = time.time()
             client_info.put(f"{client_id}.is_active", True)
             client_info.put(f"{client_id}.is_training", False)
-            client_info.put(f"{client_id}.heartbeat.timestamp", [time.time()])
+            client_info.put(f"{client_id}.heartbeat.timestamp", [join_time])
             client_info.put(f"{client_id}.heartbeat.interval", 0)
-            client_info.put(f"{client_id}.join_timestamp", time.time())
+            client_info.put(f"{client_id}.join_timestamp", join_time)
+            self.liveness.register(client_id, join_time)
 
             self.logger.info(
                 "MQTT.server.ad_response_received",
@@ -97,43 +152,15 @@ class MQTTManager:
             print("MQTT.ad_response from", client_id)
 
         def message_heartbeat_response(client, userdata, message):
-            info = json.loads(str(message.payload.decode()))
-            client_id = info["id"]
-
-            self.logger.info(
-                "MQTT.server.heartbeat.received.message",
-                f"heartbeat from client and timestamp:,{client_id},{info['timestamp']}",
+            count_mqtt_message(
+                "received", self.client_heartbeat_topic_prefix + "+", message.payload
             )
-
-            try:
-                server_time = time.time()
-                client_heartbeat_timestamp = (
-                    client_info.get(f"{client_id}.heartbeat.timestamp")
-                    if isinstance(
-                        client_info.get(f"{client_id}.heartbeat.timestamp"), list
-                    )
-                    else [time.time()]
-                )
-                interval = round(
-                    (server_time - client_heartbeat_timestamp[-1]),
-                    2,
-                )
-
-                if (
-                    len(client_heartbeat_timestamp)
-                    == self.num_heartbeats_timestamp_cached
-                ):
-                    client_heartbeat_timestamp.pop()
-                client_heartbeat_timestamp.append(server_time)
-
-                client_info.put(f"{client_id}.heartbeat.interval", interval)
-                client_info.put(
-                    f"{client_id}.heartbeat.timestamp", client_heartbeat_timestamp
-                )
-            except KeyError:
+            # the topic ends with the client id, the payload is not decoded
+            client_id = message.topic[len(self.client_heartbeat_topic_prefix) :]
+            if not self.liveness.record(client_id):
                 self.logger.warn(
                     "MQTT.server.heartbeat.invalid.client",
-                    f"Ignoring heartbeat as client_session doesn't contain Client,{id}",
+                    f"Ignoring heartbeat as client_session doesn't contain Client,{client_id}",
                 )
 
         client_user_data = self.heard_from_client_event
@@ -206,7 +233,9 @@ class MQTTManager:
         grpc_event.set()
 
         heartbeat_thread = Thread(
-            target=self.heartbeat_alive_check, args=(client_info,)
+            target=self.heartbeat_alive_check,
+            args=(client_info, stop_event),
+            daemon=True,
         )
         heartbeat_thread.start()
 
@@ -219,33 +248,72 @@ class MQTTManager:
             self.logger.error("MQTT.server.publish.error", "client not initialized")
             return
         self.client.publish(topic=topic, payload=payload, qos=qos, retain=retain)
+        count_mqtt_message("sent", topic, payload)
 
     def subscribe(self, topic: str, callback):
         if getattr(self, "client", None) is None:
             self.logger.error("MQTT.server.subscribe.error", "client not initialized")
             return
-        self.client.message_callback_add(topic, callback)
+
+        def counted_callback(client, userdata, message):
+            # labelled with the subscribed filter, not the per-client topic
+            count_mqtt_message("received", topic, message.payload)
+            callback(client, userdata, message)
+
+        self.client.message_callback_add(topic, counted_callback)
         self.client.subscribe(topic, qos=1)
 
-    def heartbeat_alive_check(self, client_info):
-        heartbeat_interval_flag = Event()
-        while not heartbeat_interval_flag.is_set():
-            for client in client_info.keys():
-                if client_info.get(f"{client}.is_active"):
-                    if time.time() - client_info.get(f"{client}.heartbeat.timestamp")[
-                        -1
-                    ] >= (
-                        (
-                            self.max_heartbeats_miss_threshold
-                            * self.mqtt_heartbeat_interval_s
-                        )
-                        + 2
-                    ):
-                        print(f"Removing client:{client} from active clients")
-                        self.logger.warn(
-                            "MQTT.server.heartbeat.delayed",
-                            f"Removing client:{client} from active clients",
-                        )
-                        client_info.put(f"{client}.is_active", False)
-                        client_info.put(f"{client}.is_training", False)
-            heartbeat_interval_flag.wait(self.mqtt_heartbeat_interval_s)
+    def add_failure_listener(self, callback) -> None:
+        self.failure_listeners.append(callback)
+
+    def remove_failure_listener(self, callback) -> None:
+        if callback in self.failure_listeners:
+            self.failure_listeners.remove(callback)
+
+    def heartbeat_alive_check(self, client_info, stop_event: Event):
+        """Sweeper of the liveness table: once per heartbeat interval, writes the
+        heartbeats received since the last sweep to client_info, with the clients that
+        recovered marked as active again, and every FAILURE_CHECK_INTERVAL_S marks the
+        clients that failed as inactive and notifies the failure listeners."""
+        timeout = (
+            self.max_heartbeats_miss_threshold * self.mqtt_heartbeat_interval_s
+        ) + 2
+        phi_threshold = self.phi_threshold if self.failure_detector == "phi" else None
+        check_interval = min(FAILURE_CHECK_INTERVAL_S, self.mqtt_heartbeat_interval_s)
+        last_flush = 0.0
+        while not stop_event.is_set():
+            now = time.time()
+            if now - last_flush >= self.mqtt_heartbeat_interval_s:
+                for client in self.liveness.flush(client_info):
+                    self.logger.info(
+                        "MQTT.server.client.recovered",
+                        f"client_id-detector,{client},{self.failure_detector}",
+                    )
+                last_flush = now
+            failed = self.liveness.expire(timeout, phi_threshold, now)
+            values = dict()
+            for client, latency in failed:
+                print(f"Removing client:{client} from active clients")
+                self.logger.warn(
+                    "MQTT.server.heartbeat.delayed",
+                    f"Removing client:{client} from active clients",
+                )
+                self.logger.info(
+                    "MQTT.server.client.failed",
+                    f"client_id-detector-detection_latency,{client},{self.failure_detector},{latency}",
+                )
+                FAILURE_DETECTION_SECONDS.observe(
+                    latency, detector=self.failure_detector
+                )
+                values[f"{client}.is_active"] = False
+                values[f"{client}.is_training"] = False
+                values[f"{client}.failure_detected"] = (now, latency)
+            if values:
+                client_info.putmany(values)
+            for client, latency in failed:
+                for callback in list(self.failure_listeners):
+                    try:
+                        callback(client, latency)
+                    except Exception as e:
+                        self.logger.error("MQTT.server.failure_listener.error", str(e))
+            stop_event.wait(check_interval)
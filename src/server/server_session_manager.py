@@ -6,6 +6,7 @@ import tarfile
 import json
 import base64
 import pickle
+from threading import Lock
 from time import time
 
 import grpc
@@ -16,7 +17,9 @@ from typing_extensions import OrderedDict
 import proto.grpc_pb2 as grpc_pb2
 import proto.grpc_pb2_grpc as grpc_pb2_grpc
 from server.load_aggregator import load_aggregator
+from server.latency_estimator import DEFAULT_ALPHA, update_latency_estimate
 from server.load_client_selection import load_client_selection
+from server.round_deadline import deadline_passed, start_round
 from server.server_file_manager import (
     OpenYaML,
     get_available_datasets,
@@ -24,8 +27,61 @@ from server.server_file_manager import (
 )
 from server.server_model_manager import ServerModelManager
 from server.server_state_manager import StateManager
+from server.training_spec import encode_spec, loss_spec, optimizer_spec
+from utils.benchmark_cache import (
+    benchmark_cache_key,
+    is_fresh,
+    matches_benchmark,
+    parse_ttl,
+)
 from utils.logger import FedLogger
-from utils.plot import Plot
+from utils.metrics import REGISTRY, SIZE_BUCKETS, TRANSPORT_BYTES
+from utils.tracing import TRACEPARENT, start_span
+
+ROUND_SECONDS = REGISTRY.histogram(
+    "flotilla_round_seconds",
+    "Time of a training round, from the previous aggregation to this one",
+    ("session_id",),
+)
+ROUND_NUMBER = REGISTRY.gauge(
+    "flotilla_round_number", "Last round number of the session", ("session_id",)
+)
+AGGREGATION_SECONDS = REGISTRY.histogram(
+    "flotilla_aggregation_seconds",
+    "Time of the aggregator calls that returned a new global model",
+    ("session_id", "aggregator"),
+)
+AGGREGATOR_CALLS = REGISTRY.counter(
+    "flotilla_aggregator_calls_total",
+    "Aggregator calls, by whether they returned a new global model",
+    ("session_id", "aggregator", "aggregated"),
+)
+CLIENT_SELECTION_SECONDS = REGISTRY.histogram(
+    "flotilla_client_selection_seconds",
+    "Time of a client_selection call",
+    ("session_id", "client_selection"),
+)
+SERVER_VALIDATION_SECONDS = REGISTRY.histogram(
+    "flotilla_server_validation_seconds",
+    "Time of the server side validation of the global model",
+    ("session_id",),
+)
+CLIENT_RESPONSE_SECONDS = REGISTRY.histogram(
+    "flotilla_client_response_seconds",
+    "Time from sending a training or validation request to a client to its response",
+    ("session_id", "protocol", "task"),
+)
+ROUND_CLIENT_BYTES = REGISTRY.histogram(
+    "flotilla_round_client_bytes",
+    "Bytes exchanged with one client in one round",
+    ("session_id", "protocol", "direction"),
+    buckets=SIZE_BUCKETS,
+)
+CLIENT_FAILURES = REGISTRY.counter(
+    "flotilla_client_failures_total",
+    "Training or validation requests without a response",
+    ("session_id", "protocol", "task"),
+)
 
 
 class FloSessionManager:
@@ -48,6 +104,18 @@ class FloSessionManager:
         self.mqtt_init_finish_event = mqtt_init_event
         self.mqtt = mqtt_manager
         self.rounds_issued = set()
+        # open tracing spans, of the rounds by round number and of the MQTT tasks by task_id
+        self.round_spans = dict()
+        self.task_spans = dict()
+        # client_id of the MQTT tasks awaiting a result, by task_id
+        self.pending_tasks = dict()
+        # gRPC calls awaiting a response by client_id, cancelled if the client fails
+        self.inflight_calls = dict()
+        self.cancelled_calls = set()
+        self.loop = None
+        # MQTT train results and clients dropped by the failure detector arrive on
+        # different threads
+        self.mqtt_results_lock = Lock()
 
         validation_data_dir_path = server_config["validation_data_dir_path"]
         self.dataset_available = get_available_datasets(validation_data_dir_path)
@@ -137,7 +205,8 @@ class FloSessionManager:
 
         self.aggregator = session_config["session_config"]["aggregator"]
         self.aggregator_args = session_config["session_config"]["aggregator_args"]
-        self.aggregate = load_aggregator(self.id, self.aggregator).aggregate
+        self.aggregator_module = load_aggregator(self.id, self.aggregator)
+        self.aggregate_fn = self.aggregator_module.aggregate
         self.client_selection_strategy = session_config["session_config"][
             "client_selection"
         ]
@@ -147,6 +216,10 @@ class FloSessionManager:
         self.client_selection = load_client_selection(
             self.id, self.client_selection_strategy
         ).client_selection
+        # weight of the newest training round in the per-client latency estimate
+        self.latency_ewma_alpha = float(
+            session_config["session_config"].get("latency_ewma_alpha", DEFAULT_ALPHA)
+        )
 
         self.checkpoint_interval = (
             session_config["session_config"]["checkpoint_interval"]
@@ -159,6 +232,9 @@ class FloSessionManager:
         ]
         self.generate_plots = session_config["session_config"]["generate_plots"]
         if self.generate_plots:
+            # matplotlib and pandas are only imported for sessions that plot
+            from utils.plot import Plot
+
             plotting_obj = Plot(self.id)
 
         self.bench_config: dict = session_config["benchmark_config"]
@@ -168,6 +244,8 @@ class FloSessionManager:
                 print("\n\n\nSKIPPING BENCHMARK\n\n\n")
         except KeyError:
             self.skip_bench = False
+        # benchmark results advertised by clients are trusted for this long, None never expires
+        self.bench_cache_ttl_s = parse_ttl(self.bench_config.get("cache_ttl_s"))
 
         self.train_config: dict = (
             session_config["server_training_config"]
@@ -197,6 +275,11 @@ class FloSessionManager:
             use_custom_validator=self.model_config["use_custom_validator"],
             custom_validator_args=self.model_config["custom_validator_args"],
             model_args=self.model_config["model_args"],
+            dataloader_args=self.model_config.get("dataloader_args"),
+            compile_mode=self.model_config.get("compile_mode"),
+            compile_cache_dir=os.path.join(
+                self.temp_dir_path, "model_cache", self.train_config["model_id"]
+            ),
         )
 
         self.model_util.set_loss_fun(
@@ -208,6 +291,9 @@ class FloSessionManager:
             self.train_config["optimizer"],
             self.train_config["optimizer_custom"],
         )
+        # sent to the clients, which build the loss function and optimizer themselves
+        self.loss_spec = loss_spec(self.train_config)
+        self.optimizer_spec = optimizer_spec(self.train_config)
         if restore or revive or file:
             self.model_util.set_model_weights(
                 self.training_session.get(f"{self.id}.global_model")
@@ -218,6 +304,43 @@ class FloSessionManager:
                 f"{self.id}.global_model", self.model_util.get_model_weights()
             )
 
+    def aggregate(self, round_no, **kwargs):
+        """Calls the aggregator plugin and records its time in the metrics registry
+        and as a span of round "round_no"."""
+        start_time = time()
+        # late updates of a round that was already aggregated start their own trace
+        with start_span(
+            "aggregate",
+            self.round_spans.get(round_no),
+            track="aggregator",
+            client_id=kwargs.get("client_id"),
+        ) as span:
+            aggregated_model = self.aggregate_fn(**kwargs)
+            aggregated = bool(aggregated_model)
+            span.args["aggregated"] = aggregated
+        if aggregated:
+            AGGREGATION_SECONDS.observe(
+                time() - start_time, session_id=self.id, aggregator=self.aggregator
+            )
+        AGGREGATOR_CALLS.inc(
+            session_id=self.id, aggregator=self.aggregator, aggregated=aggregated
+        )
+        return aggregated_model
+
+    def round_span(self, round_no):
+        """Span of round "round_no", started by the first request of the round."""
+        span = self.round_spans.get(round_no)
+        if span is None:
+            span = self.round_spans[round_no] = start_span(
+                "round", track="rounds", session_id=self.id, round_no=round_no
+            )
+        return span
+
+    def end_round_span(self, round_no):
+        span = self.round_spans.pop(round_no, None)
+        if span is not None:
+            span.end()
+
     def restore(self, restore, revive):
         print("RECIEVED RESTORE FLAG")
         session_config = self.training_session.get(f"{self.id}.session_config")
@@ -286,6 +409,23 @@ class FloSessionManager:
     async def start_session(self):
         self.logger.debug("session_id", str(self.id))
         self.mqtt_init_finish_event.wait()
+        self.loop = asyncio.get_running_loop()
+        self.mqtt.add_failure_listener(self.client_failed)
+        # a session restarted with the same id in this process starts from its state
+        self.reset_aggregator()
+        try:
+            await self.run_session()
+        finally:
+            self.mqtt.remove_failure_listener(self.client_failed)
+            self.reset_aggregator()
+
+    def reset_aggregator(self) -> None:
+        """Frees what the aggregator keeps in the server process for this session."""
+        reset = getattr(self.aggregator_module, "reset", None)
+        if reset is not None:
+            reset(self.id)
+
+    async def run_session(self):
         if self.protocol == "grpc":
             await self.echo()
         else:
@@ -310,6 +450,67 @@ class FloSessionManager:
         )
         return
 
+    def client_failed(self, client_id: str, detection_latency: float) -> None:
+        """
+        Failure listener of the MQTT manager, called from its sweeper thread when the
+        heartbeats of "client_id" stop. Cancels the gRPC calls awaiting a response from
+        the client, and in MQTT mode drops the client from the round it is training in,
+        instead of waiting for grpc_timeout or the round deadline.
+        """
+        self.logger.warn(
+            "fedserver.client_failed",
+            f"client_id-detection_latency,{client_id},{detection_latency}",
+        )
+        if self.protocol == "grpc":
+            if self.loop is not None and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.cancel_client_calls, client_id)
+            return
+        suffix = f"-{client_id}-TRAIN"
+        for task_id, task_client in list(self.pending_tasks.items()):
+            if task_client != client_id or not task_id.endswith(suffix):
+                continue
+            if not self.end_task(task_id, failed=True):
+                # the result arrived in the meantime
+                continue
+            with self.mqtt_results_lock:
+                self.mqtt_train_callback(
+                    client_id=client_id, metrics={}, local_model_wts=None
+                )
+
+    def cancel_client_calls(self, client_id: str) -> None:
+        calls = self.inflight_calls.pop(client_id, set())
+        for call in calls:
+            self.cancelled_calls.add(call)
+            call.cancel()
+        if calls:
+            self.logger.info(
+                "fedserver.client_failed.cancelled_calls", f"{client_id},{len(calls)}"
+            )
+
+    async def client_call(self, client_id: str, call):
+        """
+        Awaits a gRPC call to "client_id". A call cancelled by cancel_client_calls raises
+        grpc.RpcError with status CANCELLED, handled like a call that timed out.
+        """
+        self.inflight_calls.setdefault(client_id, set()).add(call)
+        try:
+            return await call
+        except asyncio.CancelledError:
+            if call not in self.cancelled_calls:
+                raise
+            raise grpc.aio.AioRpcError(
+                grpc.StatusCode.CANCELLED,
+                grpc.aio.Metadata(),
+                grpc.aio.Metadata(),
+                details=f"{client_id} stopped sending heartbeats",
+            )
+        finally:
+            # also when the call completed before cancel_client_calls cancelled it
+            self.cancelled_calls.discard(call)
+            calls = self.inflight_calls.get(client_id)
+            if calls is not None:
+                calls.discard(call)
+
     async def grpc_echo(self, client_id: str) -> None:
         """
         Asynchronous function that implements a gRPC echo functionality
@@ -324,8 +525,11 @@ class FloSessionManager:
 
         try:
             stub = grpc_pb2_grpc.EdgeServiceStub(channel)
-            response = await stub.Echo(
-                grpc_pb2.echoMessage(text=f"{self.id}"), timeout=self.grpc_timeout
+            response = await self.client_call(
+                client_id,
+                stub.Echo(
+                    grpc_pb2.echoMessage(text=f"{self.id}"), timeout=self.grpc_timeout
+                ),
             )
         except AttributeError:
             self.logger.error("fedserver_gRPC.echo.invalid_channel", f"{client_id}")
@@ -367,16 +571,33 @@ class FloSessionManager:
             try:
                 body = json.loads(str(message.payload.decode()))
                 client_id = message.topic.split("/")[-1]
+                ROUND_CLIENT_BYTES.observe(
+                    len(message.payload),
+                    session_id=self.id,
+                    protocol="mqtt",
+                    direction="received",
+                )
+                TRANSPORT_BYTES.inc(
+                    len(message.payload), protocol="mqtt", direction="received"
+                )
+                if not self.end_task(body.get("task_id")):
+                    # the failure detector already dropped the client from this round
+                    self.logger.warn(
+                        "fedserver_mqtt.train.result.late",
+                        f"client_id-task_id,{client_id},{body.get('task_id')}",
+                    )
+                    return
                 metrics = body.get("metrics", {})
                 weights_b64 = body.get("weights_b64")
                 local_model_wts = None
                 if weights_b64:
                     local_model_wts = pickle.loads(base64.b64decode(weights_b64))
-                self.mqtt_train_callback(
-                    client_id=client_id,
-                    metrics=metrics,
-                    local_model_wts=local_model_wts,
-                )
+                with self.mqtt_results_lock:
+                    self.mqtt_train_callback(
+                        client_id=client_id,
+                        metrics=metrics,
+                        local_model_wts=local_model_wts,
+                    )
             except Exception as e:
                 self.logger.error("fedserver_mqtt.train.result.error", str(e))
 
@@ -391,8 +612,19 @@ class FloSessionManager:
                         "time_taken_s": body.get("bench_duration_s"),
                         "num_mini_batches": body.get("num_mini_batches"),
                         "model_hash": body.get("hash"),
+                        "dataset_id": body.get("dataset_id"),
+                        "batch_size": body.get("batch_size"),
+                        "hw_fingerprint": body.get("hw_fingerprint"),
+                        "timestamp": body.get("timestamp"),
+                        "loader_throughput": body.get("loader_throughput", {}),
                     }
                 }
+                if body.get("compile_mode"):
+                    info[model_id]["compile"] = {
+                        "compile_mode": body.get("compile_mode"),
+                        "compile_time_s": body.get("compile_time_s"),
+                        "speedup": body.get("compile_speedup"),
+                    }
                 self.client_info.put(f"{client_id}.benchmark_info", info)
             except Exception as e:
                 self.logger.error("fedserver_mqtt.benchmark.result.error", str(e))
@@ -403,6 +635,7 @@ class FloSessionManager:
                 body = json.loads(str(message.payload.decode()))
                 client_id = message.topic.split("/")[-1]
                 round_no = body.get("round_id")
+                self.end_task(body.get("task_id"))
                 metrics = body.get("metrics", {})
                 try:
                     res = self.training_state.get(f"{client_id}.validation_metrics")
@@ -448,6 +681,11 @@ class FloSessionManager:
             }
         )
         self.mqtt.publish("flotilla/server/model/global", payload, qos=1, retain=True)
+        # retained, every selected client of the round receives this payload
+        ROUND_CLIENT_BYTES.observe(
+            len(payload), session_id=self.id, protocol="mqtt", direction="sent"
+        )
+        TRANSPORT_BYTES.inc(len(payload), protocol="mqtt", direction="sent")
 
     def publish_model_artifact(self, model_id: str):
         # Create tarball of model dir and publish
@@ -477,13 +715,20 @@ class FloSessionManager:
     def mqtt_publish_command(
         self, client_id: str, task: str, params: dict, round_no: int
     ):
+        task_id = str(self.id) + f"-{round_no}-{client_id}-{task}"
+        # ends when the result with this task_id arrives
+        span = self.task_spans[task_id] = self.round_span(round_no).child(
+            task.lower(), track=client_id, client_id=client_id, protocol="mqtt"
+        )
+        self.pending_tasks[task_id] = client_id
         body = {
             "task": task,
-            "task_id": str(self.id) + f"-{round_no}-{client_id}-{task}",
+            "task_id": task_id,
             "session_id": self.id,
             "round_id": round_no,
             "timestamp": time(),
             "params": params,
+            TRACEPARENT: span.traceparent,
         }
         self.mqtt.publish(
             f"flotilla/server/command/{client_id}",
@@ -492,12 +737,26 @@ class FloSessionManager:
             retain=False,
         )
 
+    def end_task(self, task_id, **args) -> bool:
+        """Ends a task and its span, when its result arrives or its client fails.
+
+        Returns:
+            bool: whether the task was still pending, False if it already ended
+        """
+        pending = self.pending_tasks.pop(task_id, None) is not None
+        span = self.task_spans.pop(task_id, None)
+        if span is not None:
+            span.end(**args)
+        return pending
+
     def mqtt_train_callback(self, client_id: str, metrics: dict, local_model_wts):
         # Mirror grpc_train_callback logic
         round_no = int(self.training_session.get(f"{self.id}.last_round_number"))
         if local_model_wts is None:
             # client considered dropped for this round
+            CLIENT_FAILURES.inc(session_id=self.id, protocol="mqtt", task="train")
             aggregated_model = self.aggregate(
+                round_no=round_no,
                 session_id=self.id,
                 client_id=client_id,
                 client_active=False,
@@ -521,7 +780,16 @@ class FloSessionManager:
                 self.training_state.put(
                     f"{client_id}.training_metrics", training_metrics
                 )
+            update_latency_estimate(
+                self.client_info,
+                client_id,
+                self.train_config["model_id"],
+                metrics,
+                self.latency_ewma_alpha,
+                self.train_config["batch_size"],
+            )
             aggregated_model = self.aggregate(
+                round_no=round_no,
                 session_id=self.id,
                 client_id=client_id,
                 client_active=True,
@@ -539,8 +807,15 @@ class FloSessionManager:
             self.model_util.set_model_weights(aggregated_model)
             # Optional server-side validation
             if round_no % self.server_validation_interval == 0:
-                global_validation_metrics = self.model_util.validate_model(
-                    round_no=round_no
+                server_validation_time = time()
+                with self.round_span(round_no).child(
+                    "server_validation", track="aggregator"
+                ):
+                    global_validation_metrics = self.model_util.validate_model(
+                        round_no=round_no
+                    )
+                SERVER_VALIDATION_SECONDS.observe(
+                    time() - server_validation_time, session_id=self.id
                 )
                 results = self.training_session.get(
                     f"{self.id}.global_validation_metrics"
@@ -555,11 +830,15 @@ class FloSessionManager:
                 )
 
             self.training_session.put(f"{self.id}.last_round_number", round_no + 1)
+            ROUND_SECONDS.observe(time() - self.round_start_time, session_id=self.id)
+            ROUND_NUMBER.set(round_no + 1, session_id=self.id)
+            self.end_round_span(round_no)
+            self.round_start_time = time()
             # Signal round advancement
             # NOTE: train loop waits on an external event we set via mqtt; handled in train()
 
     async def grpc_send_model(
-        self, client_id: str, model_id: str, model_hash, path: str
+        self, client_id: str, model_id: str, model_hash, path: str, span=None
     ):
         """
         Asynchronous function that sends that sends all files passed to the
@@ -567,6 +846,7 @@ class FloSessionManager:
         """
 
         start = time()
+        send_span = None
         try:
             SEND_MODEL = True
             models_on_client: dict = self.client_info.get(f"{client_id}.models")
@@ -578,15 +858,24 @@ class FloSessionManager:
                         SEND_MODEL = True
             if SEND_MODEL:
                 print(f"SENDING MODEL {model_id} to client {client_id}")
+                send_span = start_span(
+                    "send_model", span, track=client_id, client_id=client_id
+                )
                 grpc_ep = self.client_info.get(f"{client_id}.grpc_ep")
                 channel = grpc.aio.insecure_channel(f"{grpc_ep}", self.grpc_opts)
                 stub = grpc_pb2_grpc.EdgeServiceStub(channel)
                 if os.path.isdir(path):
                     for f in os.scandir(path):
                         if os.path.isfile(f.path):
-                            response = await stub.StreamFile(
-                                self.stream_file_chunk(model_id=model_id, path=f.path),
-                                timeout=self.grpc_timeout,
+                            response = await self.client_call(
+                                client_id,
+                                stub.StreamFile(
+                                    self.stream_file_chunk(
+                                        model_id=model_id, path=f.path
+                                    ),
+                                    timeout=self.grpc_timeout,
+                                    metadata=((TRACEPARENT, send_span.traceparent),),
+                                ),
                             )
                             self.logger.info(
                                 "fedserver_gRPC.send_model.cache_miss",
@@ -612,15 +901,18 @@ class FloSessionManager:
             self.logger.error("fedserver_gRPC.send_model.timeout", str(client_id))
             response = None
 
+        if send_span is not None:
+            send_span.end()
         self.logger.info(
             "fedserver_gRPC.send_model.client.finished",
             f"client_id - time_taken,{client_id},{time()-start}",
         )
 
-    async def send_model(self, model_id: str, path: str, clients: list):
+    async def send_model(self, model_id: str, path: str, clients: list, span=None):
         """
         Asynchronous function that sends model with model ID passed to the
         function through the argument "model_id" to all active clients.
+        "span" is the parent of the per client send_model spans.
         """
 
         model_hash = get_model_dir_hash(path)
@@ -628,7 +920,7 @@ class FloSessionManager:
         self.logger.info("fedserver_gRPC.send_model.init", "")
         await asyncio.gather(
             *(
-                self.grpc_send_model(client_id, model_id, model_hash, path)
+                self.grpc_send_model(client_id, model_id, model_hash, path, span)
                 for client_id in clients
             )
         )
@@ -670,17 +962,20 @@ class FloSessionManager:
             model_config = pickle.dumps(self.model_config)
 
             response_time = time()
-            response = await stub.InitBench(
-                grpc_pb2.InitBenchRequest(
-                    model_id=model_id,
-                    model_class=model_class,
-                    model_config=model_config,
-                    dataset_id=dataset_id,
-                    batch_size=batch_size,
-                    learning_rate=learning_rate,
-                    timeout_duration_s=timeout_duration_s,
+            response = await self.client_call(
+                client_id,
+                stub.InitBench(
+                    grpc_pb2.InitBenchRequest(
+                        model_id=model_id,
+                        model_class=model_class,
+                        model_config=model_config,
+                        dataset_id=dataset_id,
+                        batch_size=batch_size,
+                        learning_rate=learning_rate,
+                        timeout_duration_s=timeout_duration_s,
+                    ),
+                    timeout=self.grpc_timeout,
                 ),
-                timeout=self.grpc_timeout,
             )
 
             self.logger.info(
@@ -701,16 +996,31 @@ class FloSessionManager:
             print(error)
 
         if response:
-            self.client_info.put(
-                f"{client_id}.benchmark_info",
-                {
-                    model_id: {
-                        "time_taken_s": response.bench_duration_s,
-                        "num_mini_batches": response.num_mini_batches,
-                        "model_hash": model_hash,
-                    }
-                },
-            )
+            info = {
+                model_id: {
+                    "time_taken_s": response.bench_duration_s,
+                    "num_mini_batches": response.num_mini_batches,
+                    "model_hash": model_hash,
+                    "dataset_id": dataset_id,
+                    "batch_size": batch_size,
+                    "hw_fingerprint": self.client_info.get(
+                        f"{client_id}.hw_fingerprint"
+                    ),
+                    "timestamp": time(),
+                    "loader_throughput": (
+                        json.loads(response.loader_throughput)
+                        if response.HasField("loader_throughput")
+                        else {}
+                    ),
+                }
+            }
+            if response.HasField("compile_mode"):
+                info[model_id]["compile"] = {
+                    "compile_mode": response.compile_mode,
+                    "compile_time_s": response.compile_time_s,
+                    "speedup": response.compile_speedup,
+                }
+            self.client_info.put(f"{client_id}.benchmark_info", info)
 
             self.logger.debug(
                 "fedserver_gRPC.bench.results",
@@ -733,6 +1043,37 @@ class FloSessionManager:
 
         self.client_info.put(f"{client_id}.is_training", False)
 
+    def needs_benchmark(self, client_id: str, model_id: str, model_hash: str) -> bool:
+        """
+        A client is re-benchmarked only if neither its current benchmark_info nor the
+        benchmark_cache it advertised has a result for this model hash, benchmark
+        dataset, batch size and hardware that is younger than cache_ttl_s.
+        """
+        dataset_id = self.bench_config["dataset"]
+        batch_size = self.bench_config["batch_size"]
+        hw_fingerprint = self.client_info.get(f"{client_id}.hw_fingerprint")
+
+        benchmark_info = self.client_info.get(f"{client_id}.benchmark_info") or dict()
+        current = benchmark_info.get(model_id)
+        if matches_benchmark(
+            current, model_hash, dataset_id, batch_size, hw_fingerprint
+        ) and is_fresh(current, self.bench_cache_ttl_s):
+            return False
+
+        benchmark_cache = self.client_info.get(f"{client_id}.benchmark_cache") or dict()
+        cached = benchmark_cache.get(
+            benchmark_cache_key(model_hash, dataset_id, batch_size, hw_fingerprint)
+        )
+        if is_fresh(cached, self.bench_cache_ttl_s):
+            benchmark_info[model_id] = cached
+            self.client_info.put(f"{client_id}.benchmark_info", benchmark_info)
+            self.logger.info(
+                "fedserver.bench.cache_hit",
+                f"{client_id},{model_id},{cached.get('timestamp')}",
+            )
+            return False
+        return True
+
     async def benchmark(self, clients):
         """
         Asynchronous function that initiates a benchmark round for all active
@@ -784,8 +1125,8 @@ class FloSessionManager:
         num_epochs: int,
         round_no: int,
         timeout_duration_s: float,
-        loss,
-        optimizer,
+        loss: dict,
+        optimizer: dict,
         model_updated_event,
         model_updated_condition,
     ) -> None:
@@ -794,6 +1135,9 @@ class FloSessionManager:
         with whose ID is passed to it as the argument "client_id".
         """
         train_start_time = time()
+        span = self.round_span(round_no).child(
+            "train", track=client_id, client_id=client_id, protocol="grpc"
+        )
         self.logger.info("fedserver_gRPC.train.connect", f"connecting to,{client_id}")
         try:
             grpc_ep = self.client_info.get(f"{client_id}.grpc_ep")
@@ -801,6 +1145,7 @@ class FloSessionManager:
             stub = grpc_pb2_grpc.EdgeServiceStub(channel)
 
             self.logger.info("fedserver_gRPC.train.await.response", f"{client_id}")
+            serialize_span = span.child("serialize")
             model_config = pickle.dumps(self.model_config)
             weights_time = time()
             serialized_model_wts: bytes = pickle.dumps(model_wts)
@@ -810,43 +1155,58 @@ class FloSessionManager:
             )
 
             loss_time = time()
-            serialized_loss_fun: bytes = pickle.dumps(loss)
+            serialized_loss_fun: bytes = encode_spec(loss)
             self.logger.info(
-                "fedserver_gRPC.train.round.loss_function.pickle.time",
+                "fedserver_gRPC.train.round.loss_function.spec.encode.time",
                 f"client_id - round_no - time_taken,{client_id},{round_no},{time() - loss_time}",
             )
 
             optimizer_time = time()
-            serialized_optimizer: bytes = pickle.dumps(optimizer)
+            serialized_optimizer: bytes = encode_spec(optimizer)
             self.logger.info(
-                "fedserver_gRPC.train.round.optimizer.pickle.time",
+                "fedserver_gRPC.train.round.optimizer.spec.encode.time",
                 f"client_id - round_no - time_taken,{client_id},{round_no},{time() - optimizer_time}",
             )
 
+            serialize_span.end()
+
             response_time = time()
-            response = await stub.StartTraining(
-                grpc_pb2.InitTrainRequest(
-                    session_id=session_id,
-                    model_id=model_id,
-                    model_class=model_class,
-                    model_config=model_config,
-                    model_wts=serialized_model_wts,
-                    dataset_id=dataset_id,
-                    batch_size=batch_size,
-                    learning_rate=learning_rate,
-                    num_epochs=num_epochs,
-                    round_idx=round_no,
-                    timeout_duration_s=timeout_duration_s,
-                    loss_function=serialized_loss_fun,
-                    optimizer=serialized_optimizer,
+            response = await self.client_call(
+                client_id,
+                stub.StartTraining(
+                    grpc_pb2.InitTrainRequest(
+                        session_id=session_id,
+                        model_id=model_id,
+                        model_class=model_class,
+                        model_config=model_config,
+                        model_wts=serialized_model_wts,
+                        dataset_id=dataset_id,
+                        batch_size=batch_size,
+                        learning_rate=learning_rate,
+                        num_epochs=num_epochs,
+                        round_idx=round_no,
+                        timeout_duration_s=timeout_duration_s,
+                        loss_function=serialized_loss_fun,
+                        optimizer=serialized_optimizer,
+                    ),
+                    timeout=self.grpc_timeout,
+                    metadata=((TRACEPARENT, span.traceparent),),
                 ),
-                timeout=self.grpc_timeout,
             )
 
             self.logger.info(
                 "fedserver_gRPC.train.round.await.response_time",
                 f"{client_id},{round_no},{time()-response_time}",
             )
+            self.observe_grpc_round(
+                "train",
+                time() - response_time,
+                len(model_config)
+                + len(serialized_model_wts)
+                + len(serialized_loss_fun)
+                + len(serialized_optimizer),
+                len(response.model_weights) + len(response.metrics),
+            )
 
             self.logger.info(
                 "fedserver_gRPC.train.round.client.finished",
@@ -875,9 +1235,22 @@ class FloSessionManager:
             )
             print("AFTER TRAIN CALLBACK")
             print("ROUND NO = ", round_no)
+            span.end(responded=response is not None)
             model_updated_event.set()
             print(model_updated_event)
 
+    def observe_grpc_round(
+        self, task: str, response_time: float, sent_b: int, received_b: int
+    ):
+        CLIENT_RESPONSE_SECONDS.observe(
+            response_time, session_id=self.id, protocol="grpc", task=task
+        )
+        for direction, size in (("sent", sent_b), ("received", received_b)):
+            ROUND_CLIENT_BYTES.observe(
+                size, session_id=self.id, protocol="grpc", direction=direction
+            )
+            TRANSPORT_BYTES.inc(size, protocol="grpc", direction=direction)
+
     def grpc_train_callback(self, client_id, start_time, response):
         if response:
             metrics = pickle.loads(response.metrics)
@@ -915,9 +1288,18 @@ class FloSessionManager:
                 self.training_state.put(
                     f"{client_id}.training_metrics", training_metrics
                 )
+            update_latency_estimate(
+                self.client_info,
+                client_id,
+                self.train_config["model_id"],
+                metrics,
+                self.latency_ewma_alpha,
+                self.train_config["batch_size"],
+            )
 
             aggregate_start_time = time()
             aggregated_model = self.aggregate(
+                round_no=round_no,
                 session_id=self.id,
                 client_id=client_id,
                 client_active=True,
@@ -931,10 +1313,13 @@ class FloSessionManager:
             )
         elif response == None:
             self.logger.warn("fedserver.train.client_dropped", f"{client_id}")
+            CLIENT_FAILURES.inc(session_id=self.id, protocol="grpc", task="train")
             print("CLIENT DIED")
             print(client_id, " TRAIN RESPONSE EMPTY")
             round_no = int(self.training_session.get(f"{self.id}.last_round_number"))
+            aggregate_start_time = time()
             aggregated_model = self.aggregate(
+                round_no=round_no,
                 session_id=self.id,
                 client_id=client_id,
                 client_active=False,
@@ -950,59 +1335,115 @@ class FloSessionManager:
 
         if aggregated_model:
             print("GOT AGGREGATED MODEL", client_id)
-            aggregate_end_time = time() - aggregate_start_time
-            round_no = int(self.training_session.get(f"{self.id}.last_round_number"))
-            self.training_session.put(f"{self.id}.global_model", aggregated_model)
-            self.model_util.set_model_weights(aggregated_model)
-            if round_no % self.server_validation_interval == 0:
-                server_validation_time = time()
-                global_validation_metrics = self.model_util.validate_model(
-                    round_no=round_no
-                )
-                self.logger.info(
-                    "fedserver.train_callback.server_validation_time",
-                    f"{time()-server_validation_time}",
-                )
-                results = self.training_session.get(
-                    f"{self.id}.global_validation_metrics"
-                )
-                for key in global_validation_metrics.keys():
-                    if key in results:
-                        results[key].append(global_validation_metrics[key])
-                    else:
-                        results[key] = [global_validation_metrics[key]]
-                self.training_session.put(
-                    f"{self.id}.global_validation_metrics", results
-                )
+            round_no = self.apply_aggregated_model(
+                aggregated_model, time() - aggregate_start_time
+            )
+        print("ROUND NO = ", round_no)
+        return round_no
 
-                self.logger.info(
-                    "fedserver.train_callback",
-                    f"round_no,{','.join(list(global_validation_metrics.keys()))},{round_no+1},{','.join([str(i) for i in global_validation_metrics.values()])}",
-                )
-                self.logger.info(
-                    "fedserver.train_callback.aggregate_time",
-                    f"{round_no},{aggregate_end_time}",
-                )
-            self.training_session.put(f"{self.id}.last_round_number", round_no + 1)
+    async def async_round_deadline(
+        self, deadline, round_no, model_updated_event, model_updated_condition
+    ):
+        """Wakes the train loop at the round deadline, the same way a training response does."""
+        await asyncio.sleep(max(0.0, deadline - time()))
+        await model_updated_condition.acquire()
+        self.round_deadline_callback(round_no)
+        model_updated_event.set()
 
-            if (
-                self.checkpoint_interval
-                and (round_no + 1) % self.checkpoint_interval == 0
+    def round_deadline_callback(self, round_no):
+        """
+        Runs the aggregator without a client update once the round deadline set by
+        start_round has passed, so that the clients that already reported are aggregated
+        without waiting for the stragglers. Returns True if the round was aggregated.
+        """
+        if self.client_selection_state.get(
+            "round_no"
+        ) != round_no or not deadline_passed(self.client_selection_state):
+            # round was already aggregated, or a later round set a new deadline
+            return False
+        self.logger.info("fedserver.train.round_deadline", f"{round_no}")
+        aggregate_start_time = time()
+        aggregated_model = self.aggregate(
+            round_no=round_no,
+            session_id=self.id,
+            client_id=None,
+            client_active=None,
+            client_local_weights=None,
+            client_info=self.client_info,
+            training_state=self.training_state,
+            training_session=self.training_session,
+            aggregator_state=self.aggregator_state,
+            client_selection_state=self.client_selection_state,
+            args=self.aggregator_args,
+        )
+        # nothing to aggregate yet, wait for the next update without a deadline
+        self.client_selection_state.put("round_deadline", None)
+        if aggregated_model:
+            self.apply_aggregated_model(aggregated_model, time() - aggregate_start_time)
+            return True
+        return False
+
+    def apply_aggregated_model(self, aggregated_model, aggregate_end_time):
+        """Installs a new global model, runs server validation and checkpointing, and
+        advances the round number."""
+        round_no = int(self.training_session.get(f"{self.id}.last_round_number"))
+        self.training_session.put(f"{self.id}.global_model", aggregated_model)
+        self.model_util.set_model_weights(aggregated_model)
+        if round_no % self.server_validation_interval == 0:
+            server_validation_time = time()
+            with self.round_span(round_no).child(
+                "server_validation", track="aggregator"
             ):
-                self.checkpoint(round_no)
+                global_validation_metrics = self.model_util.validate_model(
+                    round_no=round_no
+                )
+            self.logger.info(
+                "fedserver.train_callback.server_validation_time",
+                f"{time()-server_validation_time}",
+            )
+            SERVER_VALIDATION_SECONDS.observe(
+                time() - server_validation_time, session_id=self.id
+            )
+            results = self.training_session.get(f"{self.id}.global_validation_metrics")
+            for key in global_validation_metrics.keys():
+                if key in results:
+                    results[key].append(global_validation_metrics[key])
+                else:
+                    results[key] = [global_validation_metrics[key]]
+            self.training_session.put(f"{self.id}.global_validation_metrics", results)
 
             self.logger.info(
-                "fedserver.train.server_round_time",
-                f"{round_no},{time()-self.round_start_time}",
+                "fedserver.train_callback",
+                f"round_no,{','.join(list(global_validation_metrics.keys()))},{round_no+1},{','.join([str(i) for i in global_validation_metrics.values()])}",
             )
-            self.round_start_time = time()
-            print("RETURNING ROUND RESULTS", client_id)
-        print("ROUND NO = ", round_no)
+            self.logger.info(
+                "fedserver.train_callback.aggregate_time",
+                f"{round_no},{aggregate_end_time}",
+            )
+        self.training_session.put(f"{self.id}.last_round_number", round_no + 1)
+
+        if self.checkpoint_interval and (round_no + 1) % self.checkpoint_interval == 0:
+            self.checkpoint(round_no)
+
+        round_time = time() - self.round_start_time
+        self.logger.info(
+            "fedserver.train.server_round_time",
+            f"{round_no},{round_time}",
+        )
+        ROUND_SECONDS.observe(round_time, session_id=self.id)
+        ROUND_NUMBER.set(round_no + 1, session_id=self.id)
+        self.end_round_span(round_no)
+        self.round_start_time = time()
+        print("RETURNING ROUND RESULTS")
         return round_no
 
     def checkpoint(self, round_no):
         checkpoint_start_time = time()
         print("CHECKPOINTING", round_no)
+        # aggregators that keep their state in memory write it to aggregator_state here
+        checkpoint_aggregator = getattr(self.aggregator_module, "checkpoint", None)
+        if checkpoint_aggregator is not None:
+            checkpoint_aggregator(self.id, self.aggregator_state)
         training_session_bytearray = pickle.dumps(self.training_session.getall())
         training_session_source_file = io.BytesIO(
             initial_bytes=training_session_bytearray
@@ -1056,8 +1497,8 @@ class FloSessionManager:
         model_wts: OrderedDict,
         batch_size: int,
         round_no: int,
-        loss,
-        optimizer,
+        loss: dict,
+        optimizer: dict,
         model_updated_event,
         model_updated_condition,
     ) -> None:
@@ -1066,6 +1507,9 @@ class FloSessionManager:
         with clients whose ID is passed to it as the argument "client_id".
         """
         validation_start_time = time()
+        span = self.round_span(round_no).child(
+            "validation", track=client_id, client_id=client_id, protocol="grpc"
+        )
 
         self.logger.info(
             "fedserver_gRPC.validation.connect", f"connecting to,{client_id}"
@@ -1076,49 +1520,64 @@ class FloSessionManager:
             stub = grpc_pb2_grpc.EdgeServiceStub(channel)
 
             self.logger.info("fedserver_gRPC.validation.await.response", f"{client_id}")
+            serialize_span = span.child("serialize")
 
             weights_time = time()
             serialized_model_wts: bytes = pickle.dumps(model_wts)
             self.logger.info(
-                "fedserver_gRPC.validation.round.loss_function.pickle.time",
+                "fedserver_gRPC.validation.round.model_wts.pickle.time",
                 f"client_id - round_no - time_taken,{client_id},{round_no},{time() - weights_time}",
             )
 
             loss_time = time()
-            serialized_loss_fun: bytes = pickle.dumps(loss)
+            serialized_loss_fun: bytes = encode_spec(loss)
             self.logger.info(
-                "fedserver_gRPC.validation.round.loss_function.pickle.time",
+                "fedserver_gRPC.validation.round.loss_function.spec.encode.time",
                 f"client_id - round_no - time_taken,{client_id},{round_no},{time() - loss_time}",
             )
 
             optimizer_time = time()
-            serialized_optimizer: bytes = pickle.dumps(optimizer)
+            serialized_optimizer: bytes = encode_spec(optimizer)
             self.logger.info(
-                "fedserver_gRPC.train.round.optimizer.pickle.time",
+                "fedserver_gRPC.validation.round.optimizer.spec.encode.time",
                 f"client_id - round_no - time_taken,{client_id},{round_no},{time() - optimizer_time}",
             )
 
+            serialize_span.end()
+
             response_time = time()
-            response = await stub.StartValidation(
-                grpc_pb2.InitValidationRequest(
-                    session_id=session_id,
-                    model_id=model_id,
-                    model_class=model_class,
-                    model_config=pickle.dumps(self.model_config),
-                    dataset_id=dataset_id,
-                    model_wts=serialized_model_wts,
-                    batch_size=batch_size,
-                    round_idx=round_no,
-                    loss_function=serialized_loss_fun,
-                    optimizer=serialized_optimizer,
+            response = await self.client_call(
+                client_id,
+                stub.StartValidation(
+                    grpc_pb2.InitValidationRequest(
+                        session_id=session_id,
+                        model_id=model_id,
+                        model_class=model_class,
+                        model_config=pickle.dumps(self.model_config),
+                        dataset_id=dataset_id,
+                        model_wts=serialized_model_wts,
+                        batch_size=batch_size,
+                        round_idx=round_no,
+                        loss_function=serialized_loss_fun,
+                        optimizer=serialized_optimizer,
+                    ),
+                    timeout=self.grpc_timeout,
+                    metadata=((TRACEPARENT, span.traceparent),),
                 ),
-                timeout=self.grpc_timeout,
             )
 
             self.logger.info(
                 "fedserver_gRPC.validation.round.await.response_time",
                 f"{client_id},{round_no},{time()-response_time}",
             )
+            self.observe_grpc_round(
+                "validation",
+                time() - response_time,
+                len(serialized_model_wts)
+                + len(serialized_loss_fun)
+                + len(serialized_optimizer),
+                len(response.metrics),
+            )
 
             self.logger.info(
                 "fedserver_gRPC.validation.round.client.finished",
@@ -1147,12 +1606,14 @@ class FloSessionManager:
                 start_time=validation_start_time,
                 response=response,
             )
+            span.end(responded=response is not None)
             model_updated_event.set()
             print(model_updated_condition, model_updated_event)
 
     def grpc_validation_callback(self, client_id, round_no, start_time, response):
         if not response:
             print(client_id, " VALIDATION RESPONSE EMPTY")
+            CLIENT_FAILURES.inc(session_id=self.id, protocol="grpc", task="validation")
             return
         metrics = pickle.loads(response.metrics)
 
@@ -1231,13 +1692,7 @@ class FloSessionManager:
                 benchmark_overhead_time = time()
                 benchmark_clients = list()
                 for client in self.get_active_clients():
-                    benchmark_info = self.client_info.get(f"{client}.benchmark_info")
-                    # print(f"BENCHMARK INFO FOR CLIENT {client} = ", benchmark_info)
-                    if bench_model_id not in benchmark_info.keys() or (
-                        benchmark_info[bench_model_id]
-                        and benchmark_info[bench_model_id]["model_hash"]
-                        != bench_model_hash
-                    ):
+                    if self.needs_benchmark(client, bench_model_id, bench_model_hash):
                         benchmark_clients.append(client)
 
                 # print("CLIENTS TO BENCHMARK = ", benchmark_clients)
@@ -1268,8 +1723,14 @@ class FloSessionManager:
             print(
                 f"IN WHILE LOOP clients selected = {training_clients}, validation clients = {validation_clients}"
             )
+            client_selection_time = time() - client_selection_time
             self.logger.info(
-                "train.client_selection.time_taken", f"{time()-client_selection_time}"
+                "train.client_selection.time_taken", f"{client_selection_time}"
+            )
+            CLIENT_SELECTION_SECONDS.observe(
+                client_selection_time,
+                session_id=self.id,
+                client_selection=self.client_selection_strategy,
             )
 
             training_clients = (
@@ -1293,15 +1754,20 @@ class FloSessionManager:
 
             if training_clients and len(training_clients) > 0:
                 model_wts = self.model_util.get_model_weights()
-                loss = self.model_util.get_loss_fun()
-                optimizer = self.model_util.get_optimizer()
+                loss = self.loss_spec
+                optimizer = self.optimizer_spec
                 round_no = self.training_session.get(f"{self.id}.last_round_number")
                 self.logger.debug(
                     "fedserver_gRPC.train.round.init",
                     f"round_no-num_clients-clients,{round_no},{len(training_clients)},{','.join([str(x) for x in training_clients])}",
                 )
                 if self.protocol == "grpc":
-                    await self.send_model(model_id, model_dir, training_clients)
+                    await self.send_model(
+                        model_id,
+                        model_dir,
+                        training_clients,
+                        span=self.round_span(round_no),
+                    )
                     asyncio.gather(
                         *(
                             self.async_grpc_train(
@@ -1324,6 +1790,25 @@ class FloSessionManager:
                             for client_id in training_clients
                         )
                     )
+                    deadline = start_round(
+                        self.client_selection_state,
+                        self.client_info,
+                        self.training_state,
+                        training_clients,
+                        model_id,
+                        round_no,
+                        self.aggregator_args,
+                        batch_size,
+                    )
+                    if deadline is not None:
+                        asyncio.ensure_future(
+                            self.async_round_deadline(
+                                deadline,
+                                round_no,
+                                model_updated_event,
+                                model_updated_condition,
+                            )
+                        )
                 else:
                     # MQTT: publish retained global model for the round and send commands
                     if round_no not in self.rounds_issued:
@@ -1337,23 +1822,40 @@ class FloSessionManager:
                                 "learning_rate": lr,
                                 "num_epochs": epochs,
                                 "timeout_duration_s": timeout,
+                                "loss_function": self.loss_spec,
+                                "optimizer": self.optimizer_spec,
                             }
                             self.mqtt_publish_command(
                                 client_id, "TRAIN", params, round_no
                             )
                         self.rounds_issued.add(round_no)
+                        start_round(
+                            self.client_selection_state,
+                            self.client_info,
+                            self.training_state,
+                            training_clients,
+                            model_id,
+                            round_no,
+                            self.aggregator_args,
+                            batch_size,
+                        )
 
             if validation_clients and len(validation_clients) > 0:
                 model_wts = self.model_util.get_model_weights()
-                loss = self.model_util.get_loss_fun()
-                optimizer = self.model_util.get_optimizer()
+                loss = self.loss_spec
+                optimizer = self.optimizer_spec
                 round_no = self.training_session.get(f"{self.id}.last_round_number")
                 self.logger.debug(
                     "fedserver_gRPC.validation.round.init",
                     f"round_no-num_clients-clients,{round_no},{len(validation_clients)},{','.join([str(x) for x in validation_clients])}",
                 )
                 if self.protocol == "grpc":
-                    await self.send_model(model_id, model_dir, validation_clients)
+                    await self.send_model(
+                        model_id,
+                        model_dir,
+                        validation_clients,
+                        span=self.round_span(round_no),
+                    )
                     asyncio.gather(
                         *(
                             self.async_grpc_validation(
@@ -1383,6 +1885,8 @@ class FloSessionManager:
                                 "model_class": model_class,
                                 "dataset_id": dataset_id,
                                 "batch_size": batch_size,
+                                "loss_function": self.loss_spec,
+                                "optimizer": self.optimizer_spec,
                             }
                             self.mqtt_publish_command(
                                 client_id, "TEST", params, round_no
@@ -1396,8 +1900,21 @@ class FloSessionManager:
                 # In MQTT mode, proceed when round number advances (set in mqtt_train_callback)
                 if self.training_session.get(f"{self.id}.last_round_number") > round_no:
                     continue
+                # results and dropped clients are aggregated on the paho and sweeper
+                # threads under the same lock
+                with self.mqtt_results_lock:
+                    fired = deadline_passed(self.client_selection_state)
+                    if fired:
+                        self.round_deadline_callback(
+                            self.client_selection_state.get("round_no")
+                        )
+                if fired:
+                    continue
                 await asyncio.sleep(0.05)
 
+        for round_no in list(self.round_spans):
+            # rounds that were issued but never aggregated
+            self.end_round_span(round_no)
         self.logger.info("fedserver.session.loop_runtime", f"{time()-start_time}")
         print(f"Training Ends.")
         return
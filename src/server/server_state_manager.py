@@ -25,6 +25,8 @@ class StateManager:
         self.get_large = kvstore.get
         self.put = kvstore.put
         self.put_large = kvstore.put
+        self.getmany = kvstore.getmany
+        self.putmany = kvstore.putmany
         self.keys = kvstore.keys
         self.len = kvstore.len
         self.clear = kvstore.clear
@@ -44,6 +46,12 @@ class StateManager:
     def put_large(self, key, value):
         raise NotImplementedError
 
+    def getmany(self, keys):
+        raise NotImplementedError
+
+    def putmany(self, values):
+        raise NotImplementedError
+
     def keys(self):
         raise NotImplementedError
 
@@ -72,6 +80,7 @@ class ReadOnlyState:
         )
         self.get = kvstore.get
         self.get_large = kvstore.get
+        self.getmany = kvstore.getmany
         self.keys = kvstore.keys
         self.len = kvstore.len
 
@@ -81,6 +90,9 @@ class ReadOnlyState:
     def get_large(self, key):
         raise NotImplementedError
 
+    def getmany(self, keys):
+        raise NotImplementedError
+
     def keys(self):
         raise NotImplementedError
 
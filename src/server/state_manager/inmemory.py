@@ -24,6 +24,13 @@ class StateManager:
             setter = setter[k]
         setter[keys[-1]] = value
 
+    def getmany(self, keys: list) -> list:
+        return [self.get(key) for key in keys]
+
+    def putmany(self, values: dict) -> None:
+        for key, value in values.items():
+            self.put(key, value)
+
     def keys(self):
         return self.state.keys()
 
@@ -36,11 +43,12 @@ class StateManager:
     def deletebykey(self, key):
         deleter = self.state
         keys = key.split(".")
-        for k in keys[-1]:
-            if k not in deleter:
+        for k in keys[:-1]:
+            if not isinstance(deleter, dict) or k not in deleter:
                 return
             deleter = deleter[k]
-        del deleter[keys[-1]]
+        if isinstance(deleter, dict):
+            deleter.pop(keys[-1], None)
 
     def getall(self):
         return self.state
@@ -40,6 +40,34 @@ class StateManager:
         except redis_exceptions.DataError:
             self.logger.error("fedserver.redis", f"Invalid input type")
 
+    def getmany(self, keys: list) -> list:
+        """get of several keys in one round trip, None for missing keys"""
+        if not keys:
+            return []
+        try:
+            values = self.redis.hmget(self.name, keys)
+        except redis_exceptions.ConnectionError as e:
+            self.logger.error("fedserver.redis", "-".join(e.args))
+            return [None] * len(keys)
+        return [None if value is None else p_loads(value) for value in values]
+
+    def putmany(self, values: dict):
+        """put of several keys in one round trip"""
+        pipeline = self.redis.pipeline(transaction=False)
+        for key, value in values.items():
+            try:
+                pipeline.hset(self.name, key, p_dumps(value))
+            except PicklingError:
+                self.logger.error("fedserver.redis", f"{value} cannot be pickled")
+                continue
+            pipeline.sadd(f"keys_{self.name}", key.split(".")[0])
+        try:
+            pipeline.execute()
+        except redis_exceptions.ConnectionError as e:
+            self.logger.error("fedserver.redis", "-".join(e.args))
+        except redis_exceptions.DataError:
+            self.logger.error("fedserver.redis", f"Invalid input type")
+
     def keys(self):
         try:
             return [
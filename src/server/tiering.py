@@ -0,0 +1,236 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import numpy as np
+
+# client_selection_state keys shared by the tiered client_selection plugins
+TIER_DICT_KEY = "client_to_tier_id_dict"
+TIER_CENTROIDS_KEY = "tier_centroids"
+TIERING_ROUND_KEY = "tiering_round"
+
+TIERING_METHODS = ("kmeans", "quantile")
+
+DEFAULT_TIERING_ARGS = {
+    # "kmeans" or "quantile", quantile only applies to 1-D values such as latencies
+    "tiering_method": "kmeans",
+    # rounds between full re-clusterings, None only places new clients
+    "recluster_interval": 10,
+    # Lloyd iterations per re-clustering
+    "tiering_max_iter": 20,
+}
+
+
+def parse_tiering_args(args) -> dict:
+    """Merges the client_selection_args of the session with DEFAULT_TIERING_ARGS."""
+    tiering_args = dict(DEFAULT_TIERING_ARGS)
+    if isinstance(args, dict):
+        for key in DEFAULT_TIERING_ARGS:
+            value = args.get(key, tiering_args[key])
+            if isinstance(value, str) and value.lower() == "none":
+                value = None
+            tiering_args[key] = value
+    if tiering_args["tiering_method"] not in TIERING_METHODS:
+        print(
+            f"tiering.parse_tiering_args:: Unknown tiering_method {tiering_args['tiering_method']}, using kmeans"
+        )
+        tiering_args["tiering_method"] = "kmeans"
+    return tiering_args
+
+
+def _as_matrix(values, dim=None) -> np.ndarray:
+    """(n, d) float array, shorter vectors are padded with zeros up to "dim"."""
+    rows = [np.atleast_1d(np.asarray(v, dtype=float)) for v in values]
+    dim = max([dim or 0] + [len(r) for r in rows])
+    matrix = np.zeros((len(rows), dim))
+    for i, row in enumerate(rows):
+        matrix[i, : len(row)] = row
+    return matrix
+
+
+def _initial_centroids(points: np.ndarray, num_tiers: int) -> np.ndarray:
+    if points.shape[1] == 1:
+        # quantiles of the sorted values, so that tier 0 is the fastest
+        return np.quantile(
+            points[:, 0], (np.arange(num_tiers) + 0.5) / num_tiers
+        ).reshape(-1, 1)
+    # farthest point initialisation, deterministic and O(n * tiers)
+    centroids = [points[np.argmin(np.linalg.norm(points - points.mean(0), axis=1))]]
+    distances = np.linalg.norm(points - centroids[0], axis=1)
+    for _ in range(1, num_tiers):
+        centroids.append(points[np.argmax(distances)])
+        distances = np.minimum(
+            distances, np.linalg.norm(points - centroids[-1], axis=1)
+        )
+    return np.array(centroids)
+
+
+def nearest_tiers(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest centroid of every row of "points", O(tiers) per point."""
+    distances = np.linalg.norm(points[:, None, :] - centroids[None, :, :], axis=2)
+    return np.argmin(distances, axis=1)
+
+
+def kmeans(points: np.ndarray, num_tiers: int, centroids=None, max_iter: int = 20):
+    """Lloyd's k-means, warm started from "centroids" when re-clustering so that tier
+    ids stay stable. Empty tiers keep their previous centroid.
+
+    Returns:
+        (np.ndarray, np.ndarray): tier of every point and the (num_tiers, d) centroids
+    """
+    if centroids is None:
+        centroids = _initial_centroids(points, num_tiers)
+    centroids = np.array(centroids, dtype=float)
+    labels = nearest_tiers(points, centroids)
+    for _ in range(max_iter):
+        for tier in range(num_tiers):
+            members = points[labels == tier]
+            if len(members) > 0:
+                centroids[tier] = members.mean(0)
+        new_labels = nearest_tiers(points, centroids)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return labels, centroids
+
+
+def quantile_tiers(points: np.ndarray, num_tiers: int, centroids=None):
+    """Equal-sized tiers of a 1-D value, O(n log n)."""
+    values = points[:, 0]
+    edges = np.quantile(values, np.arange(1, num_tiers) / num_tiers)
+    labels = np.searchsorted(edges, values, side="right")
+    new_centroids = (
+        np.array(centroids, dtype=float)
+        if centroids is not None
+        else _initial_centroids(points, num_tiers)
+    )
+    for tier in range(num_tiers):
+        members = values[labels == tier]
+        if len(members) > 0:
+            new_centroids[tier] = members.mean()
+    return labels, new_centroids
+
+
+def _fill_empty_tiers(points: np.ndarray, labels: np.ndarray, centroids: np.ndarray):
+    """Moves the point farthest from its centroid in the largest tier into each empty
+    tier, e.g. when many clients report the same latency."""
+    labels = labels.copy()
+    num_tiers = len(centroids)
+    if len(points) < num_tiers:
+        return labels, centroids
+    for tier in range(num_tiers):
+        if np.any(labels == tier):
+            continue
+        largest = np.argmax(np.bincount(labels, minlength=num_tiers))
+        members = np.flatnonzero(labels == largest)
+        distances = np.linalg.norm(points[members] - centroids[largest], axis=1)
+        # the last of the equally distant points, so that ties keep their order
+        farthest = members[len(distances) - 1 - np.argmax(distances[::-1])]
+        labels[farthest] = tier
+        centroids[tier] = points[farthest]
+        centroids[largest] = points[labels == largest].mean(0)
+    return labels, centroids
+
+
+def _order_by_centroid(labels: np.ndarray, centroids: np.ndarray):
+    """Renumbers 1-D tiers in increasing order of their centroid."""
+    order = np.argsort(centroids[:, 0], kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[labels], centroids[order]
+
+
+def get_client_tiers(
+    client_selection_state,
+    client_values: dict,
+    num_tiers: int,
+    current_round: int,
+    args=None,
+    pinned_clients=(),
+) -> dict:
+    """Tier of every client, kept in client_selection_state["client_to_tier_id_dict"].
+
+    The first call clusters all clients. Later calls place clients that have no tier
+    yet on the nearest tier centroid, and every "recluster_interval" rounds all clients
+    are re-clustered starting from the previous centroids. Clients in "pinned_clients",
+    e.g. clients that are training, keep their current tier. The number of tiers is
+    fixed by the first call.
+
+    Args:
+        client_selection_state (StateManager): state of the client_selection plugin
+        client_values (dict): client_id -> value to tier on, a latency or a vector.
+            Clients with a None value are left without a tier.
+        num_tiers (int): number of tiers for the first clustering
+        current_round (int): last_round_number of the session
+        args (dict, optional): client_selection_args, see DEFAULT_TIERING_ARGS
+        pinned_clients (iterable, optional): clients whose tier must not change
+
+    Returns:
+        dict: client_id -> tier id in range(num_tiers)
+    """
+    tiering_args = parse_tiering_args(args)
+    client_to_tier = client_selection_state.get(TIER_DICT_KEY) or dict()
+    centroids = client_selection_state.get(TIER_CENTROIDS_KEY)
+    tiering_round = client_selection_state.get(TIERING_ROUND_KEY)
+
+    clients = [c for c, v in client_values.items() if v is not None]
+    if len(clients) == 0:
+        return client_to_tier
+    points = _as_matrix(
+        [client_values[c] for c in clients],
+        None if centroids is None else len(centroids[0]),
+    )
+    one_dimensional = points.shape[1] == 1
+
+    recluster_interval = tiering_args["recluster_interval"]
+    if centroids is None:
+        num_tiers = max(1, min(int(num_tiers), len(clients)))
+        recluster = True
+    else:
+        centroids = _as_matrix(centroids, points.shape[1])
+        num_tiers = len(centroids)
+        recluster = (
+            recluster_interval is not None
+            and current_round - tiering_round >= int(recluster_interval)
+        )
+
+    if recluster:
+        if tiering_args["tiering_method"] == "quantile" and one_dimensional:
+            labels, centroids = quantile_tiers(points, num_tiers, centroids)
+        else:
+            labels, centroids = kmeans(
+                points, num_tiers, centroids, int(tiering_args["tiering_max_iter"])
+            )
+        labels, centroids = _fill_empty_tiers(points, labels, centroids)
+        if one_dimensional:
+            labels, centroids = _order_by_centroid(labels, centroids)
+        pinned_clients = set(pinned_clients)
+        for client, label in zip(clients, labels):
+            if client not in pinned_clients or client not in client_to_tier:
+                client_to_tier[client] = int(label)
+        client_selection_state.put(TIERING_ROUND_KEY, current_round)
+        print(
+            f"TIERING:: round {current_round} clustered {len(clients)} clients into {num_tiers} tiers, centroids = {centroids.tolist()}"
+        )
+    else:
+        new_clients = [i for i, c in enumerate(clients) if c not in client_to_tier]
+        if new_clients:
+            labels = nearest_tiers(points[new_clients], centroids)
+            for i, label in zip(new_clients, labels):
+                client_to_tier[clients[i]] = int(label)
+            print(
+                f"TIERING:: placed new clients {[clients[i] for i in new_clients]} in tiers {labels.tolist()}"
+            )
+
+    client_selection_state.put(TIER_CENTROIDS_KEY, centroids.tolist())
+    client_selection_state.put(TIER_DICT_KEY, client_to_tier)
+    return client_to_tier
+
+
+def get_num_tiers(client_selection_state):
+    """Number of tiers fixed by the first get_client_tiers call, None before it."""
+    centroids = client_selection_state.get(TIER_CENTROIDS_KEY)
+    return None if centroids is None else len(centroids)
@@ -0,0 +1,92 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import json
+from functools import partial
+from pickle import loads as p_loads
+
+from server.load_loss import load_loss
+from server.load_optimizer import load_optimizer
+
+# The optimizer and loss function of a session are sent to the clients as specs, the
+# name of a server.optimizer / server.loss module and its hyperparameters, e.g.
+#   {"name": "adam", "custom": true, "lr": 0.001, "args": {"weight_decay": 0.0001},
+#    "persist_state": true}
+#   {"name": "crossentropy", "custom": true, "args": {"label_smoothing": 0.1}}
+# and the clients build them for their own model with load_optimizer and load_loss.
+
+
+def optimizer_spec(train_config: dict) -> dict:
+    return {
+        "name": train_config["optimizer"],
+        "custom": train_config["optimizer_custom"],
+        "lr": train_config["learning_rate"],
+        "args": train_config.get("optimizer_args") or dict(),
+        # keep the optimizer state, e.g. Adam's moments, on the client across rounds
+        "persist_state": bool(train_config.get("optimizer_persist_state", False)),
+    }
+
+
+def loss_spec(train_config: dict) -> dict:
+    return {
+        "name": train_config["loss_function"],
+        "custom": train_config["loss_function_custom"],
+        "args": train_config.get("loss_function_args") or dict(),
+    }
+
+
+def encode_spec(spec: dict) -> bytes:
+    return json.dumps(spec).encode()
+
+
+def decode_spec(data: bytes):
+    """
+    Returns:
+        dict: spec of the request field, None if it is empty, or the object itself if
+        the server sent a pickled optimizer or loss function
+    """
+    if not data:
+        return None
+    if data[:1] == b"{":
+        return json.loads(data.decode())
+    return p_loads(data)
+
+
+def is_spec(value) -> bool:
+    return isinstance(value, dict) and "name" in value
+
+
+def optimizer_from_spec(id, spec: dict, params, state_dict: dict = None):
+    """Optimizer of the spec over "params", with the state of an earlier round if
+    "state_dict" is given, or None if its module cannot be imported. The
+    hyperparameters in "args" are set on every parameter group and on the defaults of
+    the optimizer."""
+    module = load_optimizer(id, spec["name"], spec.get("custom", True))
+    if module is None:
+        return None
+    optimizer = module.optimizer_selection(params, lr=spec["lr"])
+    if state_dict is not None:
+        try:
+            optimizer.load_state_dict(state_dict)
+        except (ValueError, KeyError) as e:
+            print(f"training_spec.optimizer_from_spec:: state not restored: {e}")
+    hyperparameters = dict(spec.get("args") or dict(), lr=spec["lr"])
+    optimizer.defaults.update(hyperparameters)
+    for param_group in optimizer.param_groups:
+        param_group.update(hyperparameters)
+    return optimizer
+
+
+def loss_from_spec(id, spec: dict):
+    """Loss function class of the spec, with the arguments in "args" bound, or None if
+    its module cannot be imported."""
+    module = load_loss(id, spec["name"], spec.get("custom", True))
+    if module is None:
+        return None
+    loss_function = module.loss_function_selection()
+    args = spec.get("args") or dict()
+    return partial(loss_function, **args) if args else loss_function
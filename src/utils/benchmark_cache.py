@@ -0,0 +1,50 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import time
+
+
+def benchmark_cache_key(model_hash, dataset_id, batch_size, hw_fingerprint) -> str:
+    """Key of a benchmark result in the "benchmark_cache" a client persists in
+    client_info.yaml and advertises to the server."""
+    return f"{model_hash}|{dataset_id}|{batch_size}|{hw_fingerprint}"
+
+
+def parse_ttl(ttl_s):
+    """Parses "cache_ttl_s" from benchmark_config, None means results never expire."""
+    if ttl_s is None or (isinstance(ttl_s, str) and ttl_s.lower() == "none"):
+        return None
+    return float(ttl_s)
+
+
+def is_fresh(entry: dict, ttl_s=None, now: float = None) -> bool:
+    if not entry:
+        return False
+    if ttl_s is None:
+        return True
+    timestamp = entry.get("timestamp")
+    if timestamp is None:
+        return False
+    now = time.time() if now is None else now
+    return now - timestamp <= ttl_s
+
+
+def matches_benchmark(
+    entry: dict, model_hash, dataset_id=None, batch_size=None, hw_fingerprint=None
+) -> bool:
+    """True if "entry" was measured with this model, dataset, batch size and hardware.
+    Entries written before these fields were recorded only carry the model hash."""
+    if not entry or entry.get("model_hash") != model_hash:
+        return False
+    for field, value in (
+        ("dataset_id", dataset_id),
+        ("batch_size", batch_size),
+        ("hw_fingerprint", hw_fingerprint),
+    ):
+        if value is not None and entry.get(field, value) != value:
+            return False
+    return True
@@ -0,0 +1,86 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+DEFAULT_DATALOADER_ARGS = {
+    "num_workers": 0,
+    "persistent_workers": False,
+    "prefetch_factor": 2,
+    "pin_memory": False,
+    "sharing_strategy": None,
+}
+
+
+def _none_if_unset(value):
+    # YAML configs in this repo spell empty values as the string "None"
+    if value is None or (isinstance(value, str) and value.lower() == "none"):
+        return None
+    return value
+
+
+def parse_dataloader_args(loader_args: dict = None) -> dict:
+    """Merges the "dataloader_args" block of a model config with the defaults.
+
+    Args:
+        loader_args (dict, optional): "dataloader_args" from default_training_config / model_config
+
+    Returns:
+        dict: num_workers, persistent_workers, prefetch_factor, pin_memory and sharing_strategy
+    """
+    args = dict(DEFAULT_DATALOADER_ARGS)
+    if isinstance(loader_args, dict):
+        for key in DEFAULT_DATALOADER_ARGS:
+            if key in loader_args:
+                args[key] = _none_if_unset(loader_args[key])
+
+    args["num_workers"] = int(args["num_workers"] or 0)
+    args["persistent_workers"] = bool(args["persistent_workers"])
+    args["pin_memory"] = bool(args["pin_memory"])
+    if args["prefetch_factor"] is not None:
+        args["prefetch_factor"] = int(args["prefetch_factor"])
+    return args
+
+
+def get_dataloader_kwargs(loader_args: dict = None) -> dict:
+    """Returns the keyword arguments to pass to torch.utils.data.DataLoader.
+
+    persistent_workers and prefetch_factor are only valid with worker processes,
+    so they are dropped when num_workers is 0. The shared-memory strategy is
+    process-wide and is applied here, before any worker is forked.
+    """
+    args = parse_dataloader_args(loader_args)
+
+    if args["sharing_strategy"]:
+        import torch.multiprocessing
+
+        if (
+            args["sharing_strategy"]
+            in torch.multiprocessing.get_all_sharing_strategies()
+        ):
+            torch.multiprocessing.set_sharing_strategy(args["sharing_strategy"])
+        else:
+            print(
+                f"dataloader_args.get_dataloader_kwargs:: Unknown sharing_strategy {args['sharing_strategy']}, ignoring."
+            )
+
+    kwargs = {"num_workers": args["num_workers"], "pin_memory": args["pin_memory"]}
+    if args["num_workers"] > 0:
+        kwargs["persistent_workers"] = args["persistent_workers"]
+        if args["prefetch_factor"] is not None:
+            kwargs["prefetch_factor"] = args["prefetch_factor"]
+    return kwargs
+
+
+def dataloader_args_key(loader_args: dict = None) -> str:
+    """Short, stable name for a loader setting, used to key benchmark throughput."""
+    args = parse_dataloader_args(loader_args)
+    return (
+        f"w{args['num_workers']}"
+        f"-pf{args['prefetch_factor'] if args['num_workers'] > 0 else 0}"
+        f"-pw{int(args['persistent_workers'] and args['num_workers'] > 0)}"
+        f"-pin{int(args['pin_memory'])}"
+        f"-{args['sharing_strategy'] or 'default'}"
+    )
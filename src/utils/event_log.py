@@ -0,0 +1,189 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import os
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from utils.logger import LOG_DIR, BatchedFileHandler, get_log_path
+
+EVENT_LOG_SUFFIX = ".events"
+
+# every batch is written as <header length><body length><header><body>, the header
+# lists the events in the batch so that readers can skip the body without decoding it
+FRAME_PREFIX = struct.Struct("<II")
+
+COLUMNS = ("timestamp", "component", "level", "thread_id", "message", "values")
+
+
+def get_event_log_path(log_path: str) -> str:
+    """flotilla_<id>.events next to flotilla_<id>.log"""
+    return os.path.splitext(log_path)[0] + EVENT_LOG_SUFFIX
+
+
+def typed_value(value):
+    if isinstance(value, (int, float)):
+        return value
+    value = str(value).strip()
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def typed_values(msg) -> list:
+    """Fields of a FedLogger message, numbers are stored as int or float."""
+    if isinstance(msg, (int, float)):
+        return [msg]
+    return [typed_value(v) for v in str(msg).split(",")]
+
+
+class EventLogHandler(BatchedFileHandler):
+    """Structured sink for FedLogger records, one flotilla_<id>.events file per id.
+
+    Records are kept as typed rows and every flush writes them as one msgpack batch
+    per file, stored by column. See read_event_log for the reader."""
+
+    def __init__(self, log_dir=LOG_DIR, mode="a"):
+        super().__init__(
+            get_event_log_path(get_log_path("0", log_dir)), mode, encoding=None
+        )
+        self.log_dir = log_dir
+        if msgpack is None:
+            print("EventLogHandler:: msgpack is not installed, events are not logged")
+
+    def get_filename(self, record) -> str:
+        fed_id = getattr(record, "fed_id", None)
+        if fed_id is None:
+            return self.baseFilename
+        return os.path.abspath(
+            get_event_log_path(get_log_path(str(fed_id), self.log_dir))
+        )
+
+    def make_entry(self, record):
+        fed_id = getattr(record, "fed_id", None)
+        if fed_id is None:
+            # not a FedLogger record, keep the whole message as the event name
+            return (
+                record.created,
+                record.name,
+                record.levelname,
+                "",
+                record.getMessage(),
+                [],
+            )
+        return (
+            record.created,
+            record.name,
+            record.levelname,
+            str(fed_id),
+            str(record.fed_event),
+            typed_values(record.fed_msg),
+        )
+
+    def encode(self, entries: list) -> bytes:
+        columns = list(zip(*entries))
+        header = msgpack.packb(
+            {
+                "count": len(entries),
+                "events": sorted(set(columns[4])),
+                "start": min(columns[0]),
+                "end": max(columns[0]),
+            }
+        )
+        body = msgpack.packb(dict(zip(COLUMNS, [list(c) for c in columns])))
+        return FRAME_PREFIX.pack(len(header), len(body)) + header + body
+
+    def emit(self, record):
+        if msgpack is not None:
+            super().emit(record)
+
+
+def read_event_log_from(
+    path: str, offset: int = 0, events=None, start=None, end=None
+) -> tuple:
+    """Reads the batches written after byte "offset" of an event log, see
+    read_event_log for the arguments.
+
+    Returns:
+        (dict, int): columns, and the offset after the last complete batch that was
+        read, to continue from once more batches are written
+    """
+    if msgpack is None:
+        raise ImportError("msgpack is required to read event logs")
+    events = set(events) if events is not None else None
+    columns = {name: list() for name in COLUMNS}
+    if not os.path.isfile(path):
+        return columns, offset
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            prefix = f.read(FRAME_PREFIX.size)
+            if len(prefix) < FRAME_PREFIX.size:
+                break
+            header_len, body_len = FRAME_PREFIX.unpack(prefix)
+            header_bytes = f.read(header_len)
+            if len(header_bytes) < header_len:
+                break
+            header = msgpack.unpackb(header_bytes)
+            if (
+                (events is not None and events.isdisjoint(header["events"]))
+                or (start is not None and header["end"] < start)
+                or (end is not None and header["start"] > end)
+            ):
+                if f.seek(body_len, os.SEEK_CUR) > os.fstat(f.fileno()).st_size:
+                    break
+                offset = f.tell()
+                continue
+            body_bytes = f.read(body_len)
+            if len(body_bytes) < body_len:
+                # batch that is still being written
+                break
+            offset = f.tell()
+            body = msgpack.unpackb(body_bytes)
+
+            if events is None and start is None and end is None:
+                for name in COLUMNS:
+                    columns[name].extend(body[name])
+                continue
+            rows = [
+                i
+                for i, (t, e) in enumerate(zip(body["timestamp"], body["message"]))
+                if (events is None or e in events)
+                and (start is None or t >= start)
+                and (end is None or t <= end)
+            ]
+            for name in COLUMNS:
+                column = body[name]
+                columns[name].extend(column[i] for i in rows)
+    return columns, offset
+
+
+def read_event_log(path: str, events=None, start=None, end=None) -> dict:
+    """Reads an event log into columns.
+
+    Args:
+        path (str): flotilla_<id>.events file
+        events (iterable, optional): only return these events. Batches without any
+            of them are skipped without being decoded.
+        start (float, optional): only return records logged at or after this time
+        end (float, optional): only return records logged at or before this time
+
+    Returns:
+        dict: column name -> list, see COLUMNS. "timestamp" is in seconds since the epoch.
+    """
+    columns, _ = read_event_log_from(path, 0, events, start, end)
+    return columns
@@ -1,28 +1,121 @@
-import pickle
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import hashlib
+import json
+import os
 import sys
-from collections import Counter
 
-import torch
+import numpy as np
+
+# <partition>_summary.json: label histogram of a partition file and the hash of the
+# file it was computed from, regenerated when the file changes
+SUMMARY_VERSION = 1
+SUMMARY_SUFFIX = "_summary.json"
+
+
+def get_summary_path(dataset_path: str) -> str:
+    return os.path.splitext(dataset_path)[0] + SUMMARY_SUFFIX
+
+
+def file_hash(path: str, blocksize: int = 1 << 20) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def read_labels(dataset_path: str) -> np.ndarray:
+    """Labels of a partition, from the index and the targets of its base dataset, or
+    from the targets of a pickled DataLoader's dataset, without loading any sample."""
+    # torch is only imported when a summary is computed, not when it is read
+    from utils.partition_format import (
+        BASE_TARGETS,
+        get_labels,
+        is_partition_index,
+        load_partition,
+        read_partition_index,
+    )
+
+    if is_partition_index(dataset_path):
+        indices, meta = read_partition_index(dataset_path)
+        targets = np.load(os.path.join(meta["base_dir"], BASE_TARGETS))
+        return targets[indices]
+    return get_labels(load_partition(dataset_path))
 
-dataset_path = sys.argv[1]
 
-try:
-    dataset = torch.load(dataset_path).dataset
-    num_items = len(dataset)
-    class_distrb = dict(Counter(dataset[i][1] for i in range(len(dataset))))
-    for i, v in class_distrb.items():
-        class_distrb[i] = v / num_items
-    data_summary = {
-        "label_distribution": class_distrb,
+def compute_summary(dataset_path: str, source_hash: str) -> dict:
+    labels = read_labels(dataset_path)
+    return {
+        "version": SUMMARY_VERSION,
+        "source_hash": source_hash,
+        "num_items": len(labels),
+        "label_counts": {
+            str(label): count
+            for label, count in enumerate(np.bincount(labels).tolist())
+            if count > 0
+        },
+    }
+
+
+def to_data_summary(summary: dict, dataset_path: str) -> dict:
+    """Summary in the layout of the dataset config metadata."""
+    num_items = summary["num_items"]
+    return {
+        "label_distribution": {
+            int(label): count / num_items
+            for label, count in summary["label_counts"].items()
+        },
         "num_items": num_items,
         "data_filename": dataset_path,
     }
 
-    print(data_summary)
-    summary_filename = dataset_path.split(".")[0] + "_summary.data"
 
-    print(summary_filename)
-    with open(summary_filename, "wb") as f:
-        pickle.dump(obj=data_summary, file=f)
-except Exception as e:
-    print("get_data_summary:: Exception - ", e)
+def get_data_summary(dataset_path: str, regenerate: bool = False) -> dict:
+    """
+    Reads the summary of a partition file, and computes and writes it if it is missing,
+    of an older version or was computed from a different file. The file is only hashed
+    when its size or modification time differ from those stored in the summary.
+
+    Returns:
+        dict: label_distribution, num_items and data_filename
+    """
+    summary_path = get_summary_path(dataset_path)
+    summary = None
+    if not regenerate and os.path.isfile(summary_path):
+        try:
+            with open(summary_path) as f:
+                summary = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"get_data_summary:: unreadable summary {summary_path}: {e}")
+    if summary is not None and summary.get("version") != SUMMARY_VERSION:
+        summary = None
+
+    stat = os.stat(dataset_path)
+    source_stat = [stat.st_size, stat.st_mtime]
+    if summary is not None and summary.get("source_stat") == source_stat:
+        return to_data_summary(summary, dataset_path)
+
+    source_hash = file_hash(dataset_path)
+    if summary is None or summary.get("source_hash") != source_hash:
+        summary = compute_summary(dataset_path, source_hash)
+    # e.g. a copied file, same content with a new modification time
+    summary["source_stat"] = source_stat
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, separators=(",", ":"))
+    return to_data_summary(summary, dataset_path)
+
+
+if __name__ == "__main__":
+    dataset_path = sys.argv[1]
+    try:
+        data_summary = get_data_summary(dataset_path, regenerate=True)
+        print(data_summary)
+        print(get_summary_path(dataset_path))
+    except Exception as e:
+        print("get_data_summary:: Exception - ", e)
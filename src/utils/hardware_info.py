@@ -1,7 +1,32 @@
+import hashlib
+import json
+import os
 import subprocess
+from functools import lru_cache
+
+# device files of the NVIDIA (desktop, Jetson and WSL2) and ROCm drivers, torch is
+# only imported to check CUDA on hosts that have one of them
+GPU_DRIVER_PATHS = (
+    "/dev/nvidia0",
+    "/proc/driver/nvidia/version",
+    "/etc/nv_tegra_release",
+    "/dev/kfd",
+    # WSL2 exposes the GPU of the Windows host as /dev/dxg, with the CUDA libraries
+    "/dev/dxg",
+    "/usr/lib/wsl/lib/libcuda.so.1",
+)
+
+
+def has_gpu_driver() -> bool:
+    return os.name == "nt" or any(os.path.exists(p) for p in GPU_DRIVER_PATHS)
 
 
 def get_hardware_info():
+    return dict(read_hardware_info())
+
+
+@lru_cache(maxsize=1)
+def read_hardware_info():
     hardware_info = dict()
     try:
         output = subprocess.check_output(
@@ -22,17 +47,41 @@ def get_hardware_info():
                 hardware_info["cpu_core_count"] = line[1].strip()
             elif "Model name" in line[0]:
                 hardware_info["model_name"] = line[1].strip()
+            elif "Flags" == line[0]:
+                # x86 advertises avx512_bf16/amx_bf16, aarch64 advertises bf16
+                flags = line[1].split()
+                hardware_info["cpu_bf16_supported"] = any(
+                    flag in flags for flag in ("avx512_bf16", "amx_bf16", "bf16")
+                )
     else:
         hardware_info = {"arch": None, "cpu_core_count": None, "model_name": None}
+    hardware_info.setdefault("cpu_bf16_supported", False)
+
+    if not has_gpu_driver():
+        hardware_info["cuda_available"] = False
+        hardware_info["cuda_bf16_supported"] = False
+        return hardware_info
 
     try:
-        from torch.cuda import is_available
+        from torch.cuda import is_available, is_bf16_supported
 
         hardware_info["cuda_available"] = True if is_available() else False
+        hardware_info["cuda_bf16_supported"] = (
+            hardware_info["cuda_available"] and is_bf16_supported()
+        )
     except ModuleNotFoundError:
         hardware_info["cuda_available"] = False
+        hardware_info["cuda_bf16_supported"] = False
     return hardware_info
 
 
+def get_hardware_fingerprint(hardware_info: dict) -> str:
+    """Short, stable hash of the hardware_info, benchmark results are only reused on
+    the same hardware."""
+    return hashlib.sha256(
+        json.dumps(hardware_info, sort_keys=True).encode()
+    ).hexdigest()[:16]
+
+
 if __name__ == "__main__":
     print(get_hardware_info())
@@ -1,5 +1,15 @@
+import os
+
 import pandas as pd
 
+from utils.event_log import (
+    COLUMNS,
+    EVENT_LOG_SUFFIX,
+    get_event_log_path,
+    read_event_log,
+    read_event_log_from,
+)
+
 
 def parse_log_line(log_line):
     """Parses a log line and returns a dictionary of the different fields."""
@@ -19,8 +29,22 @@ def parse_log_line(log_line):
     return log_dict
 
 
-def parse_log_file(file_name):
-    """Parses an entire log file and returns a pandas dataframe with the different columns."""
+def parse_event_log_file(file_name, events=None, start=None, end=None):
+    """Loads a structured event log (flotilla_<id>.events) into a dataframe with the
+    columns of parse_log_file. Only the batches that contain one of "events" are
+    decoded, "values" holds typed fields and "timestamp" is a datetime."""
+    columns = read_event_log(file_name, events=events, start=start, end=end)
+    df = pd.DataFrame(columns)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
+    return df
+
+
+def parse_log_file(file_name, events=None):
+    """Parses an entire log file and returns a pandas dataframe with the different columns.
+    Event logs are read with parse_event_log_file, "events" keeps only those events."""
+    if file_name.endswith(EVENT_LOG_SUFFIX):
+        return parse_event_log_file(file_name, events=events)
+
     f = open(file_name, "r")
     lines = f.readlines()
     print(len(lines))
@@ -29,8 +53,62 @@ def parse_log_file(file_name):
     for line in lines:
         log_dict = {}
         log_dict = parse_log_line(line)
+        if events is not None and log_dict.get("message") not in events:
+            continue
         log_dicts.append(log_dict)
 
-    df = pd.DataFrame(log_dicts)
+    df = pd.DataFrame(log_dicts, columns=list(COLUMNS))
 
     return df
+
+
+def get_session_log_file(log_file_name):
+    """The event log of a session if it is being written, its text log otherwise."""
+    event_log_file_name = get_event_log_path(log_file_name)
+    if os.path.isfile(event_log_file_name):
+        return event_log_file_name
+    return log_file_name
+
+
+class IncrementalLogReader:
+    """Follows a text or event log like "tail -f". Every read() parses only what was
+    appended since the previous one, lines or batches that are still being written
+    are left for the next read."""
+
+    def __init__(self, file_name, events=None):
+        self.file_name = file_name
+        self.events = set(events) if events is not None else None
+        self.offset = 0
+
+    def read(self) -> list:
+        """New records as dictionaries with the keys of parse_log_line."""
+        if not os.path.isfile(self.file_name):
+            return []
+        if os.path.getsize(self.file_name) < self.offset:
+            # log was truncated or replaced, start over
+            self.offset = 0
+        if self.file_name.endswith(EVENT_LOG_SUFFIX):
+            return self._read_event_log()
+        return self._read_text_log()
+
+    def _read_text_log(self) -> list:
+        with open(self.file_name, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        complete = data[: data.rfind(b"\n") + 1]
+        self.offset += len(complete)
+
+        log_dicts = []
+        for line in complete.decode("utf-8", errors="replace").splitlines():
+            if self.events is not None:
+                fields = line.split(",", 5)
+                if len(fields) < 5 or fields[4].strip() not in self.events:
+                    continue
+            log_dicts.append(parse_log_line(line))
+        return log_dicts
+
+    def _read_event_log(self) -> list:
+        columns, self.offset = read_event_log_from(
+            self.file_name, self.offset, events=self.events
+        )
+        return [dict(zip(COLUMNS, row)) for row in zip(*columns.values())]
@@ -5,9 +5,196 @@ Copyright 2023 Indian Institute of Science
 Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
 """
 
+import atexit
 import logging
 import logging.config
 import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_DIR = "logs"
+SERVER_LOG_NAME = "flotilla_server.log"
+LOGGER_CONF = os.path.join("config", "logger.conf")
+
+# records are written in batches, at the latest every FLUSH_EVERY records
+FLUSH_EVERY = 256
+
+
+def get_log_path(id: str, log_dir: str = LOG_DIR) -> str:
+    if id == "0":
+        return os.path.join(log_dir, SERVER_LOG_NAME)
+    return os.path.join(log_dir, f"flotilla_{id}.log")
+
+
+class BatchedFileHandler(logging.Handler):
+    """FileHandler that keeps formatted records in memory until flush(), which the
+    queue listener calls once the queue is drained. Writes go straight to the file
+    descriptor, so a forked process never writes the batch of its parent again."""
+
+    terminator = "\n"
+
+    def __init__(self, filename, mode="a", encoding="utf-8"):
+        super().__init__()
+        self.baseFilename = os.path.abspath(filename)
+        self.mode = mode
+        self.encoding = encoding
+        self._pid = os.getpid()
+        self._files = dict()
+        self._pending = dict()
+
+    def get_filename(self, record) -> str:
+        return self.baseFilename
+
+    def make_entry(self, record):
+        return self.format(record) + self.terminator
+
+    def encode(self, entries: list) -> bytes:
+        return "".join(entries).encode(self.encoding)
+
+    def emit(self, record):
+        try:
+            entry = self.make_entry(record)
+            self._pending.setdefault(self.get_filename(record), []).append(entry)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self._pid != os.getpid():
+                # inherited from the parent process, its records are not ours to write
+                self._pending, self._files, self._pid = dict(), dict(), os.getpid()
+                return
+            for filename, entries in self._pending.items():
+                if not entries:
+                    continue
+                fd = self._files.get(filename)
+                if fd is None:
+                    os.makedirs(os.path.dirname(filename), exist_ok=True)
+                    flags = os.O_WRONLY | os.O_CREAT
+                    flags |= os.O_APPEND if "a" in self.mode else os.O_TRUNC
+                    fd = self._files[filename] = os.open(filename, flags, 0o644)
+                os.write(fd, self.encode(entries))
+                entries.clear()
+        except Exception as e:
+            print(f"BatchedFileHandler.flush:: {e}")
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        self.acquire()
+        try:
+            for fd in self._files.values():
+                os.close(fd)
+            self._files = dict()
+        finally:
+            self.release()
+        super().close()
+
+
+class SessionFileHandler(BatchedFileHandler):
+    """Writes every record to the log file of the FedLogger id that emitted it,
+    flotilla_server.log for "0" and flotilla_<id>.log otherwise, so that a new
+    session does not need a new logging configuration."""
+
+    def __init__(self, log_dir=LOG_DIR, mode="a", encoding="utf-8"):
+        super().__init__(get_log_path("0", log_dir), mode, encoding)
+        self.log_dir = log_dir
+
+    def get_filename(self, record) -> str:
+        fed_id = getattr(record, "fed_id", None)
+        if fed_id is None:
+            return self.baseFilename
+        return os.path.abspath(get_log_path(str(fed_id), self.log_dir))
+
+
+class _RoutedQueueHandler(QueueHandler):
+    """QueueHandler of one logger, tags records with the logger that queued them."""
+
+    def __init__(self, log_queue, route: str):
+        super().__init__(log_queue)
+        self.route = route
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        record.fed_route = self.route
+        return record
+
+
+class _Dispatcher(logging.Handler):
+    """Handler of the QueueListener, passes records to the handlers logger.conf
+    configured for their logger and flushes them once the queue is drained."""
+
+    def __init__(self, log_queue, routes: dict):
+        super().__init__()
+        self.log_queue = log_queue
+        self.routes = routes
+        self._unflushed = 0
+
+    def handle(self, record):
+        for handler in self.routes.get(record.fed_route, []):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        self._unflushed += 1
+        if self._unflushed >= FLUSH_EVERY or self.log_queue.empty():
+            self.flush()
+
+    def flush(self):
+        for handler in set(h for hs in self.routes.values() for h in hs):
+            handler.flush()
+        self._unflushed = 0
+
+
+_backend_lock = threading.Lock()
+_backend_pid = None
+_listener = None
+
+
+def configure_logging(config_path: str = LOGGER_CONF, log_dir: str = LOG_DIR):
+    """Loads logger.conf once per process and moves its handlers to a QueueListener
+    thread, so that logging calls only enqueue the record."""
+    global _backend_pid, _listener
+    with _backend_lock:
+        if _backend_pid == os.getpid():
+            return
+        os.makedirs(log_dir, exist_ok=True)
+        logging.config.fileConfig(
+            fname=config_path,
+            defaults={"logfilename": get_log_path("0", log_dir)},
+        )
+
+        log_queue = queue.SimpleQueue()
+        routes = dict()
+        loggers = [logging.getLogger()] + [
+            l
+            for l in logging.Logger.manager.loggerDict.values()
+            if isinstance(l, logging.Logger) and l.handlers
+        ]
+        for l in loggers:
+            routes[l.name] = list(l.handlers)
+            for handler in routes[l.name]:
+                l.removeHandler(handler)
+            l.addHandler(_RoutedQueueHandler(log_queue, l.name))
+
+        _listener = QueueListener(log_queue, _Dispatcher(log_queue, routes))
+        _listener.start()
+        _backend_pid = os.getpid()
+
+
+def shutdown_logging():
+    """Stops the listener thread after it has written all queued records."""
+    global _backend_pid, _listener
+    with _backend_lock:
+        if _listener is not None and _backend_pid == os.getpid():
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.flush()
+        _listener, _backend_pid = None, None
+
+
+atexit.register(shutdown_logging)
 
 
 class FedLogger(object):
@@ -16,44 +203,35 @@ class FedLogger(object):
 
         self.id: str = id
         self.loggername = loggername
-        self.log_dir: str = "logs"
-        if id == "0":
-            log_name: str = "flotilla_server.log"
-        else:
-            log_name: str = f"flotilla_{self.id}.log"
-
-        os.makedirs(os.path.join(self.log_dir), exist_ok=True)
-        filepath = os.path.join(self.log_dir, log_name)
-        logging.config.fileConfig(
-            fname=os.path.join("config", "logger.conf"),
-            defaults={"logfilename": filepath},
-        )
+        self.log_dir: str = LOG_DIR
+        configure_logging(log_dir=self.log_dir)
         self._logger = logging.getLogger(self.loggername)
 
     def update_id(self, id: str):
         self.id = id
-        if id == "0":
-            log_name: str = "flotilla_server.log"
-        else:
-            log_name: str = f"flotilla_{self.id}.log"
-        filepath = os.path.join(self.log_dir, log_name)
-        logging.config.fileConfig(
-            fname=os.path.join("config", "logger.conf"),
-            defaults={"logfilename": filepath},
+
+    def _log(self, level: int, event: str, msg: str) -> None:
+        if _backend_pid != os.getpid():
+            # e.g. a multiprocessing child forked after the parent configured logging
+            configure_logging(log_dir=self.log_dir)
+        # the fields are also passed as is for the structured event log
+        self._logger.log(
+            level,
+            f"{self.id},{event},{msg}",
+            extra={"fed_id": self.id, "fed_event": event, "fed_msg": msg},
         )
-        self._logger = logging.getLogger(self.loggername)
 
     def debug(self, event: str, msg: str) -> None:
-        self._logger.debug(f"{self.id},{event},{msg}")
+        self._log(logging.DEBUG, event, msg)
 
     def info(self, event: str, msg: str) -> None:
-        self._logger.info(f"{self.id},{event},{msg}")
+        self._log(logging.INFO, event, msg)
 
     def warn(self, event: str, msg: str) -> None:
-        self._logger.warning(f"{self.id},{event},{msg}")
+        self._log(logging.WARNING, event, msg)
 
     def error(self, event: str, msg: str) -> None:
-        self._logger.error(f"{self.id},{event},{msg}")
+        self._log(logging.ERROR, event, msg)
 
     def critical(self, event: str, msg: str) -> None:
-        self._logger.critical(f"{self.id},{event},{msg}")
+        self._log(logging.CRITICAL, event, msg)
@@ -0,0 +1,264 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import bisect
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds, from a mini-batch to a slow round
+TIME_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# bytes, from a control message to a large model
+SIZE_BUCKETS = tuple(4**i * 1024 for i in range(12))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(
+            n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for n, v in zip(label_names, label_values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, label_names=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = dict()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def expose(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.append(
+                f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            )
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. messages or bytes sent."""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. the round number or the RSS."""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count of the observed values."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, label_names=(), buckets=TIME_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # per bucket counts, the last one is +Inf, then sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def expose(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts[:-1]):
+                cumulative += count
+                le = 'le="{}"'.format(_format_value(bound))
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """In-process registry of the metrics of one server or client. Getters return the
+    existing metric when called again with the same name, so that modules can declare
+    the metrics they update without coordinating."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics = dict()
+        self._collectors = list()
+
+    def _get(self, cls, name: str, documentation: str, label_names, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(
+                    name, documentation, label_names, **kwargs
+                )
+            elif not isinstance(metric, cls):
+                raise ValueError(
+                    f"metric {name} is already registered as a {metric.type_name}"
+                )
+            return metric
+
+    def counter(self, name: str, documentation: str, label_names=()) -> Counter:
+        return self._get(Counter, name, documentation, label_names)
+
+    def gauge(self, name: str, documentation: str, label_names=()) -> Gauge:
+        return self._get(Gauge, name, documentation, label_names)
+
+    def histogram(
+        self, name: str, documentation: str, label_names=(), buckets=TIME_BUCKETS
+    ) -> Histogram:
+        return self._get(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def register_collector(self, collector) -> None:
+        """Calls "collector()" before every scrape, to update metrics that are cheaper
+        to read on demand than to keep up to date, e.g. resource usage."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def expose(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics.values())
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"MetricsRegistry.expose:: collector failed: {e}")
+        lines = list()
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# metrics of the transports, updated by the server and the clients
+TRANSPORT_BYTES = REGISTRY.counter(
+    "flotilla_transport_bytes_total",
+    "Request and response bytes of the training and validation messages",
+    ("protocol", "direction"),
+)
+CLIENT_TASK_SECONDS = REGISTRY.histogram(
+    "flotilla_client_task_seconds",
+    "Time of a training or validation request on the client, unpickling included",
+    ("protocol", "task"),
+)
+CLIENT_TASK_BYTES = REGISTRY.histogram(
+    "flotilla_client_task_bytes",
+    "Request and response bytes of a training or validation request",
+    ("protocol", "task", "direction"),
+    buckets=SIZE_BUCKETS,
+)
+
+
+def observe_client_task(
+    protocol: str, task: str, task_time: float, received_b: int, sent_b: int
+) -> None:
+    CLIENT_TASK_SECONDS.observe(task_time, protocol=protocol, task=task)
+    for direction, size in (("received", received_b), ("sent", sent_b)):
+        CLIENT_TASK_BYTES.observe(
+            size, protocol=protocol, task=task, direction=direction
+        )
+
+
+def _make_handler(registry: MetricsRegistry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.expose().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # scrapes are periodic, keep them out of stderr
+            pass
+
+    return MetricsHandler
+
+
+def start_metrics_server(
+    port: int, host: str = "0.0.0.0", registry: MetricsRegistry = REGISTRY
+):
+    """Serves the registry on http://<host>:<port>/metrics from a daemon thread.
+
+    Returns:
+        ThreadingHTTPServer: the server, None if the port could not be bound
+    """
+    try:
+        server = ThreadingHTTPServer((host, int(port)), _make_handler(registry))
+    except OSError as e:
+        print(f"start_metrics_server:: could not listen on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    print(f"start_metrics_server:: metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,170 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import torch
+
+COMPILE_MODES = ("torchscript", "torch_compile")
+COMPILED_DIR_NAME = "compiled"
+
+
+def get_compile_mode(compile_mode):
+    """Returns "torchscript", "torch_compile" or None for eager execution."""
+    if compile_mode is None or str(compile_mode).lower() in ("none", "eager"):
+        return None
+    compile_mode = str(compile_mode).lower()
+    if compile_mode not in COMPILE_MODES:
+        print(
+            f"model_compiler.get_compile_mode:: Unknown compile_mode {compile_mode}, using eager"
+        )
+        return None
+    return compile_mode
+
+
+def example_input_from_loader(loader, device, channels_last=False):
+    """Zero input with the shape of one full mini-batch of "loader"."""
+    x = torch.as_tensor(loader.dataset[0][0])
+    example = torch.zeros((loader.batch_size, *x.shape), dtype=x.dtype, device=device)
+    if channels_last and example.dim() == 4:
+        example = example.contiguous(memory_format=torch.channels_last)
+    return example
+
+
+def compile_cache_key(model_hash: str, device, example_input, compile_mode: str) -> str:
+    key = ",".join(
+        [
+            str(model_hash),
+            torch.device(device).type,
+            str(tuple(example_input.shape)),
+            str(example_input.dtype),
+            compile_mode,
+            torch.__version__,
+        ]
+    )
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def _time_forward(model, example_input, iters: int) -> float:
+    with torch.no_grad():
+        model(example_input)
+        if example_input.is_cuda:
+            torch.cuda.synchronize()
+        start = time.time()
+        for _ in range(iters):
+            model(example_input)
+        if example_input.is_cuda:
+            torch.cuda.synchronize()
+    return (time.time() - start) / iters
+
+
+def compile_model(
+    model,
+    compile_mode: str,
+    cache_dir: str,
+    model_hash: str,
+    example_input,
+    speedup_iters: int = 5,
+):
+    """Compiles "model" once per (model hash, device, input shape) and reuses the
+    artifact persisted under "<cache_dir>/compiled/".
+
+    TorchScript modules are saved with torch.jit.save and loaded back with the weights
+    of "model". torch.compile has no single artifact, its Inductor cache is pointed at
+    the same directory so that later sessions skip code generation.
+
+    Args:
+        model (torch.nn.Module): eager model, already on the target device
+        compile_mode (str): "torchscript" or "torch_compile"
+        cache_dir (str): model directory, e.g. <temp_dir>/model_cache/<model_id>
+        model_hash (str): hash of the model files
+        example_input (torch.Tensor): one mini-batch, on the target device
+        speedup_iters (int, optional): forward passes used to measure the speedup
+
+    Returns:
+        (torch.nn.Module, dict): compiled model, or "model" if compilation failed, and
+        compile_mode, cached, compile_time_s and speedup
+    """
+    info = {"compile_mode": compile_mode, "cached": False}
+    start = time.time()
+    try:
+        compiled_dir = os.path.join(cache_dir, COMPILED_DIR_NAME)
+        os.makedirs(compiled_dir, exist_ok=True)
+        key = compile_cache_key(
+            model_hash, example_input.device, example_input, compile_mode
+        )
+        meta_path = os.path.join(compiled_dir, f"{key}.json")
+        meta = None
+        if os.path.isfile(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+        if compile_mode == "torchscript":
+            artifact_path = os.path.join(compiled_dir, f"{key}.pt")
+            if meta and os.path.isfile(artifact_path):
+                compiled = torch.jit.load(
+                    artifact_path, map_location=example_input.device
+                )
+                compiled.load_state_dict(model.state_dict())
+                compiled.train(model.training)
+            else:
+                compiled = torch.jit.script(model)
+                torch.jit.save(compiled, artifact_path)
+        else:
+            os.environ.setdefault(
+                "TORCHINDUCTOR_CACHE_DIR",
+                os.path.abspath(os.path.join(compiled_dir, "inductor")),
+            )
+            compiled = torch.compile(model)
+
+        if meta:
+            # torch.compile is lazy, run one forward pass so it is compiled here
+            if compile_mode == "torch_compile":
+                with torch.no_grad():
+                    compiled(example_input)
+            info["cached"] = True
+            info["compile_time_s"] = time.time() - start
+            info["speedup"] = meta["speedup"]
+        else:
+            compiled_time = _time_forward(compiled, example_input, speedup_iters)
+            info["compile_time_s"] = time.time() - start - compiled_time * speedup_iters
+            eager_time = _time_forward(model, example_input, speedup_iters)
+            info["speedup"] = eager_time / compiled_time if compiled_time else 1.0
+            with open(meta_path, "w") as f:
+                json.dump(
+                    {
+                        "compile_mode": compile_mode,
+                        "model_hash": model_hash,
+                        "device": torch.device(example_input.device).type,
+                        "input_shape": list(example_input.shape),
+                        "torch_version": torch.__version__,
+                        "compile_time_s": info["compile_time_s"],
+                        "speedup": info["speedup"],
+                    },
+                    f,
+                )
+    except Exception as e:
+        print(
+            f"model_compiler.compile_model:: {compile_mode} failed, using eager model: {e}"
+        )
+        return model, {
+            "compile_mode": "eager",
+            "cached": False,
+            "compile_time_s": time.time() - start,
+            "speedup": 1.0,
+        }
+
+    print(f"model_compiler.compile_model:: {info}")
+    return compiled, info
+
+
+def unwrap_model(model):
+    """Module that owns the parameters, so state_dict keys match the eager model."""
+    return getattr(model, "_orig_mod", model)
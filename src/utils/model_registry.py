@@ -0,0 +1,186 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import hashlib
+import importlib
+import inspect
+import os
+import re
+import sys
+import types
+from threading import Lock
+
+import yaml
+
+# model files are imported as submodules of a package per model directory and hash,
+# e.g. flotilla_models.LeNet5_1a2b3c4d5e6f.model, instead of adding the directory to
+# sys.path
+PACKAGE_PREFIX = "flotilla_models"
+# file of a class when config.yaml does not name one
+DEFAULT_CLASS_FILES = {
+    "CustomDataLoader": "loader.py",
+    "CustomModelTrainer": "trainer.py",
+}
+DEFAULT_MODEL_FILE = "model.py"
+
+_lock = Lock()
+# entries of the model directories loaded in this process, by absolute path
+_entries = dict()
+
+
+def file_as_bytes(file):
+    with file:
+        return file.read()
+
+
+def model_dir_hash(path: str) -> str:
+    """Sum of the sha256 of the files in the model directory, as sent by the server
+    and advertised by the clients."""
+    model_hash = hex(0)
+    model_files = [
+        file for file in os.scandir(os.path.abspath(path)) if not os.path.isdir(file)
+    ]
+    hashes = [
+        hashlib.sha256(file_as_bytes(open(fname, "rb"))).hexdigest()
+        for fname in model_files
+    ]
+    for hash in hashes:
+        model_hash = hex(int(model_hash, 16) + int(hash, 16))
+    return model_hash
+
+
+def dir_signature(path: str) -> tuple:
+    return tuple(
+        sorted(
+            (f.name, f.stat().st_size, f.stat().st_mtime_ns)
+            for f in os.scandir(path)
+            if f.is_file()
+        )
+    )
+
+
+class ModelEntry:
+    """Classes loaded from one version of a model directory."""
+
+    def __init__(self, model_dir: str, signature: tuple, model_hash: str) -> None:
+        self.model_dir = model_dir
+        self.signature = signature
+        self.model_hash = model_hash
+        self.classes = dict()
+        self.package = f"{PACKAGE_PREFIX}.{sanitize(os.path.basename(model_dir))}_{model_hash[2:14]}"
+        self.class_files = read_class_files(model_dir)
+
+    def load_package(self) -> None:
+        if PACKAGE_PREFIX not in sys.modules:
+            root = types.ModuleType(PACKAGE_PREFIX)
+            root.__path__ = []
+            sys.modules[PACKAGE_PREFIX] = root
+        if self.package not in sys.modules:
+            package = types.ModuleType(self.package)
+            # submodules are found in the model directory, and can import each
+            # other relatively, without executing the generated __init__.py
+            package.__path__ = [self.model_dir]
+            sys.modules[self.package] = package
+
+    def unload(self) -> None:
+        for name in [m for m in sys.modules if m.startswith(self.package)]:
+            del sys.modules[name]
+
+    def find_file(self, class_name: str):
+        """File that defines "class_name": the one named in config.yaml, or by the
+        naming convention, if it defines the class, otherwise the first file whose
+        source does."""
+        pattern = re.compile(rf"^class\s+{re.escape(class_name)}\b", re.MULTILINE)
+        named = self.class_files.get(class_name, DEFAULT_CLASS_FILES.get(class_name))
+        candidates = sorted(
+            f
+            for f in os.listdir(self.model_dir)
+            if f.endswith(".py") and f != "__init__.py"
+        )
+        if named in candidates:
+            candidates.remove(named)
+            candidates.insert(0, named)
+        for file in candidates:
+            with open(os.path.join(self.model_dir, file)) as f:
+                if pattern.search(f.read()):
+                    return file
+        return None
+
+    def get_class(self, class_name: str):
+        if class_name in self.classes:
+            return self.classes[class_name]
+        file = self.find_file(class_name)
+        loaded_class = None
+        if file is not None:
+            self.load_package()
+            module = importlib.import_module(f"{self.package}.{file[:-3]}")
+            loaded_class = getattr(module, class_name, None)
+            if not inspect.isclass(loaded_class):
+                loaded_class = None
+        if loaded_class is not None:
+            self.classes[class_name] = loaded_class
+        return loaded_class
+
+
+def sanitize(name: str) -> str:
+    return re.sub(r"\W", "_", name)
+
+
+def read_class_files(model_dir: str) -> dict:
+    """Files of the model, dataloader and trainer classes named in config.yaml, by
+    class name."""
+    class_files = dict()
+    config_path = os.path.join(model_dir, "config.yaml")
+    if not os.path.isfile(config_path):
+        return class_files
+    try:
+        with open(config_path) as f:
+            model_details = (yaml.safe_load(f) or dict()).get("model_details") or dict()
+    except yaml.YAMLError as e:
+        print(f"model_registry.read_class_files:: {config_path}: {e}")
+        return class_files
+    if model_details.get("model_class"):
+        class_files[model_details["model_class"]] = model_details.get(
+            "model_file", DEFAULT_MODEL_FILE
+        )
+    for class_name, key in (
+        ("CustomDataLoader", "loader_file"),
+        ("CustomModelTrainer", "trainer_file"),
+    ):
+        if model_details.get(key):
+            class_files[class_name] = model_details[key]
+    return class_files
+
+
+def get_entry(model_dir: str) -> ModelEntry:
+    """Entry of the model directory, replaced when the hash of its files changes. The
+    files are only hashed again when their names, sizes or modification times do."""
+    model_dir = os.path.abspath(model_dir)
+    signature = dir_signature(model_dir)
+    entry = _entries.get(model_dir)
+    if entry is not None and entry.signature == signature:
+        return entry
+    model_hash = model_dir_hash(model_dir)
+    if entry is not None and entry.model_hash == model_hash:
+        entry.signature = signature
+        return entry
+    if entry is not None:
+        entry.unload()
+    entry = _entries[model_dir] = ModelEntry(model_dir, signature, model_hash)
+    return entry
+
+
+def load_class(model_dir: str, class_name: str):
+    """
+    Class "class_name" of the model in "model_dir", imported once per version of the
+    model files.
+
+    Returns:
+        class: None if no file of the model defines it
+    """
+    with _lock:
+        return get_entry(model_dir).get_class(class_name)
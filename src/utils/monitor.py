@@ -1,143 +1,262 @@
 import datetime
+import os
 import subprocess
-from multiprocessing import Process
-from time import time
+from multiprocessing import Process, Queue
+from threading import Thread
+from time import process_time, sleep, time
 
 import psutil
 
 from utils.logger import FedLogger
+from utils.metrics import REGISTRY
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+# fields of the MONITOR record, logged as MONITOR_FIELDS when the monitor starts and at
+# the start of every log it switches to
+MONITOR_FIELDS = (
+    "cpu_perc",
+    "rss_b",
+    "vms_b",
+    "data_b",
+    "threads",
+    "ram_used_kb",
+    "swap_used_kb",
+    "net_sent_b",
+    "net_recv_b",
+    "disk_write_b",
+    "disk_read_b",
+    "gpu_perc",
+    "monitor_cpu_s",
+    "monitor_time_s",
+)
+
+
+def read_proc(path: str) -> str:
+    with open(path, "rb") as f:
+        return f.read().decode()
+
+
+class ProcSampler:
+    """Reads the counters of one process and of the host from /proc, one read per file
+    and tick: /proc/<pid>/stat, /proc/<pid>/statm, /proc/<pid>/io, /proc/meminfo and
+    /proc/net/dev."""
+
+    def __init__(self, pid: int) -> None:
+        self.pid = pid
+        self.last = None
+
+    def sample(self) -> dict:
+        now = time()
+        stat = read_proc(f"/proc/{self.pid}/stat")
+        # the command name can contain spaces, fields start after its closing bracket
+        fields = stat[stat.rindex(")") + 2 :].split()
+        # utime and stime, fields 14 and 15 of proc(5)
+        cpu_s = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        threads = int(fields[17])
+
+        statm = read_proc(f"/proc/{self.pid}/statm").split()
+        vms_b = int(statm[0]) * PAGE_SIZE
+        rss_b = int(statm[1]) * PAGE_SIZE
+        data_b = int(statm[5]) * PAGE_SIZE
+
+        meminfo = dict()
+        for line in read_proc("/proc/meminfo").splitlines():
+            key, value = line.split(":", 1)
+            meminfo[key] = int(value.split()[0])
+        ram_used_kb = meminfo["MemTotal"] - meminfo.get(
+            "MemAvailable", meminfo["MemFree"]
+        )
+        swap_used_kb = meminfo.get("SwapTotal", 0) - meminfo.get("SwapFree", 0)
+
+        net_recv_b, net_sent_b = 0, 0
+        for line in read_proc("/proc/net/dev").splitlines()[2:]:
+            counters = line.split(":", 1)[1].split()
+            net_recv_b += int(counters[0])
+            net_sent_b += int(counters[8])
+
+        try:
+            io = dict()
+            for line in read_proc(f"/proc/{self.pid}/io").splitlines():
+                key, value = line.split(":", 1)
+                io[key] = int(value)
+            disk_read_b, disk_write_b = io["read_bytes"], io["write_bytes"]
+        except (OSError, KeyError):
+            # /proc/<pid>/io needs the same user or CAP_SYS_PTRACE
+            disk_read_b, disk_write_b = 0, 0
+
+        counters = {
+            "time": now,
+            "cpu_s": cpu_s,
+            "net_sent_b": net_sent_b,
+            "net_recv_b": net_recv_b,
+            "disk_write_b": disk_write_b,
+            "disk_read_b": disk_read_b,
+        }
+        last, self.last = self.last, counters
+        if last is None:
+            last = counters
+        elapsed = counters["time"] - last["time"]
+        return {
+            "cpu_perc": (
+                round(100 * (cpu_s - last["cpu_s"]) / elapsed, 2) if elapsed else 0.0
+            ),
+            "rss_b": rss_b,
+            "vms_b": vms_b,
+            "data_b": data_b,
+            "threads": threads,
+            "ram_used_kb": ram_used_kb,
+            "swap_used_kb": swap_used_kb,
+            "net_sent_b": net_sent_b - last["net_sent_b"],
+            "net_recv_b": net_recv_b - last["net_recv_b"],
+            "disk_write_b": disk_write_b - last["disk_write_b"],
+            "disk_read_b": disk_read_b - last["disk_read_b"],
+        }
+
+
+def register_resource_metrics(pid: int, registry=REGISTRY) -> None:
+    """Exposes the ProcSampler readings of "pid" on the metrics endpoint. The Monitor
+    samples in its own process, so the scrape reads /proc again in this one."""
+    gauges = {
+        f: registry.gauge(f"flotilla_process_{f}", f"{f} of the monitored process")
+        for f in ("cpu_perc", "rss_b", "vms_b", "data_b", "threads")
+    }
+    gauges.update(
+        {
+            f: registry.gauge(f"flotilla_host_{f}", f"{f} of the host")
+            for f in ("ram_used_kb", "swap_used_kb")
+        }
+    )
+    counters = {
+        f: registry.counter(f"flotilla_{f}_total", f"{f} since the monitor started")
+        for f in ("net_sent_b", "net_recv_b", "disk_write_b", "disk_read_b")
+    }
+    sampler = ProcSampler(pid)
+
+    def collect():
+        try:
+            sample = sampler.sample()
+        except FileNotFoundError:
+            return
+        for field, gauge in gauges.items():
+            gauge.set(sample[field])
+        for field, counter in counters.items():
+            counter.inc(sample[field])
+
+    registry.register_collector(collect)
+
+
+class GPUSampler:
+    """Keeps one "nvidia-smi -lms" process running and remembers its last reading,
+    instead of starting nvidia-smi on every tick."""
+
+    def __init__(self, interval_s: float) -> None:
+        self.gpu_usage = None
+        self.num_gpus = self.get_num_gpus()
+        if self.num_gpus == 0:
+            return
+        self.smi_process = subprocess.Popen(
+            [
+                "nvidia-smi",
+                "--query-gpu=utilization.gpu",
+                "--format=csv,noheader,nounits",
+                f"-lms={max(100, int(interval_s * 1000))}",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        Thread(target=self.read_usage, daemon=True).start()
+
+    @staticmethod
+    def get_num_gpus() -> int:
+        try:
+            output = subprocess.check_output(["nvidia-smi", "-L"])
+            return len(output.decode("utf-8").strip().splitlines())
+        except (FileNotFoundError, subprocess.CalledProcessError):
+            return 0
+
+    def read_usage(self):
+        reading = []
+        for line in self.smi_process.stdout:
+            try:
+                reading.append(int(line.strip()))
+            except ValueError:
+                continue
+            if len(reading) == self.num_gpus:
+                self.gpu_usage, reading = reading, []
+
+    def stop(self):
+        if self.num_gpus:
+            self.smi_process.terminate()
 
 
 class Monitor:
-    def __init__(self, id: str, pid: int) -> None:
+    def __init__(
+        self, id: str, pid: int, interval_s: float = 1.0, loggername="UTIL_MONITOR"
+    ) -> None:
         self.id: str = id
         self.pid: int = pid
-        self.logger = FedLogger(id=self.id, loggername="UTIL_MONITOR")
-        self.nvidia_smi_available = self.is_nvidia_smi_available()
+        self.interval_s: float = float(interval_s)
+        self.logger = FedLogger(id=self.id, loggername=loggername)
+        # the monitor runs in its own process, session changes are sent to it
+        self.session_queue = Queue()
+        register_resource_metrics(self.pid)
         self.monitor_process = Process(target=self.monitor_all)
         self.monitor_process.start()
 
     def set_session(self, session_id):
         self.logger.update_id(session_id)
+        self.session_queue.put(session_id)
 
     def reset_session(self):
         self.logger.update_id("0")
-
-    def is_nvidia_smi_available(self):
-        try:
-            subprocess.check_output(["nvidia-smi"])
-            return True
-        except FileNotFoundError:
-            return False
-        except subprocess.CalledProcessError:
-            return False
-
-    def get_gpu_usage(self):
-        try:
-            output = subprocess.check_output(
-                [
-                    "nvidia-smi",
-                    "--query-gpu=utilization.gpu",
-                    "--format=csv,noheader,nounits",
-                ]
-            )
-            gpu_usage = [int(x) for x in output.decode("utf-8").strip().split("\n")]
-            return gpu_usage
-        except Exception as e:
-            print(f"Error in monitor: {e}")
-            return None
-
-    def get_memory_from_free(self):
-        try:
-            output = subprocess.check_output(
-                [
-                    "free",
-                    "-w",
-                ]
-            )
-            memory_usage = [
-                i.split() for i in output.decode("utf8").strip().split("\n")
-            ]
-            memory_usage_ram = memory_usage[1][2]
-            memory_usage_swap = memory_usage[2][2]
-            return memory_usage_ram, memory_usage_swap
-        except Exception as e:
-            print(f"free not available: {e}")
-            return None, None
+        self.session_queue.put("0")
 
     def monitor_all(self):
-        if psutil.pid_exists(self.pid):
-            process = psutil.Process(self.pid)
-
-        create_time = datetime.datetime.fromtimestamp(process.create_time()).strftime(
-            "%Y%m%d - %H:%M:%S"
+        try:
+            create_time = psutil.Process(self.pid).create_time()
+        except psutil.NoSuchProcess:
+            return
+        self.logger.info(
+            "CREATE_TIME",
+            datetime.datetime.fromtimestamp(create_time).strftime("%Y%m%d - %H:%M:%S"),
         )
-        self.logger.info("CREATE_TIME", create_time)
-
-        io_0 = psutil.net_io_counters()
-        bs, br = io_0.bytes_sent, io_0.bytes_recv
-        o_s, o_r = bs, br
+        self.logger.info("MONITOR_FIELDS", ",".join(MONITOR_FIELDS))
+        log_id = self.id
 
-        io_disk_0 = process.io_counters()
-        dw, dr = io_disk_0.write_bytes, io_disk_0.read_bytes
-        d_w, d_r = dw, dr
-
-        while psutil.pid_exists(self.pid):
-            if not process:
-                break
+        sampler = ProcSampler(self.pid)
+        gpu_sampler = GPUSampler(self.interval_s)
+        sampler.sample()
+        next_tick = time() + self.interval_s
+        while True:
+            sleep(max(0.0, next_tick - time()))
+            next_tick += self.interval_s
+            start_time, start_cpu = time(), process_time()
+            while not self.session_queue.empty():
+                session_id = self.session_queue.get()
+                if session_id != log_id:
+                    # every log that holds MONITOR records starts with their fields
+                    self.logger.update_id(session_id)
+                    self.logger.info("MONITOR_FIELDS", ",".join(MONITOR_FIELDS))
+                    log_id = session_id
             try:
-                cpu_perc = process.cpu_percent(interval=1)
-                monitor_time = time()
-                self.logger.info("CPU_USAGE", f"{cpu_perc}")
-
-                try:
-                    memory_rss = process.memory_full_info().rss
-                    self.logger.info("MEMORY_USAGE_PHYSICAL", f"{memory_rss}")
-                    memory_rss_swap = process.memory_full_info().swap
-                    self.logger.info("MEMORY_USAGE_SWAP", f"{memory_rss_swap}")
-                except Exception as e:
-                    self.logger.info("CPU_USAGE", f"{cpu_perc}")
-                    memory_rss = process.memory_info().rss
-
-                memory_vms = process.memory_info().vms
-                self.logger.info("MEMORY_USAGE_VMS", f"{memory_vms}")
-                memory_data_f = process.memory_info().data
-                self.logger.info("DATA_SECTION_MEMORY", f"{memory_data_f}")
-                memory_ram, memory_swap = self.get_memory_from_free()
-                self.logger.info("MEMORY_USAGE_LINUX", f"{memory_ram},{memory_swap}")
-
-                io = psutil.net_io_counters()
-                network_bytes_sent_s = round((io.bytes_sent - bs), 2)
-                network_bytes_recv_s = round((io.bytes_recv - br), 2)
-                self.logger.info(
-                    "NETWORK_I/O", f"{network_bytes_sent_s},{network_bytes_recv_s}"
-                )
-                bs, br = io.bytes_sent, io.bytes_recv
-
-                io_disk = process.io_counters()
-                disk_bytes_write_s = round((io_disk.write_bytes - dw), 2)
-                disk_bytes_read_s = round((io_disk.read_bytes - dr), 2)
-                dw, dr = io_disk.write_bytes, io_disk.read_bytes
-                self.logger.info(
-                    "DISK_I/O", f"{disk_bytes_write_s},{disk_bytes_read_s}"
-                )
-
-                thread_count = process.num_threads()
-                self.logger.info("CURRENT_THREADS", f"{thread_count}")
-
-                if self.nvidia_smi_available:
-                    gpu_perc = self.get_gpu_usage()
-                    self.logger.info("GPU_USAGE", f"{gpu_perc}")
-
-            except psutil.NoSuchProcess as e:
-                self.logger.error(f"{e}", "")
-            finally:
-                o_s, o_r = round((bs - o_s) / (1024 * 1024), 2), round(
-                    (br - o_r) / (1024 * 1024), 2
-                )
-                self.logger.info("TOTAL_NETWORK_IO", f"{o_s},{o_r}")
-                d_w, d_r = round((dw - d_w) / (1024 * 1024), 2), round(
-                    (dr - d_r) / (1024 * 1024), 2
-                )
-                self.logger.info("TOTAL_DISK_IO", f"{d_w},{d_r}")
-                self.logger.info("MONITOR_TIME", time() - monitor_time)
+                sample = sampler.sample()
+            except FileNotFoundError:
+                # monitored process exited
+                break
+            except Exception as e:
+                self.logger.error("MONITOR.error", f"{e}")
+                continue
+            gpu_usage = gpu_sampler.gpu_usage
+            sample["gpu_perc"] = (
+                "-".join(str(g) for g in gpu_usage) if gpu_usage else ""
+            )
+            # cost of this tick, the sampling and the logging call
+            sample["monitor_cpu_s"] = round(process_time() - start_cpu, 6)
+            sample["monitor_time_s"] = round(time() - start_time, 6)
+            self.logger.info(
+                "MONITOR", ",".join(str(sample[f]) for f in MONITOR_FIELDS)
+            )
+        gpu_sampler.stop()
@@ -0,0 +1,212 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+
+# a partition is an index file over a base dataset that all partitions share:
+#   <base_dir>/data.npy      samples, read through a read-only memory map
+#   <base_dir>/targets.npy   labels
+#   <base_dir>/meta.pth      transforms, and the dataset itself if it has no data array
+#   <base_dir>/source.json   fingerprint of the source dataset, written last
+#   part_<n>.npz             "indices" into the base dataset and a JSON "meta" string
+PARTITION_FORMAT_VERSION = 1
+INDEX_SUFFIX = ".npz"
+BASE_DATA = "data.npy"
+BASE_TARGETS = "targets.npy"
+BASE_META = "meta.pth"
+BASE_FINGERPRINT = "source.json"
+
+
+def get_labels(data) -> np.ndarray:
+    """Labels of a dataset, read from its targets (MNIST, CIFAR, ImageFolder) or labels
+    (SVHN) attribute instead of loading every sample."""
+    if isinstance(data, torch.utils.data.Subset):
+        return get_labels(data.dataset)[np.asarray(data.indices)]
+    for attr in ("targets", "labels"):
+        labels = getattr(data, attr, None)
+        if labels is not None:
+            if torch.is_tensor(labels):
+                labels = labels.numpy()
+            return np.asarray(labels, dtype=np.int64)
+    print("get_labels:: dataset has no targets, loading every sample")
+    return np.fromiter((int(y) for _, y in data), dtype=np.int64, count=len(data))
+
+
+def label_summary(labels: np.ndarray) -> dict:
+    num_items = len(labels)
+    counts = np.bincount(labels) if num_items else np.zeros(0, dtype=np.int64)
+    class_distrb = {
+        int(label): count / num_items
+        for label, count in enumerate(counts.tolist())
+        if count > 0
+    }
+    return {"label_distribution": class_distrb, "num_items": num_items}
+
+
+def _samples(data):
+    samples = getattr(data, "data", None)
+    if torch.is_tensor(samples):
+        samples = samples.numpy()
+    return samples
+
+
+def base_fingerprint(data, targets: np.ndarray) -> dict:
+    """Checksums of the samples and labels of a dataset and the repr of its
+    transforms, to tell whether a base directory holds the same dataset. Datasets
+    without a data array are compared by their repr, e.g. root and transforms of an
+    ImageFolder."""
+    samples = _samples(data)
+    fingerprint = {
+        "version": PARTITION_FORMAT_VERSION,
+        "targets": hashlib.sha256(
+            np.ascontiguousarray(targets, dtype=np.int64)
+        ).hexdigest(),
+        "transform": repr(getattr(data, "transform", None)),
+        "target_transform": repr(getattr(data, "target_transform", None)),
+    }
+    if isinstance(samples, np.ndarray) and len(samples) == len(targets):
+        samples = np.ascontiguousarray(samples)
+        fingerprint["data"] = {
+            "shape": list(samples.shape),
+            "dtype": str(samples.dtype),
+            "sha256": hashlib.sha256(samples.reshape(-1).view(np.uint8)).hexdigest(),
+        }
+    else:
+        fingerprint["dataset"] = f"{type(data).__name__}:{len(data)}:{data!r}"
+    return fingerprint
+
+
+def read_base_fingerprint(base_dir: str):
+    """Fingerprint of the dataset in "base_dir", None if it is not complete."""
+    try:
+        with open(os.path.join(base_dir, BASE_FINGERPRINT)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_base_dataset(
+    data, targets: np.ndarray, base_dir: str, fingerprint: dict = None
+) -> None:
+    """Writes "data" once for all partitions. Datasets that keep their samples in a
+    "data" array (MNIST, EMNIST, CIFAR) are stored as .npy, others, e.g. ImageFolder
+    which only holds file paths, are pickled as they are."""
+    os.makedirs(base_dir, exist_ok=True)
+    fingerprint_path = os.path.join(base_dir, BASE_FINGERPRINT)
+    if os.path.isfile(fingerprint_path):
+        # an interrupted rewrite must not leave a matching fingerprint behind
+        os.remove(fingerprint_path)
+    samples = _samples(data)
+    meta = {
+        "version": PARTITION_FORMAT_VERSION,
+        "transform": getattr(data, "transform", None),
+        "target_transform": getattr(data, "target_transform", None),
+    }
+    if isinstance(samples, np.ndarray) and len(samples) == len(targets):
+        # HxW samples are read back as "L" images and HxWxC ones as RGB, as in torchvision
+        np.save(os.path.join(base_dir, BASE_DATA), np.ascontiguousarray(samples))
+    else:
+        meta["dataset"] = data
+    np.save(os.path.join(base_dir, BASE_TARGETS), np.asarray(targets, dtype=np.int64))
+    torch.save(meta, os.path.join(base_dir, BASE_META))
+    if fingerprint is None:
+        fingerprint = base_fingerprint(data, targets)
+    with open(fingerprint_path, "w") as f:
+        json.dump(fingerprint, f)
+
+
+def save_partition_index(
+    path: str, indices: np.ndarray, base_dir: str, labels: np.ndarray, **details
+) -> dict:
+    """Writes the index file of a partition, with the path of the base dataset
+    relative to it, so that the data directory can be moved or mounted elsewhere.
+
+    Returns:
+        dict: label summary of the partition
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    summary = label_summary(labels[indices])
+    meta = {
+        "version": PARTITION_FORMAT_VERSION,
+        "base_dir": os.path.relpath(base_dir, os.path.dirname(os.path.abspath(path))),
+        "summary": summary,
+        **details,
+    }
+    with open(path, "wb") as f:
+        np.savez(f, indices=indices, meta=np.array(json.dumps(meta)))
+    return summary
+
+
+def read_partition_index(path: str):
+    """
+    Returns:
+        tuple: (indices, meta) of an index file, the base_dir in meta resolved
+    """
+    with np.load(path, allow_pickle=False) as f:
+        indices = f["indices"]
+        meta = json.loads(str(f["meta"]))
+    meta["base_dir"] = os.path.normpath(
+        os.path.join(os.path.dirname(os.path.abspath(path)), meta["base_dir"])
+    )
+    return indices, meta
+
+
+class IndexedDataset(torch.utils.data.Dataset):
+    """Partition over a base dataset. The sample array is memory mapped read-only on
+    first access, in every process, so that DataLoader workers and clients on the same
+    host share its pages in the page cache instead of holding their own copy."""
+
+    def __init__(self, base_dir: str, indices: np.ndarray) -> None:
+        self.base_dir = base_dir
+        self.indices = indices
+        meta = torch.load(os.path.join(base_dir, BASE_META), weights_only=False)
+        self.transform = meta.get("transform")
+        self.target_transform = meta.get("target_transform")
+        self.base_dataset = meta.get("dataset")
+        self.targets = np.load(os.path.join(base_dir, BASE_TARGETS))[indices]
+        self._data = None
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getstate__(self):
+        # DataLoader workers open their own memory map
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def __getitem__(self, i):
+        index = int(self.indices[i])
+        if self.base_dataset is not None:
+            return self.base_dataset[index]
+        if self._data is None:
+            self._data = np.load(os.path.join(self.base_dir, BASE_DATA), mmap_mode="r")
+        img = Image.fromarray(np.asarray(self._data[index]))
+        target = int(self.targets[i])
+        if self.transform is not None:
+            img = self.transform(img)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return img, target
+
+
+def is_partition_index(path: str) -> bool:
+    return str(path).endswith(INDEX_SUFFIX)
+
+
+def load_partition(path: str) -> torch.utils.data.Dataset:
+    """Dataset of a partition file, an index file or a pickled DataLoader."""
+    if is_partition_index(path):
+        indices, meta = read_partition_index(path)
+        return IndexedDataset(meta["base_dir"], indices)
+    return torch.load(path, weights_only=False).dataset
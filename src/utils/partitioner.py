@@ -1,33 +1,45 @@
 import argparse
 import math
+import multiprocessing
 import os.path
 import yaml
 import torch
 import numpy as np
 import scipy
-from collections import Counter
 import torchvision.transforms as transforms
 import torchvision
 from sklearn.model_selection import train_test_split
 
+from utils.get_data_summary import get_data_summary
+from utils.partition_format import (
+    base_fingerprint,
+    get_labels,
+    read_base_fingerprint,
+    save_base_dataset,
+    save_partition_index,
+)
+
 
 def random_seed(seed=100):
     np.random.seed(seed)
 
 
-def get_dataset_summary(dataloader):
-    try:
-        dataset = dataloader.dataset
-        num_items = len(dataset)
-        class_distrb = dict(Counter(y for _, (x, y) in enumerate(dataset)))
-        for i, v in class_distrb.items():
-            class_distrb[i] = v / num_items
-        data_summary = {"label_distribution": class_distrb, "num_items": num_items}
+def group_indices(keys: np.ndarray, minlength: int = 0) -> list:
+    """Indices of "keys" grouped by key value, in dataset order, from one stable argsort.
 
-        return data_summary
+    Returns:
+        list: index array of every key value from 0 to max(keys) or minlength - 1
+    """
+    order = np.argsort(keys, kind="stable")
+    counts = np.bincount(keys, minlength=minlength)
+    return np.split(order, np.cumsum(counts)[:-1])
 
-    except Exception as e:
-        print("get_data_summary:: Exception - ", e)
+
+def class_indices(labels: np.ndarray) -> dict:
+    """Indices of every class that has samples, by label."""
+    return {
+        label: idx for label, idx in enumerate(group_indices(labels)) if len(idx) > 0
+    }
 
 
 def dirchlet(
@@ -38,107 +50,81 @@ def dirchlet(
     path: str = "./data/",
     min_samples: int = 100,
     task: str = "train",
+    workers: int = None,
 ):
     # https://github.com/IBM/probabilistic-federated-neural-matching/blob/master/experiment.py
-    X = [[] for _ in range(num_clients)]
-    y = [[] for _ in range(num_clients)]
     data = dataset.dataset
-    dataset_content, dataset_label = (data.data, data.targets)
-    label_distribution = dict(Counter([y for _, y in data]))
-    print(label_distribution)
-    num_classes = len(label_distribution)
-    dataidx_map = {}
-    min_size = 0
-    K = num_classes
-    N = len(dataset_label)
+    labels = get_labels(data)
+    classes = class_indices(labels)
+    print({label: len(idx) for label, idx in classes.items()})
+    N = len(labels)
 
+    # client of every sample, drawn class by class until every client has min_samples
+    owner = np.empty(N, dtype=np.int64)
+    min_size = 0
     while min_size < min_samples:
-        idx_batch = [[] for _ in range(num_clients)]
-        for k in range(K):
-            idx_k = np.where(dataset_label == k)[0]
-            np.random.shuffle(idx_k)
+        sizes = np.zeros(num_clients, dtype=np.int64)
+        for idx_k in classes.values():
             proportions = np.random.dirichlet(np.repeat(alpha, num_clients))
-            proportions = np.array(
-                [
-                    p * (len(idx_j) < N / num_clients)
-                    for p, idx_j in zip(proportions, idx_batch)
-                ]
-            )
+            # clients that already hold their share get nothing more
+            proportions = proportions * (sizes < N / num_clients)
             proportions = proportions / proportions.sum()
-            proportions = (np.cumsum(proportions) * len(idx_k)).astype(int)[:-1]
-            idx_batch = [
-                idx_j + idx.tolist()
-                for idx_j, idx in zip(idx_batch, np.split(idx_k, proportions))
-            ]
-            min_size = min([len(idx_j) for idx_j in idx_batch])
-        for j in range(num_clients):
-            dataidx_map[j] = idx_batch[j]
+            cuts = (np.cumsum(proportions) * len(idx_k)).astype(int)[:-1]
+            counts = np.diff(np.concatenate(([0], cuts, [len(idx_k)])))
+            owner[np.random.permutation(idx_k)] = np.repeat(
+                np.arange(num_clients), counts
+            )
+            sizes += counts
+        min_size = sizes.min()
 
-    path = os.path.join(path, dataset_name,task)
+    path = os.path.join(path, dataset_name, task)
+    base_dir = os.path.join(path, "base")
     path = os.path.join(path, "dirichlet/")
-    os.makedirs(path, exist_ok=True)
-    # assign data
-    for client in range(num_clients):
-        idxs = dataidx_map[client]
-
-        temp = os.path.join(path, f"part_{client}/")
-        os.makedirs(temp, exist_ok=True)
-        filename = f"a_{alpha}_part_{client}.pth"
-
-        save_partition(client, data, dataset_name, filename, idxs, temp, task)
-
-        X[client] = dataset_content[idxs]
-        y[client] = dataset_label[idxs]
+    partitions = [
+        (client, f"a_{alpha}_part_{client}.npz", idxs, os.path.join(path, f"part_{client}/"))
+        for client, idxs in enumerate(group_indices(owner, num_clients))
+    ]
+    save_partitions(data, labels, dataset_name, task, partitions, base_dir, workers)
 
     print("Created dirichlet partitions!!")
 
-    del data
-
 def limit_label(dataset,
                 max_classes,
                 num_client,
                 f: float = 1.0,
                 path="./data/",
                 dataset_name: str = "MNIST",
-                task: str = "train"):
-    client_idx = []
-
+                task: str = "train",
+                workers: int = None):
     data = dataset.dataset
-    label_distribution = dict(Counter([y for _, y in data]))
-    print(label_distribution)
-    num_classes = len(label_distribution)
+    labels = get_labels(data)
+    classes = class_indices(labels)
+    print({label: len(idx) for label, idx in classes.items()})
+    class_labels = np.array(list(classes.keys()))
 
     path = os.path.join(path, dataset_name,task)
+    base_dir = os.path.join(path, "base")
     path = os.path.join(path, "limit_label/")
-    os.makedirs(path, exist_ok=True)
 
-    classes = dict()
-    for i, (x, y) in enumerate(data):
-        if y in classes.keys():
-            classes[y].append(i)
-        else:
-            classes[y] = [i]
-    print(classes.keys())
+    partitions = []
     for client in range(num_client):
-        selected_labels = np.random.choice(num_classes,
-                                           size=min(max_classes, num_classes),
+        selected_labels = np.random.choice(class_labels,
+                                           size=min(max_classes, len(class_labels)),
                                            replace=False)
         print("selected labels: ", selected_labels)
 
-        idx = []
-        for x in selected_labels:
-            fraction = np.random.choice(classes[x],
-                                        size=min(math.ceil(f * len(classes[x])), len(classes[x])),
-                                        replace=False)
-            idx.extend(fraction)
-
-        client_idx.append(idx)
-        temp = os.path.join(path, f"part_{client}/")
-        os.makedirs(temp, exist_ok=True)
-        filename = f"ll_part_{client}.pth"
+        idx = [
+            np.random.choice(classes[x],
+                             size=min(math.ceil(f * len(classes[x])), len(classes[x])),
+                             replace=False)
+            for x in selected_labels
+        ]
+        partitions.append(
+            (client, f"ll_part_{client}.npz", np.concatenate(idx), os.path.join(path, f"part_{client}/"))
+        )
 
-        # save the partitions
-        save_partition(client, data, dataset_name, filename, idx, temp, task)
+    # save the partitions
+    save_partitions(data, labels, dataset_name, task, partitions, base_dir, workers)
 
     print("Created limit_label partitions!!")
 
@@ -148,46 +134,39 @@ def limit_label_unique(dataset,
                 samples,
                 path="./data/",
                 dataset_name: str = "MNIST",
-                task: str = "train"):
-    client_idx = []
-
+                task: str = "train",
+                workers: int = None):
     data = dataset.dataset
-    label_distribution = dict(Counter([y for _, y in data]))
-    print(label_distribution)
-    num_classes = len(label_distribution)
+    labels = get_labels(data)
+    # shuffled once, every client then takes the next samples of a class
+    classes = {label: np.random.permutation(idx) for label, idx in class_indices(labels).items()}
+    print({label: len(idx) for label, idx in classes.items()})
+    class_labels = np.array(list(classes.keys()))
+    taken = dict.fromkeys(classes.keys(), 0)
 
     path = os.path.join(path, dataset_name,task)
+    base_dir = os.path.join(path, "base")
     path = os.path.join(path, "limit_label_samples/")
-    os.makedirs(path, exist_ok=True)
 
-    classes = dict()
-    for i, (x, y) in enumerate(data):
-        if y in classes.keys():
-            classes[y].append(i)
-        else:
-            classes[y] = [i]
+    partitions = []
     for client in range(num_client):
-        selected_labels = np.random.choice(num_classes,
-                                           size=min(max_classes, num_classes),
+        selected_labels = np.random.choice(class_labels,
+                                           size=min(max_classes, len(class_labels)),
                                            replace=False)
         print("selected labels: ", selected_labels)
-        # need to handle if the samples in class is empty
+        # a class that is used up adds no samples
         idx = []
         for x in selected_labels:
-            fraction = np.random.choice(classes[x],
-                                        size=min(samples, len(classes[x])),
-                                        replace=False)
-            idx.extend(fraction)
-            for j in fraction:
-                classes[x].remove(j)
-
-        client_idx.append(idx)
-        temp = os.path.join(path, f"part_{client}/")
-        os.makedirs(temp, exist_ok=True)
-        filename = f"ll_part_{client}.pth"
+            start = taken[x]
+            taken[x] = min(start + samples, len(classes[x]))
+            idx.append(classes[x][start:taken[x]])
+
+        partitions.append(
+            (client, f"ll_part_{client}.npz", np.concatenate(idx), os.path.join(path, f"part_{client}/"))
+        )
 
-        # save the partitions
-        save_partition(client, data, dataset_name, filename, idx, temp, task)
+    # save the partitions
+    save_partitions(data, labels, dataset_name, task, partitions, base_dir, workers)
 
     print("Created limit_label partitions!!")
 
@@ -197,71 +176,50 @@ def equal_label_distribution(dataset,
                              dataset_name: str = "MNIST",
                              task: str = "train"):
     data = dataset.dataset
-    label_distribution = dict(Counter([y for _, y in data]))
-    print(label_distribution)
-    num_classes = len(label_distribution)
+    labels = get_labels(data)
+    classes = class_indices(labels)
+    print({label: len(idx) for label, idx in classes.items()})
 
     path = os.path.join(path, dataset_name,task)
+    base_dir = os.path.join(path, "base")
     path = os.path.join(path, "eq_part_complete/")
     os.makedirs(path, exist_ok=True)
 
-    classes = dict()
-
-    for i, (x, y) in enumerate(data):
-        if y in classes.keys():
-            classes[y].append(i)
-        else:
-            classes[y] = [i]
-
-    least = min(label_distribution.values())
+    least = min(len(idx) for idx in classes.values())
     print(f"least is {least}")
-    idx = []
-
-    for key in classes.keys():
-        for i in classes[key][:least]:
-            idx.append(i)
-
-    # temp = os.path.join(path, f'part_{part}/')
-    # os.makedirs(temp, exist_ok=True)
+    idx = np.concatenate([class_idx[:least] for class_idx in classes.values()])
 
-    filename = f"equal_labels.pth"
-    save_partition(1, data, dataset_name, filename, idx, path, task)
+    filename = f"equal_labels.npz"
+    write_base_dataset(data, labels, base_dir)
+    save_partition(1, dataset_name, filename, idx, path, task, labels, base_dir)
 
 
 def equal_partition(dataset,
                     num_client,
                     path="./data/",
                     dataset_name: str = "MNIST",
-                    task: str = "train"):
+                    task: str = "train",
+                    workers: int = None):
     data = dataset.dataset
-    label_distribution = dict(Counter([y for _, y in data]))
+    labels = get_labels(data)
+    classes = class_indices(labels)
 
     path = os.path.join(path, dataset_name,task)
+    base_dir = os.path.join(path, "base")
     path = os.path.join(path, "iid/")
-    os.makedirs(path, exist_ok=True)
-
-    classes = dict()
-
-    for i, (x, y) in enumerate(data):
-        if y in classes.keys():
-            classes[y].append(i)
-        else:
-            classes[y] = [i]
 
-    least = min(label_distribution.values())
+    least = min(len(idx) for idx in classes.values())
     min_samples = least // num_client
     print(f"least label wise samples: {least}")
-    for i in range(num_client):
-        part_idx = list()
-        print(f"partition - {i}")
-        for k in classes.keys():
-            for j in range(i * min_samples, (i + 1) * min_samples):
-                part_idx.append(classes[k][j])
-
-        temp = os.path.join(path, f"part_{i}/")
-        os.makedirs(temp, exist_ok=True)
-        filename = f"iid_part_{i}.pth"
-        save_partition(i, data, dataset_name, filename, part_idx, temp, task)
+    # class x client x sample, client i gets samples i * min_samples onwards of every class
+    split = np.stack(
+        [idx[: num_client * min_samples] for idx in classes.values()]
+    ).reshape(len(classes), num_client, min_samples)
+    partitions = [
+        (i, f"iid_part_{i}.npz", split[:, i, :].ravel(), os.path.join(path, f"part_{i}/"))
+        for i in range(num_client)
+    ]
+    save_partitions(data, labels, dataset_name, task, partitions, base_dir, workers)
 
     print("Generated partitions!!!")
 
@@ -270,39 +228,30 @@ def equal_samples(dataset,
                   num_samples,
                   path="./data/",
                   dataset_name: str = "MNIST",
-                  task: str = "train"):
+                  task: str = "train",
+                  workers: int = None):
     data = dataset.dataset
-    label_distribution = dict(Counter([y for _, y in data]))
+    labels = get_labels(data)
+    classes = class_indices(labels)
 
     path = os.path.join(path, dataset_name,task)
+    base_dir = os.path.join(path, "base")
     path = os.path.join(path, "iid_eq_samples/")
-    os.makedirs(path, exist_ok=True)
-
-    classes = dict()
-
-    for i, (x, y) in enumerate(data):
-        if y in classes.keys():
-            classes[y].append(i)
-        else:
-            classes[y] = [i]
-
-    samples_per_class = num_samples // len(classes.keys())
 
+    samples_per_class = num_samples // len(classes)
 
+    partitions = []
     for part in range(num_client):
-        idx = []
-        for k in classes.keys():
-            temp = np.random.choice(classes[k],
-                                    size=min(samples_per_class, len(classes[k])),
-                                    replace=False)
-            # or
-            # end = len(classes[k]) if ((part+1)*samples_per_class > len(classes[k])) else (part+1)*samples_per_class
-            # temp = classes[k][part*samples_per_class:end]
-            idx.extend(temp)
-        temp = os.path.join(path, f"part_{part}/")
-        os.makedirs(temp, exist_ok=True)
-        filename = f"iid_part_{part}.pth"
-        save_partition(part, data, dataset_name, filename, idx, temp, task)
+        idx = [
+            np.random.choice(class_idx,
+                             size=min(samples_per_class, len(class_idx)),
+                             replace=False)
+            for class_idx in classes.values()
+        ]
+        partitions.append(
+            (part, f"iid_part_{part}.npz", np.concatenate(idx), os.path.join(path, f"part_{part}/"))
+        )
+    save_partitions(data, labels, dataset_name, task, partitions, base_dir, workers)
 
     print("Generated partitions!!!")
 
@@ -310,59 +259,89 @@ def probability_distribution(dataset,
                              distribution: list,
                              path: str = "./data/",
                              dataset_name: str = "MNIST",
-                             task: str = "train"):
+                             task: str = "train",
+                             workers: int = None):
     data = dataset.dataset
-    label_distribution = dict(Counter([y for _, y in data]))
-    print(label_distribution)
+    labels = get_labels(data)
+    classes = class_indices(labels)
+    print({label: len(idx) for label, idx in classes.items()})
 
     path = os.path.join(path, dataset_name,task)
+    base_dir = os.path.join(path, "base")
     path = os.path.join(path, "probability/")
-    os.makedirs(path, exist_ok=True)
 
-    classes = dict()
+    # every class is cut at the cumulative share of each partition
+    class_sizes = np.array([len(idx) for idx in classes.values()])
+    shares = np.ceil(np.outer(distribution, class_sizes)).astype(np.int64)
+    ends = np.minimum(np.cumsum(shares, axis=0), class_sizes)
+    starts = np.vstack([np.zeros_like(class_sizes), ends[:-1]])
+
+    partitions = []
+    for part in range(len(distribution)):
+        idx = np.concatenate([
+            class_idx[start:end]
+            for class_idx, start, end in zip(classes.values(), starts[part], ends[part])
+        ])
+        partitions.append(
+            (part, f"probability_{dataset_name}_part_{part}.npz", idx, os.path.join(path, f"part_{part}/"))
+        )
+    save_partitions(data, labels, dataset_name, task, partitions, base_dir, workers)
 
-    for i, (x, y) in enumerate(data):
-        if y in classes.keys():
-            classes[y].append(i)
-        else:
-            classes[y] = [i]
-
-    slices_indicies = dict()
-    for key in classes.keys():
-        slices_indicies[key] = 0
-    client_idxs = []
-    part = 0
-    for probability in distribution:
-        idx = []
-        for key in classes.keys():
-            temp_num = math.ceil(probability * len(classes[key]))
-            start = slices_indicies[key]
-            end = slices_indicies[key] + temp_num
-            if end > len(classes[key]):
-                end = len(classes[key])
-            for i in range(start, end):
-                idx.append(classes[key][i])
-                pass
-            slices_indicies[key] = end
-
-        client_idxs.append(idx)
-
-        temp = os.path.join(path, f"part_{part}/")
-        os.makedirs(temp, exist_ok=True)
 
-        filename = f"probability_{dataset_name}_part_{part}.pth"
+# arguments of the save_partitions workers, inherited through fork instead of pickled
+_shared_partition_data = dict()
+
+
+def _save_partition_worker(partition):
+    client, filename, idxs, temp = partition
+    shared = _shared_partition_data
+    save_partition(
+        client, shared["dataset_name"], filename, idxs, temp, shared["task"],
+        shared["labels"], shared["base_dir"],
+    )
+
 
-        save_partition(part, data, dataset_name, filename, idx, temp, task)
-        part += 1
+def write_base_dataset(data, labels, base_dir):
+    """Writes the base dataset that the partitions index, unless the same samples,
+    labels and transforms were already written there by an earlier partitioning."""
+    fingerprint = base_fingerprint(data, labels)
+    if read_base_fingerprint(base_dir) == fingerprint:
+        print(f"Reusing base dataset {base_dir}")
+        return
+    save_base_dataset(data, labels, base_dir, fingerprint)
 
 
-def save_partition(client, data, dataset_name, filename, idxs, temp, task):
-    partition = torch.utils.data.Subset(data, idxs)
-    partition_loader = torch.utils.data.DataLoader(
-        partition, batch_size=1, shuffle=False
+def save_partitions(data, labels, dataset_name, task, partitions, base_dir, workers=None):
+    """Writes the base dataset once and the index files of the (client, filename, idxs,
+    directory) partitions from "workers" processes, one per CPU by default. Without
+    fork, e.g. on Windows, they are written one by one."""
+    write_base_dataset(data, labels, base_dir)
+    for _, _, _, temp in partitions:
+        os.makedirs(temp, exist_ok=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(partitions))
+    _shared_partition_data.update(
+        labels=labels, dataset_name=dataset_name, task=task, base_dir=base_dir
+    )
+    try:
+        if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                pool.map(_save_partition_worker, partitions, chunksize=1)
+        else:
+            for partition in partitions:
+                _save_partition_worker(partition)
+    finally:
+        _shared_partition_data.clear()
+
+
+def save_partition(client, dataset_name, filename, idxs, temp, task, labels, base_dir):
+    summary = save_partition_index(
+        os.path.join(temp, filename), idxs, base_dir, labels,
+        dataset_id=dataset_name, partition=client,
     )
-    torch.save(partition_loader, os.path.join(temp, filename))
-    summary = get_dataset_summary(partition_loader)
+    # written now so that clients do not compute it on their first start
+    get_data_summary(os.path.join(temp, filename))
     config = dict()
     config["dataset_details"] = {
         "data_filename": filename,
@@ -375,26 +354,14 @@ def save_partition(client, data, dataset_name, filename, idxs, temp, task):
     with open(os.path.join(temp, yaml_file), "w") as f:
         yaml.dump(config, f, default_flow_style=False)
 
-def save_test_partition(data, dataset_name, filename="test.pth", task="test"):
+def save_test_partition(data, dataset_name, filename="test.npz", task="test"):
     partition = data.dataset
-    partition_loader = torch.utils.data.DataLoader(
-        partition, batch_size=1, shuffle=False
-    )
+    labels = get_labels(partition)
     path = os.path.join('./data',dataset_name, task)
     os.makedirs(path, exist_ok=True)
-    torch.save(partition_loader, os.path.join(path, filename))
-    summary = get_dataset_summary(partition_loader)
-    config = dict()
-    config["dataset_details"] = {
-        "data_filename": filename,
-        "dataset_id": dataset_name,
-        "dataset_tags": ["IMAGE"],
-        "suitable_models": ["LeNet5", "AlexNet"],
-    }
-    config["metadata"] = summary
-    yaml_file = f"{task}_dataset_config.yaml"
-    with open(os.path.join(path, yaml_file), "w") as f:
-        yaml.dump(config, f, default_flow_style=False)
+    base_dir = os.path.join(path, "base")
+    write_base_dataset(partition, labels, base_dir)
+    save_partition(0, dataset_name, filename, np.arange(len(labels)), path, task, labels, base_dir)
 
 
 def get_mnist():
@@ -538,6 +505,9 @@ if __name__ == "__main__":
     parser.add_argument(
         "-partition", choices=technique, help="select partition technique"
     )
+    parser.add_argument(
+        "-workers", type=int, default=None, help="processes writing the partitions (default: one per CPU)"
+    )
 
     args, remaining_args = parser.parse_known_args()
 
@@ -575,7 +545,8 @@ if __name__ == "__main__":
                 dataset_name=dataset_name,
                 path=subargs.path,
                 min_samples=subargs.min_samples,
-                task="train"
+                task="train",
+                workers=args.workers,
             )
             save_test_partition(data=data[1], dataset_name=dataset_name)
 
@@ -613,7 +584,8 @@ if __name__ == "__main__":
                 max_classes=subargs.labels_per_client,
                 num_client=subargs.n_clients,
                 path=subargs.path,
-                task="train"
+                task="train",
+                workers=args.workers,
             )
             save_test_partition(data=data[1], dataset_name=dataset_name)
 
@@ -651,7 +623,8 @@ if __name__ == "__main__":
                 max_classes=subargs.labels_per_client,
                 num_client=subargs.n_clients,
                 path=subargs.path,
-                task="train"
+                task="train",
+                workers=args.workers,
             )
             save_test_partition(data=data[1], dataset_name=dataset_name)
 
@@ -690,7 +663,8 @@ if __name__ == "__main__":
                 distribution=prob,
                 dataset_name=dataset_name,
                 path=subargs.path,
-                task="train"
+                task="train",
+                workers=args.workers,
             )
             save_test_partition(data=data[1], dataset_name=dataset_name)
 
@@ -722,7 +696,8 @@ if __name__ == "__main__":
                 num_client=subargs.n_clients,
                 dataset_name=dataset_name,
                 path=subargs.path,
-                task="train"
+                task="train",
+                workers=args.workers,
             )
             save_test_partition(data=data[1], dataset_name=dataset_name)
 
@@ -750,7 +725,7 @@ if __name__ == "__main__":
                 dataset=data[0],
                 dataset_name=dataset_name,
                 path=subargs.path,
-                task="train"
+                task="train",
             )
             save_test_partition(data=data[1], dataset_name=dataset_name)
 
@@ -786,7 +761,8 @@ if __name__ == "__main__":
                 num_samples=subargs.samples,
                 dataset_name=dataset_name,
                 path=subargs.path,
-                task="train"
+                task="train",
+                workers=args.workers,
             )
             save_test_partition(data=data[1], dataset_name=dataset_name)
 
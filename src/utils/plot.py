@@ -1,4 +1,4 @@
-from utils.log_parser import parse_log_file
+from utils.log_parser import IncrementalLogReader, get_session_log_file
 from threading import Event
 from threading import Thread
 import os
@@ -17,25 +17,43 @@ class Plot:
             [0.6627451, 0.8505867, 0.53165947, 1.0],
             [0.07254902, 0.88292761, 0.9005867, 1.0],
         ]
+        # values of every fedserver.train_callback event read so far
+        self.results = list()
+        self.log_reader = None
         plot_thread = Thread(target=self.plot)
         plot_thread.start()
 
     def plot(self) -> None:
         sleep = Event()
         while not sleep.is_set():
-            df = parse_log_file(self.session_log_name)
-            check_list = df["values"][
-                df["message"] == "fedserver_session_finished_running"
-            ].to_list()
-            if len(check_list) >= 1:
+            if self.log_reader is None:
+                log_name = get_session_log_file(self.session_log_name)
+                if os.path.isfile(log_name):
+                    self.log_reader = IncrementalLogReader(
+                        log_name,
+                        events=[
+                            "fedserver_session_finished_running",
+                            "fedserver.train_callback",
+                        ],
+                    )
+            records = self.log_reader.read() if self.log_reader else []
+            new_results = [
+                r["values"]
+                for r in records
+                if r["message"] == "fedserver.train_callback"
+            ]
+            finished = any(
+                r["message"] == "fedserver_session_finished_running" for r in records
+            )
+            if new_results:
+                self.results.extend(new_results)
+                self.plot_log_vs_accuracy(self.results)
+            if finished:
                 print("STOPPING PLOTTER")
                 return
             sleep.wait(10)
-            self.plot_log_vs_accuracy(df)
-
-    def plot_log_vs_accuracy(self, df) -> None:
-        results = df["values"][df["message"] == "fedserver.train_callback"].to_list()
 
+    def plot_log_vs_accuracy(self, results) -> None:
         try:
             rounds = int(results[-1][3])
         except IndexError:
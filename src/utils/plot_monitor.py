@@ -2,7 +2,8 @@ import argparse
 
 import matplotlib.pyplot as plt
 
-from log_parser import parse_log_file
+from utils.log_parser import parse_log_file
+from utils.monitor import MONITOR_FIELDS
 
 parser = argparse.ArgumentParser()
 parser.add_argument("f")
@@ -23,15 +24,21 @@ else:
 monitor = df[df["thread_id"] == hack]
 monitor.reset_index()
 
-"""NETWORK_I/O"""
-NETWORK = monitor[monitor["message"] == "NETWORK_I/O"]
+"""MONITOR, one record per sample with the fields listed in MONITOR_FIELDS"""
+headers = df["values"][df["message"] == "MONITOR_FIELDS"].to_list()
+# logs without a header use the fields of this version of the monitor
+fields = list(headers[-1]) if headers else list(MONITOR_FIELDS)
+MONITOR = monitor[monitor["message"] == "MONITOR"]
+
 
-sent = []
-recv = []
-for i, j in enumerate(NETWORK["values"]):
-    if i % 1 == 0:
-        sent.append(float(j[0]) / (1024))
-        recv.append(float(j[1]) / (1024))
+def monitor_series(field, scale=1):
+    index = fields.index(field)
+    return [float(j[index]) / scale for j in MONITOR["values"]]
+
+
+"""NETWORK_I/O"""
+sent = monitor_series("net_sent_b", 1024)
+recv = monitor_series("net_recv_b", 1024)
 
 fig, ax1 = plt.subplots()
 ax1.grid()
@@ -47,14 +54,8 @@ plt.legend(bbox_to_anchor=(1.3, 1.0))
 fig.savefig(f"network_{plot_name}.jpg", bbox_inches="tight")
 
 """DISK_I/O"""
-DISK = monitor[monitor["message"] == "DISK_I/O"]
-
-d_sent = []
-d_recv = []
-for i, j in enumerate(DISK["values"]):
-    if i % 1 == 0:
-        d_sent.append(float(j[0]) / (1024))
-        d_recv.append(float(j[1]) / (1024))
+d_sent = monitor_series("disk_write_b", 1024)
+d_recv = monitor_series("disk_read_b", 1024)
 
 fig, ax1 = plt.subplots()
 ax1.grid()
@@ -69,12 +70,7 @@ plt.legend(bbox_to_anchor=(1.35, 1.0))
 fig.savefig(f"disk_{plot_name}.jpg", bbox_inches="tight")
 
 """CPU_USAGE"""
-CPU = monitor[monitor["message"] == "CPU_USAGE"]
-
-cpu = []
-for i, j in enumerate(CPU["values"]):
-    if i % 1 == 0:
-        cpu.append(float(j[0]))
+cpu = monitor_series("cpu_perc")
 
 fig, ax1 = plt.subplots()
 ax1.grid()
@@ -89,20 +85,6 @@ plt.legend(bbox_to_anchor=(1.4, 1.0))
 fig.savefig(f"cpu_{plot_name}.jpg", bbox_inches="tight")
 
 """CPU_USAGE vs NETWORK I/O"""
-CPU = monitor[monitor["message"] == "CPU_USAGE"]
-NETWORK = monitor[monitor["message"] == "NETWORK_I/O"]
-
-cpu = []
-for i, j in enumerate(CPU["values"]):
-    if i % 1 == 0:
-        cpu.append(float(j[0]))
-
-sent = []
-recv = []
-for i, j in enumerate(NETWORK["values"]):
-    if i % 1 == 0:
-        sent.append(float(j[0]) / (1024))
-        recv.append(float(j[1]) / (1024))
 
 fig, ax1 = plt.subplots()
 ax1.grid()
@@ -0,0 +1,70 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+from contextlib import nullcontext
+
+import torch
+
+PRECISIONS = ("fp32", "bf16", "fp16-amp")
+
+
+def negotiate_precision(requested, hw_info: dict, device) -> str:
+    """Picks the training precision for this client.
+
+    Args:
+        requested (str): "precision" from default_training_config / model_config
+        hw_info (dict): hardware_info advertised by the client, see utils.hardware_info
+        device (torch.device | str): device the model is trained on
+
+    Returns:
+        str: requested precision if the hardware supports it, "fp32" otherwise
+    """
+    if requested is None or str(requested).lower() in ("none", "fp32"):
+        return "fp32"
+    requested = str(requested).lower()
+    if requested not in PRECISIONS:
+        print(
+            f"precision.negotiate_precision:: Unknown precision {requested}, using fp32"
+        )
+        return "fp32"
+
+    hw_info = hw_info if hw_info else dict()
+    on_cuda = torch.device(device).type == "cuda"
+    if requested == "bf16":
+        supported = hw_info.get(
+            "cuda_bf16_supported" if on_cuda else "cpu_bf16_supported", False
+        )
+    else:
+        # fp16 autocast on CPU is slower than fp32, only use it on GPUs
+        supported = on_cuda and hw_info.get("cuda_available", False)
+
+    if not supported:
+        print(
+            f"precision.negotiate_precision:: {requested} not supported on {torch.device(device).type}, using fp32"
+        )
+        return "fp32"
+    return requested
+
+
+def autocast_context(precision: str, device):
+    """Autocast region for the forward pass and loss. Parameters stay fp32."""
+    device_type = torch.device(device).type
+    if precision == "bf16":
+        return torch.autocast(device_type=device_type, dtype=torch.bfloat16)
+    elif precision == "fp16-amp":
+        return torch.autocast(device_type=device_type, dtype=torch.float16)
+    return nullcontext()
+
+
+def get_grad_scaler(precision: str):
+    """Loss scaler for fp16 autocast. A disabled scaler is a pass-through for the
+    other precisions, so the training loop does not need to branch on it."""
+    enabled = precision == "fp16-amp"
+    try:
+        return torch.amp.GradScaler("cuda", enabled=enabled)
+    except (AttributeError, TypeError):
+        return torch.cuda.amp.GradScaler(enabled=enabled)
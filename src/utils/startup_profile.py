@@ -0,0 +1,127 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import sys
+import threading
+from importlib.abc import MetaPathFinder
+from time import perf_counter
+
+PROFILE_FLAG = "--profile-startup"
+# number of modules printed per report
+REPORT_TOP_N = 15
+
+
+class TimedLoader:
+    """Loader of a module that times its execution, and forwards everything else to
+    the loader it wraps."""
+
+    def __init__(self, loader, profiler, name: str) -> None:
+        self._loader = loader
+        self._profiler = profiler
+        self._name = name
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module) -> None:
+        module.__loader__ = self._loader
+        self._profiler.enter()
+        start = perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler.exit(self._name, perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class ImportProfiler(MetaPathFinder):
+    """
+    Records the time taken to import each module, with the time of the modules it
+    imported (cumulative) and without (self), like "python -X importtime". Installed
+    first in sys.meta_path when a process is started with --profile-startup.
+    """
+
+    def __init__(self) -> None:
+        self.start_time = perf_counter()
+        self.last_report = self.start_time
+        self.records = list()
+        self._local = threading.local()
+
+    def start(self):
+        sys.meta_path.insert(0, self)
+        return self
+
+    def stop(self) -> None:
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path, target=None):
+        if getattr(self._local, "finding", False):
+            return None
+        self._local.finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.finding = False
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = TimedLoader(spec.loader, self, fullname)
+        return spec
+
+    def enter(self) -> None:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = list()
+        # time of the modules imported by this one
+        stack.append(0.0)
+
+    def exit(self, name: str, elapsed: float) -> None:
+        stack = self._local.stack
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        self.records.append((name, elapsed - children, elapsed, len(stack)))
+
+    def report(self, label: str, top_n: int = REPORT_TOP_N) -> None:
+        """Prints the modules imported since the last report that took the longest,
+        by cumulative time, and the time since the last report."""
+        now = perf_counter()
+        records, self.records = self.records, list()
+        total_import = sum(r[2] for r in records if r[3] == 0)
+        print(
+            f"startup_profile.report:: {label} - {now - self.last_report:.3f}s, "
+            f"{total_import:.3f}s importing {len(records)} modules"
+        )
+        self.last_report = now
+        for name, self_time, cumulative, depth in sorted(
+            records, key=lambda r: r[2], reverse=True
+        )[:top_n]:
+            print(
+                f"startup_profile.report::   {cumulative:8.3f}s cumulative "
+                f"{self_time:8.3f}s self  {'  ' * min(depth, 4)}{name}"
+            )
+
+
+def start_profiler(argv=None):
+    """Starts the import profiler if --profile-startup is in "argv", before the
+    other arguments are parsed so that the imports of the entry point are included.
+
+    Returns:
+        ImportProfiler: None without the flag
+    """
+    argv = sys.argv if argv is None else argv
+    if PROFILE_FLAG not in argv:
+        return None
+    return ImportProfiler().start()
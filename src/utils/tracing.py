@@ -0,0 +1,244 @@
+"""
+Authors: Prince Modi, Roopkatha Banerjee, Yogesh Simmhan
+Emails: princemodi@iisc.ac.in, roopkathab@iisc.ac.in, simmhan@iisc.ac.in
+Copyright 2023 Indian Institute of Science
+Licensed under the Apache License, Version 2.0, http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import json
+import os
+import threading
+import zlib
+from argparse import ArgumentParser
+from time import time
+
+from utils.logger import LOG_DIR
+
+TRACE_SUFFIX = ".trace.json"
+
+# W3C trace context header, sent as gRPC metadata and in MQTT command bodies
+TRACEPARENT = "traceparent"
+
+
+def get_trace_path(service: str, log_dir: str = LOG_DIR) -> str:
+    """flotilla_<service>.trace.json next to the logs"""
+    return os.path.join(log_dir, f"flotilla_{service}{TRACE_SUFFIX}")
+
+
+def new_id(num_bytes: int) -> str:
+    return os.urandom(num_bytes).hex()
+
+
+def parse_traceparent(traceparent: str):
+    """
+    Returns:
+        tuple: (trace_id, span_id) of a "00-<trace_id>-<span_id>-<flags>" header,
+        None if the header is missing or malformed
+    """
+    if not traceparent:
+        return None
+    parts = str(traceparent).split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+class TraceWriter:
+    """Appends spans to a file in the Chrome trace event format, as "X" complete events
+    with wall clock timestamps in microseconds. The JSON array is left open, which
+    Perfetto and chrome://tracing accept, so that every span is one appended line; see
+    merge_traces to combine the files of the server and the clients."""
+
+    def __init__(self, service: str, path: str) -> None:
+        self.service = service
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._tracks = set()
+
+    def _open(self) -> None:
+        # a forked process opens its own file descriptor and names its own tracks
+        self._pid = os.getpid()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._tracks = set()
+        lines = []
+        if os.fstat(self._fd).st_size == 0:
+            lines.append("[")
+        lines.append(self._metadata("process_name", 0, self.service))
+        os.write(self._fd, "\n".join(lines).encode() + b"\n")
+
+    def _metadata(self, name: str, tid: int, value: str) -> str:
+        event = {"name": name, "ph": "M", "pid": self._pid, "tid": tid}
+        event["args"] = {"name": value}
+        return json.dumps(event) + ","
+
+    def write(self, event: dict, track: str) -> None:
+        with self._lock:
+            try:
+                if self._pid != os.getpid():
+                    self._open()
+                event["pid"] = self._pid
+                lines = []
+                if track is None:
+                    event["tid"] = threading.get_ident()
+                else:
+                    # one row per track, e.g. per client, instead of per thread
+                    event["tid"] = zlib.crc32(track.encode())
+                    if track not in self._tracks:
+                        self._tracks.add(track)
+                        lines.append(self._metadata("thread_name", event["tid"], track))
+                lines.append(json.dumps(event, default=str) + ",")
+                os.write(self._fd, "\n".join(lines).encode() + b"\n")
+            except Exception as e:
+                print(f"TraceWriter.write:: {e}")
+
+
+class Span:
+    """Timed operation of a trace. Spans that share a trace_id are linked through
+    parent_id, across processes when the traceparent is sent along with a request."""
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str = None,
+        parent_id: str = None,
+        track: str = None,
+        writer: TraceWriter = None,
+        **args,
+    ) -> None:
+        self.name = name
+        self.trace_id = trace_id or new_id(16)
+        self.parent_id = parent_id
+        self.span_id = new_id(8)
+        self.track = track
+        self.writer = writer
+        self.args = args
+        self.start_time = time()
+        self.end_time = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def child(self, name: str, track: str = None, **args) -> "Span":
+        return Span(
+            name,
+            trace_id=self.trace_id,
+            parent_id=self.span_id,
+            track=self.track if track is None else track,
+            writer=self.writer,
+            **args,
+        )
+
+    def end(self, **args) -> None:
+        if self.end_time is not None:
+            return
+        self.end_time = time()
+        if self.writer is None:
+            return
+        self.args.update(args)
+        self.args["trace_id"] = self.trace_id
+        self.args["span_id"] = self.span_id
+        if self.parent_id:
+            self.args["parent_id"] = self.parent_id
+        self.writer.write(
+            {
+                "name": self.name,
+                "ph": "X",
+                "ts": round(self.start_time * 1e6),
+                "dur": round((self.end_time - self.start_time) * 1e6),
+                "args": self.args,
+            },
+            self.track,
+        )
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.args["error"] = repr(exc)
+        self.end()
+
+
+# spans are only written once configure_tracing is called, ids are propagated regardless
+_writer = None
+
+
+def configure_tracing(service: str, log_dir: str = LOG_DIR) -> str:
+    """Writes the spans of this process to flotilla_<service>.trace.json.
+
+    Returns:
+        str: path of the trace file
+    """
+    global _writer
+    path = get_trace_path(service, log_dir)
+    _writer = TraceWriter(service, path)
+    return path
+
+
+def start_span(name: str, parent=None, track: str = None, **args) -> Span:
+    """Starts a span, a root span of a new trace if "parent" is None.
+
+    Args:
+        parent: parent Span in this process, or the traceparent header of a span in
+            another process
+        track: row of the span in the timeline, the thread that ends it by default
+    """
+    if isinstance(parent, Span):
+        return parent.child(name, track=track, **args)
+    trace_id, parent_id = parse_traceparent(parent) or (None, None)
+    return Span(
+        name,
+        trace_id=trace_id,
+        parent_id=parent_id,
+        track=track,
+        writer=_writer,
+        **args,
+    )
+
+
+def read_trace(path: str) -> list:
+    """Events of a trace file, whether or not its JSON array was closed."""
+    with open(path) as f:
+        text = f.read().strip()
+    if not text:
+        return []
+    if text.startswith("{"):
+        return json.loads(text).get("traceEvents", [])
+    text = text.lstrip("[").rstrip("]").strip().rstrip(",")
+    return json.loads(f"[{text}]")
+
+
+def merge_traces(paths: list, out_path: str) -> int:
+    """Combines the trace files of the server and clients into one timeline. Process
+    ids are renumbered per file, since processes on different hosts can share one.
+
+    Returns:
+        int: number of events written
+    """
+    events = []
+    for file_no, path in enumerate(paths):
+        pids = dict()
+        for event in read_trace(path):
+            if "pid" in event:
+                event["pid"] = pids.setdefault(
+                    (file_no, event["pid"]), (file_no + 1) * 100000 + len(pids)
+                )
+            events.append(event)
+    with open(out_path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Merge flotilla trace files for Perfetto or chrome://tracing"
+    )
+    parser.add_argument("traces", nargs="+", help="*.trace.json files to merge")
+    parser.add_argument("-o", "--output", default="flotilla_trace.json")
+    args = parser.parse_args()
+    count = merge_traces(args.traces, args.output)
+    print(f"merge_traces:: {count} events written to {args.output}")